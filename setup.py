@@ -62,9 +62,12 @@ setup(
         'simplejson',
         'six',
         'sqlalchemy',
+        'transaction',
+        'ZODB',
         'nti.analytics',
         'nti.analytics_database',
         'nti.contenttypes.courses',
+        'nti.ntiids',
 	'nti.dataserver',
         'zope.cachedescriptors',
         'zope.component',
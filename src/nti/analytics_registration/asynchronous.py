@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+An asyncio facade over the registration read API. Python 3 only.
+
+Each call runs in a bounded thread pool, in the zope site of the caller,
+with its own analytics database session that is closed when the call
+finishes. Users and courses are resolved to their ids on the calling
+thread, so no persistent objects are shared with the pool. Returned ORM
+objects are detached: their column values are loaded, as are the
+surveys of user registrations, but other relationships are not
+available.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+import transaction
+
+from six import string_types
+
+from zope.component.hooks import getSite
+from zope.component.hooks import site as current_site
+
+from nti.analytics.database import get_analytics_db
+
+from nti.analytics.identifier import get_ds_id
+
+from nti.analytics_registration.database import registration as db_registration
+
+from nti.contenttypes.courses.interfaces import ICourseCatalogEntry
+
+#: The default number of concurrent database reads.
+DEFAULT_MAX_WORKERS = 8
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def _materialize(result):
+    if result is not None and not isinstance(result, (list, tuple, set, dict)):
+        result = list(result)
+    return result
+
+
+class AsyncRegistrationReader(object):
+    """
+    Awaitable versions of the registration queries. For example::
+
+        reader = AsyncRegistrationReader()
+        rules, sessions = await asyncio.gather(
+            reader.get_registration_rules(ds_id),
+            reader.get_registration_sessions(ds_id))
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers)
+
+    def _call(self, func, *args, **kwargs):
+        site = getSite()
+
+        def run():
+            with current_site(site):
+                db = get_analytics_db()
+                try:
+                    return _materialize(func(*args, **kwargs))
+                finally:
+                    transaction.abort()
+                    db.session.remove()
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, run)
+
+    def get_user_registrations(self, user=None, registration_ds_id=None,
+                               course=None, match_course_rules=True):
+        """
+        Fetch user registrations as in
+        :func:`~.database.registration.get_user_registrations`, with
+        their surveys loaded.
+        """
+        user_ds_id = get_ds_id(user) if user is not None else None
+        course_ntiid = None
+        if course is not None and match_course_rules:
+            course_ntiid = ICourseCatalogEntry(course).ntiid
+        return self._call(db_registration.get_registration_records,
+                          user_ds_id=user_ds_id,
+                          registration_ds_id=registration_ds_id,
+                          course_ntiid=course_ntiid)
+
+    def get_registration_rules(self, *args, **kwargs):
+        return self._call(db_registration.get_registration_rules,
+                          *args, **kwargs)
+
+    def get_registration_sessions(self, *args, **kwargs):
+        return self._call(db_registration.get_registration_sessions,
+                          *args, **kwargs)
+
+    def get_all_survey_questions(self, registration):
+        if not isinstance(registration, string_types):
+            registration = registration.registration_id
+        return self._call(db_registration.get_all_survey_questions,
+                          registration)
+
+    def get_course_registrations(self, courses, registration_ds_id=None,
+                                 match_course_rules=True):
+        """
+        Fetch the user registrations of many courses concurrently,
+        resolving to a list in the order of the given courses.
+        """
+        calls = [self.get_user_registrations(registration_ds_id=registration_ds_id,
+                                             course=course,
+                                             match_course_rules=match_course_rules)
+                 for course in courses]
+        return asyncio.gather(*calls)
+
+    def close(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -8,19 +8,43 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import re
+import time
+import threading
+
+from collections import Counter
+from collections import namedtuple
+
+from weakref import WeakKeyDictionary
+
 import simplejson as json
 
+import transaction
+
 from six import string_types
+from six import integer_types
 
 from sqlalchemy import Text
+from sqlalchemy import Index
 from sqlalchemy import Column
 from sqlalchemy import String
 from sqlalchemy import Integer
 from sqlalchemy import ForeignKey
 
+from sqlalchemy import and_
+from sqlalchemy import func
+from sqlalchemy import exists
+from sqlalchemy import select
+from sqlalchemy import inspect
+
+from sqlalchemy.exc import IntegrityError
+
 from sqlalchemy.ext.declarative import declared_attr
 
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm import subqueryload
+
+from sqlalchemy.orm.util import identity_key
 
 from sqlalchemy.schema import Sequence
 
@@ -29,13 +53,18 @@ from nti.analytics_database.meta_mixins import BaseTableMixin
 from nti.analytics_database import Base
 from nti.analytics_database import NTIID_COLUMN_TYPE
 
+from nti.analytics_database.users import Users
+
 from nti.analytics.database import get_analytics_db
 from nti.analytics.database import resolve_objects
 
 from nti.analytics.database.query_utils import get_filtered_records
 
+from nti.analytics.database.users import create_user
 from nti.analytics.database.users import get_or_create_user
 
+from nti.analytics.identifier import get_ds_id
+
 from nti.analytics_registration.exceptions import NoUserRegistrationException
 from nti.analytics_registration.exceptions import InvalidCourseMappingException
 from nti.analytics_registration.exceptions import DuplicateUserRegistrationException
@@ -45,6 +74,38 @@ from nti.contenttypes.courses.interfaces import ICourseCatalogEntry
 
 COURSE_TITLE_LENGTH = 128
 
+#: Per-item outcomes of the batch store functions.
+STORED = 'stored'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+NOT_REGISTERED = 'not_registered'
+
+#: The counts of rows changed by a diff-based store.
+StoreDiffResult = namedtuple('StoreDiffResult',
+                             ('inserted', 'deleted', 'unchanged'))
+
+#: The natural keys of stored rules and sessions.
+RULE_KEY_COLUMNS = ('school', 'grade_teaching', 'curriculum', 'course_ntiid')
+SESSION_KEY_COLUMNS = ('session_range', 'curriculum', 'course_ntiid')
+
+#: The columns registration counts may be grouped by.
+REGISTRATION_GROUP_COLUMNS = ('school', 'grade_teaching',
+                              'session_range', 'curriculum')
+
+#: strftime style formats of the supported timestamp buckets.
+TIME_BUCKET_FORMATS = {
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m',
+    'year': '%Y',
+}
+
+#: The unique (user_id, registration_id) index of user registrations.
+UNIQUE_REGISTRATION_INDEX = 'ix_user_registrations_user_registration'
+
+#: How often, in seconds, a cached registration value is checked against
+#: the database for changes made by other processes.
+CACHE_CHECK_INTERVAL = 30
+
 logger = __import__('logging').getLogger(__name__)
 
 
@@ -54,12 +115,29 @@ class Registrations(Base):
     """
     __tablename__ = 'Registrations'
 
+    __table_args__ = (
+        Index('ix_registrations_registration_ds_id_unique',
+              'registration_ds_id', unique=True),
+    )
+
     registration_id = Column('registration_id', Integer,
                              Sequence('registration_id_seq'),
                              index=True, nullable=False, primary_key=True)
 
     registration_ds_id = Column('registration_ds_id', String(128),
-                                nullable=False, index=True, autoincrement=False)
+                                nullable=False, autoincrement=False)
+
+    #: Incremented whenever the rules, sessions or (deleted) surveys of
+    #: the registration change; the caches of other processes compare
+    #: against these, since row ids may be reused once rows are deleted.
+    rules_version = Column('rules_version', Integer, nullable=False,
+                           default=0, server_default='0')
+
+    sessions_version = Column('sessions_version', Integer, nullable=False,
+                              default=0, server_default='0')
+
+    surveys_version = Column('surveys_version', Integer, nullable=False,
+                             default=0, server_default='0')
 
     registration_sessions = relationship('RegistrationSessions', lazy="select")
 
@@ -88,6 +166,11 @@ class RegistrationSessions(Base, RegistrationMixin):
     """
     __tablename__ = 'RegistrationSessions'
 
+    __table_args__ = (
+        Index('ix_registration_sessions_session',
+              'registration_id', 'session_range', 'curriculum'),
+    )
+
     registration_session_id = Column('registration_session_id', Integer,
                                      Sequence('registration_session_id_seq'),
                                      index=True, nullable=False, primary_key=True)
@@ -110,6 +193,13 @@ class RegistrationEnrollmentRules(Base, RegistrationMixin):
     """
     __tablename__ = 'RegistrationEnrollmentRules'
 
+    __table_args__ = (
+        Index('ix_registration_rules_course',
+              'registration_id', 'school', 'grade_teaching', 'course_ntiid'),
+        Index('ix_registration_rules_curriculum',
+              'registration_id', 'school', 'grade_teaching', 'curriculum'),
+    )
+
     registration_rule_id = Column('registration_rule_id', Integer,
                                   Sequence('registration_rule_id_seq'),
                                   index=True, nullable=False, primary_key=True)
@@ -131,6 +221,12 @@ class UserRegistrations(Base, BaseTableMixin, RegistrationMixin):
     """
     __tablename__ = 'UserRegistrations'
 
+    # A user may only register once per registration.
+    __table_args__ = (
+        Index(UNIQUE_REGISTRATION_INDEX,
+              'user_id', 'registration_id', unique=True),
+    )
+
     user_registration_id = Column('user_registration_id', Integer,
                                   Sequence('user_registration_id_seq'),
                                   index=True, nullable=False, primary_key=True)
@@ -209,47 +305,492 @@ class RegistrationSurveyDetails(Base):
     @property
     def response(self):
         "For a database response value, transform it into a useable state."
-        response = json.loads(self._response)
-        if isinstance(response, dict):
-            # Convert to int keys, if possible.
-            # We currently do not handle mixed types of keys.
-            try:
-                response = {int(x): y for x, y in response.items()}
-            except ValueError:
-                pass
-        return response
+        raw = self._response
+        cached = self.__dict__.get('_v_response')
+        if cached is None or cached[0] != raw:
+            cached = self._v_response = (raw, decode_response(raw))
+        return cached[1]
 
 
-def get_registration(registration_ds_id):
+class RegistrationSummary(Base, RegistrationMixin):
+    """
+    Registration counts per registration, school, grade, session and
+    curriculum, maintained as registrations are stored and deleted.
+    Missing school and grade values are stored as empty strings.
+    """
+    __tablename__ = 'RegistrationSummary'
+
+    __table_args__ = (
+        Index('ix_registration_summary_key',
+              'registration_id', 'school', 'grade_teaching',
+              'session_range', 'curriculum', unique=True),
+    )
+
+    registration_summary_id = Column('registration_summary_id', Integer,
+                                     Sequence('registration_summary_id_seq'),
+                                     index=True, nullable=False, primary_key=True)
+
+    school = Column('school', String(128), nullable=False, index=False)
+
+    grade_teaching = Column('grade_teaching', String(32),
+                            nullable=False, index=False)
+
+    session_range = Column('session_range', String(32),
+                           nullable=False, index=False)
+
+    curriculum = Column('curriculum', String(COURSE_TITLE_LENGTH),
+                        nullable=False, index=False)
+
+    count = Column('count', Integer, nullable=False, default=0)
+
+
+#: Plain string and int scalars, as written by
+#: :func:`_get_response_str`, that decode without the general decoder.
+#: Strings with escapes or control characters are not plain.
+_INT_PATTERN = re.compile(r'(?:0|[1-9][0-9]*)\Z')
+_STRING_PATTERN = re.compile(r'"[^"\\\x00-\x1f]*"\Z')
+
+
+def decode_response(raw):
+    """
+    Transform a stored response string into a useable value.
+    """
+    if raw is None:
+        return None
+    # Fast paths for the common scalar forms; lists and dicts decode as
+    # quickly with the json C scanner (see the benchmark).
+    if len(raw) < 10 and _INT_PATTERN.match(raw):
+        return int(raw)
+    if raw[:1] == '"' and _STRING_PATTERN.match(raw):
+        return raw[1:-1]
+    response = json.loads(raw)
+    if isinstance(response, dict):
+        # Convert to int keys, if possible.
+        # We currently do not handle mixed types of keys.
+        try:
+            response = {int(x): y for x, y in response.items()}
+        except ValueError:
+            pass
+    return response
+
+
+def decode_responses(raws):
+    """
+    Decode many stored response strings, decoding each distinct value
+    only once.
+    """
+    decoded = {}
+    result = []
+    for raw in raws:
+        try:
+            value = decoded[raw]
+        except KeyError:
+            value = decoded[raw] = decode_response(raw)
+        result.append(value)
+    return result
+
+
+#: The immutable registration_ds_id -> registration_id mapping, per
+#: analytics database.
+_registration_ids = WeakKeyDictionary()
+_registration_ids_lock = threading.Lock()
+
+
+def _get_registration_ids(db):
+    with _registration_ids_lock:
+        result = _registration_ids.get(db)
+        if result is None:
+            result = _registration_ids[db] = {}
+    return result
+
+
+def _query_registration(registration_ds_id, lock=False):
     db = get_analytics_db()
-    registration = db.session.query(Registrations).filter(
+    query = db.session.query(Registrations).filter(
         Registrations.registration_ds_id == registration_ds_id
-    ).first()
+    ).order_by(Registrations.registration_id)
+    if lock:
+        # A locking read sees rows committed after our snapshot.
+        query = query.with_for_update(read=True)
+    return query.first()
+
+
+#: The registrations created by each open transaction, as
+#: {registration_ds_id: registration_id}; cached once it commits.
+_created_registrations = WeakKeyDictionary()
+
+
+def _cache_registration_ids(success, db, created):
+    if success:
+        _get_registration_ids(db).update(created)
+
+
+def get_registration_id(registration_ds_id):
+    """
+    Return the id of the registration, or None. Committed registrations
+    are cached, so this does not query the database for known
+    registrations; prefer it to :func:`get_registration` when only the
+    id is needed.
+    """
+    db = get_analytics_db()
+    registration_ids = _get_registration_ids(db)
+    registration_id = registration_ids.get(registration_ds_id)
+    if registration_id is not None:
+        return registration_id
+    created = _created_registrations.get(transaction.get())
+    if created and registration_ds_id in created:
+        return created[registration_ds_id]
+    registration = _query_registration(registration_ds_id)
+    if registration is None:
+        return None
+    registration_ids[registration_ds_id] = registration.registration_id
+    return registration.registration_id
+
+
+def get_registration(registration_ds_id):
+    """
+    Return the registration record, or None. This loads the record by
+    primary key, which is a (cheap) query unless already loaded in this
+    session.
+    """
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return None
+    db = get_analytics_db()
+    registration = db.session.query(Registrations).get(registration_id)
+    if (registration is None
+            or registration.registration_ds_id != registration_ds_id):
+        # Deleted, e.g. by a test; look it up again.
+        _get_registration_ids(db).pop(registration_ds_id, None)
+        registration = _query_registration(registration_ds_id)
+        if registration is not None:
+            _get_registration_ids(db)[registration_ds_id] = registration.registration_id
     return registration
 
 
+class _CacheEntry(object):
+
+    def __init__(self, version, value, checked):
+        self.version = version
+        self.value = value
+        self.checked = checked
+
+
+#: The cached values changed by each open transaction, as
+#: (cache, registration_id) pairs.
+_pending_changes = WeakKeyDictionary()
+
+
+def _invalidate_changes(success, db, changes):
+    if success:
+        for cache, registration_id in changes:
+            cache.invalidate(registration_id, db=db)
+
+
+class _RegistrationCache(object):
+    """
+    A process-local cache of values built per registration. Entries are
+    keyed by analytics database and registration id, and are rebuilt when
+    the version token read from the database changes. That (cheap) token
+    is checked at most every `check_interval` seconds, so changes made by
+    other processes are picked up within that window.
+
+    Writers call :meth:`changed`; the transaction making the change
+    then builds its own uncached values, and the cached value is
+    invalidated once (and only if) it commits.
+    """
+
+    def __init__(self, version_factory, value_factory,
+                 check_interval=CACHE_CHECK_INTERVAL):
+        self.version_factory = version_factory
+        self.value_factory = value_factory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = WeakKeyDictionary()
+        self._generation = 0
+
+    def _get_entries(self, db=None):
+        db = get_analytics_db() if db is None else db
+        with self._lock:
+            result = self._entries.get(db)
+            if result is None:
+                result = self._entries[db] = {}
+        return result
+
+    def _is_changed(self, registration_id):
+        changes = _pending_changes.get(transaction.get())
+        return bool(changes) and (self, registration_id) in changes
+
+    def get(self, registration_id):
+        if self._is_changed(registration_id):
+            return self.value_factory(registration_id)
+        entries = self._get_entries()
+        entry = entries.get(registration_id)
+        now = time.time()
+        if entry is not None and now - entry.checked < self.check_interval:
+            return entry.value
+        generation = self._generation
+        version = self.version_factory(registration_id)
+        if entry is None or entry.version != version:
+            value = self.value_factory(registration_id)
+            entry = _CacheEntry(version, value, now)
+            with self._lock:
+                # Do not cache values built before a commit invalidated them.
+                if generation == self._generation:
+                    entries[registration_id] = entry
+        entry.checked = now
+        return entry.value
+
+    def changed(self, registration_id):
+        """
+        Note the value of the registration was changed in the current
+        transaction.
+        """
+        txn = transaction.get()
+        changes = _pending_changes.get(txn)
+        if changes is None:
+            changes = _pending_changes[txn] = set()
+            txn.addAfterCommitHook(_invalidate_changes,
+                                   args=(get_analytics_db(), changes))
+        changes.add((self, registration_id))
+
+    def invalidate(self, registration_id=None, db=None):
+        entries = self._get_entries(db)
+        with self._lock:
+            self._generation += 1
+            if registration_id is None:
+                entries.clear()
+            else:
+                entries.pop(registration_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+def _get_version(registration_id, column):
+    db = get_analytics_db()
+    return db.session.query(column).filter(
+        Registrations.registration_id == registration_id
+    ).scalar()
+
+
+def _increment_version(registration_id, column):
+    db = get_analytics_db()
+    db.session.query(Registrations).filter(
+        Registrations.registration_id == registration_id
+    ).update({column: column + 1}, synchronize_session=False)
+
+
+class _RuleIndex(object):
+    """
+    The enrollment rules of a registration, compiled into dict lookups.
+    """
+
+    def __init__(self, rules):
+        #: (school, grade) -> {course_ntiid: curriculum}
+        self.curricula = {}
+        #: (school, grade, curriculum) -> set of course_ntiids
+        self.courses = {}
+        for school, grade, curriculum, course_ntiid in rules:
+            by_course = self.curricula.setdefault((school, grade), {})
+            by_course.setdefault(course_ntiid, curriculum)
+            key = (school, grade, curriculum)
+            self.courses.setdefault(key, set()).add(course_ntiid)
+
+    def get_curriculum(self, school, grade, course_ntiid):
+        return self.curricula.get((school, grade), {}).get(course_ntiid)
+
+    def get_courses(self, school, grade, curriculum):
+        return self.courses.get((school, grade, curriculum), ())
+
+
+def _get_rules_version(registration_id):
+    return _get_version(registration_id, Registrations.rules_version)
+
+
+def _build_rule_index(registration_id):
+    db = get_analytics_db()
+    rules = db.session.query(RegistrationEnrollmentRules.school,
+                             RegistrationEnrollmentRules.grade_teaching,
+                             RegistrationEnrollmentRules.curriculum,
+                             RegistrationEnrollmentRules.course_ntiid).filter(
+        RegistrationEnrollmentRules.registration_id == registration_id
+    ).order_by(RegistrationEnrollmentRules.registration_rule_id)
+    return _RuleIndex(rules)
+
+
+_rule_index_cache = _RegistrationCache(_get_rules_version, _build_rule_index)
+
+
+def _rules_changed(registration_id):
+    _increment_version(registration_id, Registrations.rules_version)
+    _rule_index_cache.changed(registration_id)
+
+
+def get_rule_index(registration_id):
+    """
+    Return the compiled rule index for the given registration id.
+    """
+    return _rule_index_cache.get(registration_id)
+
+
+def _get_sessions_version(registration_id):
+    return _get_version(registration_id, Registrations.sessions_version)
+
+
+def _build_session_index(registration_id):
+    """
+    Map (session_range, curriculum) to the set of course ntiids.
+    """
+    db = get_analytics_db()
+    sessions = db.session.query(RegistrationSessions.session_range,
+                                RegistrationSessions.curriculum,
+                                RegistrationSessions.course_ntiid).filter(
+        RegistrationSessions.registration_id == registration_id)
+    result = {}
+    for session_range, curriculum, course_ntiid in sessions:
+        result.setdefault((session_range, curriculum), set()).add(course_ntiid)
+    return result
+
+
+_session_index_cache = _RegistrationCache(_get_sessions_version,
+                                          _build_session_index)
+
+
+def _sessions_changed(registration_id):
+    _increment_version(registration_id, Registrations.sessions_version)
+    _session_index_cache.changed(registration_id)
+
+
+def _resolve_session(session_index, session_range, curriculum, registration_id):
+    course_ntiids = session_index.get((session_range, curriculum), ())
+    if len(course_ntiids) > 1:
+        # Data issue; return nothing.
+        logger.warning('Multiple course ntiids mapping to session (%s) (%s) (%s)',
+                       session_range, curriculum, registration_id)
+        return None
+    return next(iter(course_ntiids), None)
+
+
+def resolve_session_course(registration_ds_id, session_range, curriculum):
+    """
+    Return the course ntiid the registration sessions map the given
+    session range and curriculum to, or None.
+    """
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return None
+    session_index = _session_index_cache.get(registration_id)
+    return _resolve_session(session_index, session_range, curriculum,
+                            registration_id)
+
+
+def resolve_session_courses(user_registrations):
+    """
+    Return the session course ntiid (or None) for each of the given user
+    registrations, in order.
+    """
+    result = []
+    for user_registration in user_registrations:
+        registration_id = user_registration.registration_id
+        session_index = _session_index_cache.get(registration_id)
+        result.append(_resolve_session(session_index,
+                                       user_registration.session_range,
+                                       user_registration.curriculum,
+                                       registration_id))
+    return result
+
+
 def get_or_create_registration(registration_ds_id):
     registration = get_registration(registration_ds_id)
     if registration is None:
         db = get_analytics_db()
         registration = Registrations(registration_ds_id=registration_ds_id)
-        db.session.add(registration)
+        try:
+            with db.session.begin_nested():
+                db.session.add(registration)
+        except IntegrityError:
+            # Another worker created it concurrently.
+            logger.info('Registration created concurrently (%s)',
+                        registration_ds_id)
+            registration = _query_registration(registration_ds_id, lock=True)
+            _get_registration_ids(db)[registration_ds_id] = registration.registration_id
+        else:
+            # Only cached for other transactions once committed.
+            txn = transaction.get()
+            created = _created_registrations.get(txn)
+            if created is None:
+                created = _created_registrations[txn] = {}
+                txn.addAfterCommitHook(_cache_registration_ids,
+                                       args=(db, created))
+            created[registration_ds_id] = registration.registration_id
     return registration
 
 
-def store_registration_rules(registration_ds_id, rules, truncate=True):
+def _store_diff(table, pk_column, key_columns, registration_id, keys):
+    """
+    Make the stored rows of the registration match the given natural keys,
+    deleting and bulk-inserting only the rows that differ.
+    """
+    db = get_analytics_db()
+    columns = [getattr(table, x) for x in key_columns]
+    existing = db.session.query(pk_column, *columns).filter(
+        table.registration_id == registration_id)
+    wanted = Counter(keys)
+    to_delete = []
+    unchanged = 0
+    for row in existing:
+        key = tuple(row[1:])
+        if wanted[key] > 0:
+            wanted[key] -= 1
+            unchanged += 1
+        else:
+            to_delete.append(row[0])
+    for idx in range(0, len(to_delete), 1000):
+        db.session.query(table).filter(
+            pk_column.in_(to_delete[idx:idx + 1000])
+        ).delete(synchronize_session=False)
+    mappings = []
+    for key in wanted.elements():
+        mapping = dict(zip(key_columns, key))
+        mapping['registration_id'] = registration_id
+        mappings.append(mapping)
+    if mappings:
+        db.session.bulk_insert_mappings(table, mappings)
+    return StoreDiffResult(len(mappings), len(to_delete), unchanged)
+
+
+def store_registration_rules(registration_ds_id, rules, truncate=True, diff=False):
     """
     Store the given registration rules, optionally truncating previous data.
     No validation is done here.
+
+    With `diff`, the stored rules are instead made to match the given
+    rules by natural key, only the changed rows are written and a
+    :class:`StoreDiffResult` is returned.
     """
     db = get_analytics_db()
     registration = get_or_create_registration(registration_ds_id)
+    if diff:
+        keys = [(x.school, x.grade, x.curriculum, x.course_ntiid) for x in rules]
+        result = _store_diff(RegistrationEnrollmentRules,
+                             RegistrationEnrollmentRules.registration_rule_id,
+                             RULE_KEY_COLUMNS,
+                             registration.registration_id,
+                             keys)
+        logger.info('Updated RegistrationEnrollmentRules (%s) (%s)',
+                    registration_ds_id, result)
+        _rules_changed(registration.registration_id)
+        return result
     if truncate:
         deleted_count = db.session.query(RegistrationEnrollmentRules).filter(
             RegistrationEnrollmentRules.registration_id == registration.registration_id
         ).delete()
         logger.info('Deleted RegistrationEnrollmentRules (%s) (%s)',
                     registration_ds_id, deleted_count)
+    count = 0
     for rule in rules:
         rule_record = RegistrationEnrollmentRules(school=rule.school,
                                                   curriculum=rule.curriculum,
@@ -257,28 +798,193 @@ def store_registration_rules(registration_ds_id, rules, truncate=True):
                                                   course_ntiid=rule.course_ntiid)
         rule_record._registration_record = registration
         db.session.add(rule_record)
-    return len(rules)
+        count += 1
+    _rules_changed(registration.registration_id)
+    return count
 
 
-def store_registration_sessions(registration_ds_id, sessions, truncate=True):
+def append_registration_rules(registration_ds_id, rules):
+    """
+    Bulk insert the given rules, keeping any previously stored rules,
+    and return the number inserted.
+    """
+    db = get_analytics_db()
+    registration = get_or_create_registration(registration_ds_id)
+    mappings = [{'registration_id': registration.registration_id,
+                 'school': x.school,
+                 'grade_teaching': x.grade,
+                 'curriculum': x.curriculum,
+                 'course_ntiid': x.course_ntiid} for x in rules]
+    if mappings:
+        db.session.bulk_insert_mappings(RegistrationEnrollmentRules, mappings)
+    _rules_changed(registration.registration_id)
+    return len(mappings)
+
+
+def store_registration_sessions(registration_ds_id, sessions, truncate=True, diff=False):
     """
     Store the given registration sessions, optionally truncating previous data.
     No validation is done here.
+
+    With `diff`, the stored sessions are instead made to match the given
+    sessions by natural key, only the changed rows are written and a
+    :class:`StoreDiffResult` is returned.
     """
     db = get_analytics_db()
     registration = get_or_create_registration(registration_ds_id)
+    if diff:
+        keys = [(x.session_range, x.curriculum, x.course_ntiid) for x in sessions]
+        result = _store_diff(RegistrationSessions,
+                             RegistrationSessions.registration_session_id,
+                             SESSION_KEY_COLUMNS,
+                             registration.registration_id,
+                             keys)
+        logger.info('Updated RegistrationSessions (%s) (%s)',
+                    registration_ds_id, result)
+        _sessions_changed(registration.registration_id)
+        return result
     if truncate:
         deleted_count = db.session.query(RegistrationSessions).filter(
             RegistrationSessions.registration_id == registration.registration_id).delete()
         logger.info('Deleted RegistrationSessions (%s) (%s)',
                     registration_ds_id, deleted_count)
+    count = 0
     for session in sessions:
         session_record = RegistrationSessions(session_range=session.session_range,
                                               curriculum=session.curriculum,
                                               course_ntiid=session.course_ntiid)
         session_record._registration_record = registration
         db.session.add(session_record)
-    return len(sessions)
+        count += 1
+    _sessions_changed(registration.registration_id)
+    return count
+
+
+def append_registration_sessions(registration_ds_id, sessions):
+    """
+    Bulk insert the given sessions, keeping any previously stored
+    sessions, and return the number inserted.
+    """
+    db = get_analytics_db()
+    registration = get_or_create_registration(registration_ds_id)
+    mappings = [{'registration_id': registration.registration_id,
+                 'session_range': x.session_range,
+                 'curriculum': x.curriculum,
+                 'course_ntiid': x.course_ntiid} for x in sessions]
+    if mappings:
+        db.session.bulk_insert_mappings(RegistrationSessions, mappings)
+    _sessions_changed(registration.registration_id)
+    return len(mappings)
+
+
+def _summary_key(school, grade_teaching, session_range, curriculum):
+    return (school or '', grade_teaching or '', session_range, curriculum)
+
+
+def _update_summary(registration_id, deltas):
+    """
+    Apply the given {summary key: count delta} changes to the summary
+    table, in the current transaction.
+    """
+    db = get_analytics_db()
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        school, grade_teaching, session_range, curriculum = key
+        query = db.session.query(RegistrationSummary).filter(
+            RegistrationSummary.registration_id == registration_id,
+            RegistrationSummary.school == school,
+            RegistrationSummary.grade_teaching == grade_teaching,
+            RegistrationSummary.session_range == session_range,
+            RegistrationSummary.curriculum == curriculum)
+        values = {RegistrationSummary.count: RegistrationSummary.count + delta}
+        if query.update(values, synchronize_session=False) or delta < 0:
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.execute(RegistrationSummary.__table__.insert().values(
+                    registration_id=registration_id,
+                    school=school,
+                    grade_teaching=grade_teaching,
+                    session_range=session_range,
+                    curriculum=curriculum,
+                    count=delta))
+        except IntegrityError:
+            # Inserted concurrently.
+            query.update(values, synchronize_session=False)
+
+
+def get_registration_summary(registration_ds_id):
+    """
+    Return the maintained (school, grade_teaching, session_range,
+    curriculum, count) registration counts for the registration.
+    """
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return []
+    db = get_analytics_db()
+    rows = db.session.query(RegistrationSummary.school,
+                            RegistrationSummary.grade_teaching,
+                            RegistrationSummary.session_range,
+                            RegistrationSummary.curriculum,
+                            RegistrationSummary.count).filter(
+        RegistrationSummary.registration_id == registration_id,
+        RegistrationSummary.count > 0
+    ).order_by(RegistrationSummary.school,
+               RegistrationSummary.grade_teaching,
+               RegistrationSummary.session_range,
+               RegistrationSummary.curriculum)
+    return [tuple(x) for x in rows]
+
+
+def rebuild_registration_summary(registration_ds_id=None, chunk_size=10000):
+    """
+    Recompute the summary table from the user registrations of the given
+    (or every) registration, reading `chunk_size` id ranges at a time.
+    """
+    db = get_analytics_db()
+    if registration_ds_id:
+        registration_id = get_registration_id(registration_ds_id)
+        registration_ids = [registration_id] if registration_id is not None else ()
+    else:
+        registration_ids = [x[0] for x in db.session.query(Registrations.registration_id)]
+    for registration_id in registration_ids:
+        low, high = db.session.query(func.min(UserRegistrations.user_registration_id),
+                                     func.max(UserRegistrations.user_registration_id)).filter(
+            UserRegistrations.registration_id == registration_id).one()
+        counts = Counter()
+        start = (low or 1) - 1
+        while high is not None and start < high:
+            rows = db.session.query(UserRegistrations.school,
+                                    UserRegistrations.grade_teaching,
+                                    UserRegistrations.session_range,
+                                    UserRegistrations.curriculum,
+                                    func.count(UserRegistrations.user_registration_id)).filter(
+                UserRegistrations.registration_id == registration_id,
+                UserRegistrations.user_registration_id > start,
+                UserRegistrations.user_registration_id <= start + chunk_size
+            ).group_by(UserRegistrations.school,
+                       UserRegistrations.grade_teaching,
+                       UserRegistrations.session_range,
+                       UserRegistrations.curriculum)
+            for school, grade_teaching, session_range, curriculum, count in rows:
+                counts[_summary_key(school, grade_teaching,
+                                    session_range, curriculum)] += count
+            start += chunk_size
+        db.session.query(RegistrationSummary).filter(
+            RegistrationSummary.registration_id == registration_id
+        ).delete(synchronize_session=False)
+        mappings = []
+        for key, count in counts.items():
+            mapping = dict(zip(('school', 'grade_teaching',
+                                'session_range', 'curriculum'), key))
+            mapping['registration_id'] = registration_id
+            mapping['count'] = count
+            mappings.append(mapping)
+        if mappings:
+            db.session.bulk_insert_mappings(RegistrationSummary, mappings)
+        logger.info('Rebuilt registration summary (%s) (%s)',
+                    registration_id, len(mappings))
 
 
 def _validate_registration(registration_id, registration_ds_id, data):
@@ -286,35 +992,65 @@ def _validate_registration(registration_id, registration_ds_id, data):
     Validate we received a correct registration mapping to a course,
     returning the curriculum.
     """
-    db = get_analytics_db()
     school = data.school
     grade_teaching = data.grade_teaching
     course_ntiid = data.course_ntiid
-    rule = db.session.query(RegistrationEnrollmentRules).filter(
-        RegistrationEnrollmentRules.registration_id == registration_id,
-        RegistrationEnrollmentRules.school == school,
-        RegistrationEnrollmentRules.grade_teaching == grade_teaching,
-        RegistrationEnrollmentRules.course_ntiid == course_ntiid
-    ).first()
-    if rule is None:
+    rule_index = get_rule_index(registration_id)
+    curriculum = rule_index.get_curriculum(school, grade_teaching, course_ntiid)
+    if curriculum is None:
         logger.info('No mapping for %s (school=%s) (grade=%s) (ntiid=%s)',
                     registration_ds_id, school, grade_teaching, course_ntiid)
         raise InvalidCourseMappingException()
-    return rule.curriculum
+    return curriculum
+
+
+def _is_registered(user_id, registration_id):
+    """
+    Whether the user has registered for the registration; a locking read,
+    so registrations committed after our snapshot are seen.
+    """
+    db = get_analytics_db()
+    query = db.session.query(UserRegistrations.user_registration_id).filter(
+        UserRegistrations.user_id == user_id,
+        UserRegistrations.registration_id == registration_id
+    ).with_for_update(read=True)
+    return query.first() is not None
+
+
+#: Whether each analytics database has the unique registration index,
+#: which evolve4 does not add while duplicate registrations exist.
+_unique_registration_index = WeakKeyDictionary()
+
+
+def _has_unique_registration_index(db):
+    result = _unique_registration_index.get(db)
+    if result is None:
+        indexes = inspect(db.engine).get_indexes(UserRegistrations.__tablename__)
+        result = any(x['name'] == UNIQUE_REGISTRATION_INDEX and x['unique']
+                     for x in indexes)
+        if not result:
+            logger.warning('Missing unique registration index (%s)',
+                           UNIQUE_REGISTRATION_INDEX)
+        _unique_registration_index[db] = result
+    return result
 
 
 def store_registration_data(user, timestamp, session_id, registration_ds_id, data):
     """
-    Store user registration data.
+    Store user registration data. Duplicates are detected by the
+    unique (user_id, registration_id) index, or by querying if the
+    index does not exist.
     """
-    if get_user_registrations(user, registration_ds_id):
-        raise DuplicateUserRegistrationException()
     registration = get_or_create_registration(registration_ds_id)
     curriculum = _validate_registration(registration.registration_id,
                                         registration_ds_id,
                                         data)
     db = get_analytics_db()
     user = get_or_create_user(user)
+    registration_id = registration.registration_id
+    if (not _has_unique_registration_index(db)
+            and _is_registered(user.user_id, registration_id)):
+        raise DuplicateUserRegistrationException()
     user_registration = UserRegistrations(timestamp=timestamp,
                                           session_id=session_id,
                                           school=data.school,
@@ -325,40 +1061,314 @@ def store_registration_data(user, timestamp, session_id, registration_ds_id, dat
                                           session_range=data.session_range)
     user_registration._registration_record = registration
     user_registration._user_record = user
-    db.session.add(user_registration)
+    try:
+        with db.session.begin_nested():
+            db.session.add(user_registration)
+    except IntegrityError:
+        # Only a violation of the unique index is a duplicate.
+        if not _is_registered(user.user_id, registration_id):
+            raise
+        raise DuplicateUserRegistrationException()
+    key = _summary_key(data.school, data.grade_teaching,
+                       data.session_range, curriculum)
+    _update_summary(registration_id, {key: 1})
+
+
+def _create_users(users_by_ds_id):
+    """
+    Create the missing user records of the given {ds_id: user} with
+    :func:`create_user`, so they are written just as when created one
+    request at a time, returning their {ds_id: user_id}. All are created
+    in a single savepoint; if some were created concurrently, the rest
+    are created one at a time.
+    """
+    db = get_analytics_db()
+    result = {}
+    try:
+        with db.session.begin_nested():
+            records = {ds_id: create_user(user)
+                       for ds_id, user in users_by_ds_id.items()}
+        return {ds_id: x.user_id for ds_id, x in records.items()}
+    except IntegrityError:
+        logger.info('Users created concurrently (%s)', len(users_by_ds_id))
+    for ds_id, user in users_by_ds_id.items():
+        try:
+            with db.session.begin_nested():
+                result[ds_id] = create_user(user).user_id
+        except IntegrityError:
+            pass
+    missing = [x for x in users_by_ds_id if x not in result]
+    if missing:
+        # A locking read sees rows committed after our snapshot.
+        rows = db.session.query(Users.user_ds_id, Users.user_id).filter(
+            Users.user_ds_id.in_(missing)
+        ).with_for_update(read=True)
+        result.update(rows)
+    return result
+
+
+def _get_user_ids(users, create=True):
+    """
+    Map each of the given users to its analytics user id, fetching the
+    existing user records in one query and creating the missing ones
+    (users without a record are omitted if `create` is False).
+    """
+    db = get_analytics_db()
+    ds_ids = {}
+    for user in users:
+        ds_ids[user] = get_ds_id(user)
+    existing = {}
+    lookup_ids = {x for x in ds_ids.values() if x is not None}
+    if lookup_ids:
+        rows = db.session.query(Users.user_ds_id, Users.user_id).filter(
+            Users.user_ds_id.in_(lookup_ids))
+        existing = dict(rows)
+    missing = {ds_id: user for user, ds_id in ds_ids.items()
+               if ds_id is not None and ds_id not in existing}
+    if missing and create:
+        existing.update(_create_users(missing))
+    result = {}
+    for user, ds_id in ds_ids.items():
+        user_id = existing.get(ds_id)
+        if user_id is None:
+            if not create:
+                continue
+            user_id = get_or_create_user(user).user_id
+        result[user] = user_id
+    return result
+
+
+def _insert_user_registrations(mappings):
+    """
+    Bulk insert the given user registration rows, returning the ones
+    stored. If some users registered concurrently, the rows are instead
+    inserted one at a time and those duplicates skipped.
+    """
+    db = get_analytics_db()
+    try:
+        with db.session.begin_nested():
+            db.session.bulk_insert_mappings(UserRegistrations, mappings)
+        return mappings
+    except IntegrityError:
+        logger.info('Registrations stored concurrently (%s)', len(mappings))
+    result = []
+    table = UserRegistrations.__table__
+    for mapping in mappings:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(**mapping))
+        except IntegrityError:
+            if not _is_registered(mapping['user_id'],
+                                  mapping['registration_id']):
+                raise
+        else:
+            result.append(mapping)
+    return result
+
+
+def store_registration_data_batch(registration_ds_id, items):
+    """
+    Store many user registrations at once. Each item is a tuple of
+    (user, timestamp, session_id, data). Rather than raising on the first
+    bad item, a list of outcomes (:const:`STORED`, :const:`DUPLICATE` or
+    :const:`INVALID`) is returned, in the order of the given items.
+    """
+    items = list(items)
+    result = [None] * len(items)
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        # No registration means no rules to validate against.
+        logger.info('No registration for batch (%s) (%s)',
+                    registration_ds_id, len(items))
+        return [INVALID] * len(items)
+
+    rule_index = get_rule_index(registration_id)
+    user_ids = _get_user_ids({item[0] for item in items})
+
+    db = get_analytics_db()
+    registered = set()
+    if user_ids:
+        rows = db.session.query(UserRegistrations.user_id).filter(
+            UserRegistrations.registration_id == registration_id,
+            UserRegistrations.user_id.in_(set(user_ids.values())))
+        registered.update(x[0] for x in rows)
+
+    mappings = []
+    for idx, (user, timestamp, session_id, data) in enumerate(items):
+        user_id = user_ids[user]
+        if user_id in registered:
+            result[idx] = DUPLICATE
+            continue
+        curriculum = rule_index.get_curriculum(data.school,
+                                               data.grade_teaching,
+                                               data.course_ntiid)
+        if curriculum is None:
+            logger.info('No mapping for %s (school=%s) (grade=%s) (ntiid=%s)',
+                        registration_ds_id, data.school,
+                        data.grade_teaching, data.course_ntiid)
+            result[idx] = INVALID
+            continue
+        # Guard against the same user appearing twice in this batch.
+        registered.add(user_id)
+        mappings.append({'user_id': user_id,
+                         'timestamp': timestamp,
+                         'session_id': session_id,
+                         'registration_id': registration_id,
+                         'school': data.school,
+                         'grade_teaching': data.grade_teaching,
+                         'phone': data.phone,
+                         'curriculum': curriculum,
+                         'employee_id': data.employee_id,
+                         'session_range': data.session_range})
+        result[idx] = STORED
+    if mappings:
+        stored = _insert_user_registrations(mappings)
+        if len(stored) != len(mappings):
+            stored_ids = {x['user_id'] for x in stored}
+            for idx, (user, unused_ts, unused_sid, unused_data) in enumerate(items):
+                if result[idx] == STORED and user_ids[user] not in stored_ids:
+                    result[idx] = DUPLICATE
+        mappings = stored
+        deltas = Counter(_summary_key(x['school'], x['grade_teaching'],
+                                      x['session_range'], x['curriculum'])
+                         for x in mappings)
+        _update_summary(registration_id, deltas)
+    logger.info('Stored registration batch (%s) (stored=%s) (total=%s)',
+                registration_ds_id, len(mappings), len(items))
+    return result
 
 
 def _get_response_str(response):
     return json.dumps(response)
 
 
+def _expire_survey_submissions(user_registration_ids):
+    """
+    Expire the survey relationship of any of the given registrations
+    already loaded in the session, since bulk inserts bypass the ORM.
+    """
+    session = get_analytics_db().session
+    for user_registration_id in user_registration_ids:
+        key = identity_key(UserRegistrations, user_registration_id)
+        user_registration = session.identity_map.get(key)
+        if user_registration is not None:
+            session.expire(user_registration, ['survey_submission'])
+
+
+def _probe_registrations(registration_id, user_ids):
+    """
+    In a single query, map each of the given users to their registration
+    id and return it with the set of registration ids with a survey.
+    """
+    db = get_analytics_db()
+    rows = db.session.query(UserRegistrations.user_id,
+                            UserRegistrations.user_registration_id,
+                            RegistrationSurveysTaken.registration_survey_taken_id).outerjoin(
+        RegistrationSurveysTaken,
+        RegistrationSurveysTaken.user_registration_id == UserRegistrations.user_registration_id
+    ).filter(
+        UserRegistrations.registration_id == registration_id,
+        UserRegistrations.user_id.in_(user_ids)
+    ).order_by(UserRegistrations.user_registration_id)
+    user_registration_ids = {}
+    surveyed = set()
+    for user_id, user_registration_id, survey_taken_id in rows:
+        first_id = user_registration_ids.setdefault(user_id,
+                                                    user_registration_id)
+        if survey_taken_id is not None and first_id == user_registration_id:
+            surveyed.add(user_registration_id)
+    return user_registration_ids, surveyed
+
+
+def get_registration_status(user, registration_ds_id):
+    """
+    Return whether the user has registered for, and submitted the
+    survey of, the registration, as a tuple of booleans.
+    """
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return False, False
+    user_id = _get_user_ids((user,), create=False).get(user)
+    if user_id is None:
+        return False, False
+    user_registration_ids, surveyed = _probe_registrations(registration_id,
+                                                           (user_id,))
+    user_registration_id = user_registration_ids.get(user_id)
+    return user_registration_id is not None, user_registration_id in surveyed
+
+
+def store_registration_survey_data_batch(registration_ds_id, items):
+    """
+    Store many user surveys at once. Each item is a tuple of
+    (user, timestamp, session_id, version, data). Returns a list of
+    outcomes (:const:`STORED`, :const:`DUPLICATE` or
+    :const:`NOT_REGISTERED`), in the order of the given items.
+    """
+    items = list(items)
+    result = [NOT_REGISTERED] * len(items)
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return result
+    user_ids = _get_user_ids({item[0] for item in items}, create=False)
+    if not user_ids:
+        return result
+
+    db = get_analytics_db()
+    user_registration_ids, surveyed = _probe_registrations(registration_id,
+                                                           set(user_ids.values()))
+    surveys = []
+    details = []
+    for idx, (user, timestamp, session_id, version, data) in enumerate(items):
+        user_registration_id = user_registration_ids.get(user_ids.get(user))
+        if user_registration_id is None:
+            continue
+        if user_registration_id in surveyed:
+            result[idx] = DUPLICATE
+            continue
+        surveyed.add(user_registration_id)
+        surveys.append({'user_id': user_ids[user],
+                        'timestamp': timestamp,
+                        'session_id': session_id,
+                        'survey_version': version,
+                        'user_registration_id': user_registration_id})
+        details.append((user_registration_id, data))
+        result[idx] = STORED
+
+    if surveys:
+        db.session.bulk_insert_mappings(RegistrationSurveysTaken, surveys)
+        stored_ids = [x[0] for x in details]
+        survey_ids = dict(db.session.query(RegistrationSurveysTaken.user_registration_id,
+                                           RegistrationSurveysTaken.registration_survey_taken_id).filter(
+            RegistrationSurveysTaken.user_registration_id.in_(stored_ids)))
+        detail_mappings = []
+        for user_registration_id, data in details:
+            survey_taken_id = survey_ids[user_registration_id]
+            for key, value in data.items():
+                detail_mappings.append({'registration_survey_taken_id': survey_taken_id,
+                                        'question_id': key,
+                                        '_response': _get_response_str(value)})
+        if detail_mappings:
+            db.session.bulk_insert_mappings(RegistrationSurveyDetails,
+                                            detail_mappings)
+        _expire_survey_submissions(stored_ids)
+        _survey_questions_cache.changed(registration_id)
+    logger.info('Stored survey batch (%s) (stored=%s) (total=%s)',
+                registration_ds_id, len(surveys), len(items))
+    return result
+
+
 def store_registration_survey_data(user, timestamp, session_id, registration_ds_id, version, data):
     """
     Store user survey data.
     """
-    user_registrations = get_user_registrations(user, registration_ds_id)
-    if not user_registrations:
+    item = (user, timestamp, session_id, version, data)
+    outcome = store_registration_survey_data_batch(registration_ds_id,
+                                                   (item,))[0]
+    if outcome == NOT_REGISTERED:
         raise NoUserRegistrationException()
-    user_registration = user_registrations[0]
-    if user_registration.survey_submission:
+    if outcome == DUPLICATE:
         raise DuplicateRegistrationSurveyException()
 
-    user_reg_id = user_registration.user_registration_id
-    db = get_analytics_db()
-    user = get_or_create_user(user)
-    survey_submission = RegistrationSurveysTaken(timestamp=timestamp,
-                                                 session_id=session_id,
-                                                 survey_version=version,
-                                                 user_registration_id=user_reg_id)
-    survey_submission._user_record = user
-    db.session.add(survey_submission)
-    for key, value in data.items():
-        response = _get_response_str(value)
-        survey_detail = RegistrationSurveyDetails(question_id=key,
-                                                  _response=response)
-        survey_detail._survey_record = survey_submission
-        db.session.add(survey_detail)
-
 
 def _resolve_registration(row, user=None):
     if user is not None:
@@ -366,72 +1376,468 @@ def _resolve_registration(row, user=None):
     return row
 
 
-def get_user_registrations(user=None, registration_ds_id=None, course=None, **kwargs):
+def _course_rule_filter(course):
+    """
+    A filter matching user registrations whose rules map them to the
+    given course.
+    """
+    return _course_ntiid_filter(ICourseCatalogEntry(course).ntiid)
+
+
+def _course_ntiid_filter(course_ntiid):
+    return exists().where(and_(
+        RegistrationEnrollmentRules.registration_id == UserRegistrations.registration_id,
+        RegistrationEnrollmentRules.school == UserRegistrations.school,
+        RegistrationEnrollmentRules.grade_teaching == UserRegistrations.grade_teaching,
+        RegistrationEnrollmentRules.course_ntiid == course_ntiid))
+
+
+def get_user_registrations(user=None, registration_ds_id=None, course=None,
+                           match_course_rules=True, **kwargs):
     """
     Get all registrations, optionally by user and/or registration_id.
+
+    If a course is given, only registrations the rules map to that course
+    are returned. Since some users are manually placed in courses, this
+    can be turned off with `match_course_rules`.
     """
-    filters = ()
+    filters = []
     if registration_ds_id:
-        registration = get_registration(registration_ds_id)
-        if registration is None:
+        registration_id = get_registration_id(registration_ds_id)
+        if registration_id is None:
             return ()
-        filters = (UserRegistrations.registration_id ==
-                   registration.registration_id,)
+        filters.append(UserRegistrations.registration_id ==
+                       registration_id)
+    if course is not None and match_course_rules:
+        filters.append(_course_rule_filter(course))
     results = get_filtered_records(
-        user, UserRegistrations, filters=filters, **kwargs)
+        user, UserRegistrations, filters=tuple(filters), **kwargs)
     user_registrations = resolve_objects(
         _resolve_registration, results, user=user)
-    # Rethink this filtering, some users are manually placed in courses.
-    if course is not None and False:
-        entry = ICourseCatalogEntry(course)
-        course_ntiid = entry.ntiid
-        db = get_analytics_db()
-        # Exclude registrations not mapped to our course
-        # We could make this easier...
-
-        def _do_include(user_registration):
-            rule_for_course = db.session.query(RegistrationEnrollmentRules).filter(
-                RegistrationEnrollmentRules.registration_id == user_registration.registration_id,
-                RegistrationEnrollmentRules.school == user_registration.school,
-                RegistrationEnrollmentRules.grade_teaching == user_registration.grade_teaching,
-                RegistrationEnrollmentRules.course_ntiid == course_ntiid
-            ).first()
-            return rule_for_course is not None
-        user_registrations = [x for x in user_registrations if _do_include(x)]
     return user_registrations
 
 
-def get_all_survey_questions(registration):
+def _get_surveys_version(registration_id):
+    """
+    A cheap token that changes whenever a survey is stored for or deleted
+    from the registration: stored surveys always increase the count, and
+    deletes increment the surveys version. Storing surveys leaves the
+    version alone, so concurrent submissions do not contend for the
+    registration row.
+    """
+    db = get_analytics_db()
+    version = db.session.query(func.count(RegistrationSurveysTaken.registration_survey_taken_id),
+                               func.max(RegistrationSurveysTaken.registration_survey_taken_id)).join(
+        UserRegistrations,
+        UserRegistrations.user_registration_id == RegistrationSurveysTaken.user_registration_id
+    ).filter(
+        UserRegistrations.registration_id == registration_id
+    ).one()
+    surveys_version = _get_version(registration_id,
+                                   Registrations.surveys_version)
+    return (surveys_version,) + tuple(version)
+
+
+def _build_survey_questions(registration_id):
+    db = get_analytics_db()
+    questions = db.session.query(RegistrationSurveyDetails.question_id).join(
+        RegistrationSurveysTaken,
+        RegistrationSurveysTaken.registration_survey_taken_id == RegistrationSurveyDetails.registration_survey_taken_id
+    ).join(
+        UserRegistrations,
+        UserRegistrations.user_registration_id == RegistrationSurveysTaken.user_registration_id
+    ).filter(
+        UserRegistrations.registration_id == registration_id
+    ).distinct()
+    return frozenset(x[0] for x in questions)
+
+
+_survey_questions_cache = _RegistrationCache(_get_surveys_version,
+                                             _build_survey_questions)
+
+
+def _surveys_deleted(registration_id):
+    _increment_version(registration_id, Registrations.surveys_version)
+    _survey_questions_cache.changed(registration_id)
+
+
+def get_user_registrations_page(registration_ds_id=None, user=None, after=None,
+                                page_size=1000, start_time=None, end_time=None,
+                                resolve=True):
+    """
+    Get a page of registrations, optionally by user and/or registration id
+    and within a timestamp window, ordered by user_registration_id. Pages
+    are keyed on that id: pass the returned key as `after` to get the
+    next page. Returns a (registrations, next key) tuple; the key is None
+    after the last page.
+    """
+    db = get_analytics_db()
+    query = db.session.query(UserRegistrations)
+    if registration_ds_id:
+        registration_id = get_registration_id(registration_ds_id)
+        if registration_id is None:
+            return (), None
+        query = query.filter(UserRegistrations.registration_id ==
+                             registration_id)
+    if user is not None:
+        user_id = _get_user_ids((user,), create=False).get(user)
+        if user_id is None:
+            return (), None
+        query = query.filter(UserRegistrations.user_id == user_id)
+    if start_time is not None:
+        query = query.filter(UserRegistrations.timestamp >= start_time)
+    if end_time is not None:
+        query = query.filter(UserRegistrations.timestamp <= end_time)
+    if after is not None:
+        query = query.filter(UserRegistrations.user_registration_id > after)
+    records = query.order_by(UserRegistrations.user_registration_id).limit(page_size).all()
+    next_key = records[-1].user_registration_id if len(records) == page_size else None
+    if resolve:
+        records = resolve_objects(_resolve_registration, records, user=user)
+    return records, next_key
+
+
+def iter_user_registrations(registration_ds_id=None, user=None, page_size=1000,
+                            start_time=None, end_time=None, resolve=True):
+    """
+    Iterate over registrations with bounded memory, fetching `page_size`
+    rows at a time. See :func:`get_user_registrations_page`.
+    """
+    after = None
+    while True:
+        records, after = get_user_registrations_page(registration_ds_id,
+                                                     user=user,
+                                                     after=after,
+                                                     page_size=page_size,
+                                                     start_time=start_time,
+                                                     end_time=end_time,
+                                                     resolve=resolve)
+        for record in records:
+            yield record
+        if after is None:
+            break
+
+
+def _time_bucket(column, bucket, dialect):
+    fmt = TIME_BUCKET_FORMATS[bucket]
+    if dialect == 'sqlite':
+        return func.strftime(fmt, column)
+    # MySQL uses the same format specifiers.
+    return func.date_format(column, fmt)
+
+
+def get_registration_counts(registration_ds_id, group_by=('school',),
+                            time_bucket=None, by_course=False,
+                            start_time=None, end_time=None):
+    """
+    Count the registrations of the registration in the database, grouped
+    by the given :const:`REGISTRATION_GROUP_COLUMNS`. Optionally also
+    group by a `time_bucket` ('day', 'month' or 'year') of the timestamp
+    and by the course ntiid the rules map each registration to.
+
+    Returns a list of tuples of the group values (then the bucket and
+    course ntiid, if requested) followed by the count, ordered by group.
+    """
+    for name in group_by:
+        if name not in REGISTRATION_GROUP_COLUMNS:
+            raise ValueError('Invalid group column %s' % name)
+    if time_bucket is not None and time_bucket not in TIME_BUCKET_FORMATS:
+        raise ValueError('Invalid time bucket %s' % time_bucket)
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return []
+    db = get_analytics_db()
+    groups = [getattr(UserRegistrations, x) for x in group_by]
+    if time_bucket is not None:
+        groups.append(_time_bucket(UserRegistrations.timestamp,
+                                   time_bucket, db.engine.name))
+    if by_course:
+        groups.append(RegistrationEnrollmentRules.course_ntiid)
+    count = func.count(UserRegistrations.user_registration_id.distinct())
+    query = db.session.query(*(groups + [count]))
+    if by_course:
+        query = query.outerjoin(
+            RegistrationEnrollmentRules,
+            (RegistrationEnrollmentRules.registration_id == UserRegistrations.registration_id)
+            & (RegistrationEnrollmentRules.school == UserRegistrations.school)
+            & (RegistrationEnrollmentRules.grade_teaching == UserRegistrations.grade_teaching)
+            & (RegistrationEnrollmentRules.curriculum == UserRegistrations.curriculum))
+    query = query.filter(UserRegistrations.registration_id ==
+                         registration_id)
+    if start_time is not None:
+        query = query.filter(UserRegistrations.timestamp >= start_time)
+    if end_time is not None:
+        query = query.filter(UserRegistrations.timestamp <= end_time)
+    if groups:
+        query = query.group_by(*groups).order_by(*groups)
+    return [tuple(x) for x in query]
+
+
+def get_user_registrations_by_user(users, registration_ds_id=None, course=None,
+                                   match_course_rules=True):
+    """
+    Return a map of each of the given users to their registrations, with
+    surveys and survey details eagerly loaded, in a constant number of
+    queries. The course arguments are as in :func:`get_user_registrations`.
+    """
+    result = {user: [] for user in users}
+    user_ids = _get_user_ids(result, create=False)
+    if not user_ids:
+        return result
+    db = get_analytics_db()
+    query = db.session.query(UserRegistrations).filter(
+        UserRegistrations.user_id.in_(set(user_ids.values()))
+    ).options(
+        subqueryload(UserRegistrations.survey_submission).subqueryload(RegistrationSurveysTaken.details)
+    ).order_by(UserRegistrations.user_registration_id)
+    if registration_ds_id:
+        registration_id = get_registration_id(registration_ds_id)
+        if registration_id is None:
+            return result
+        query = query.filter(UserRegistrations.registration_id ==
+                             registration_id)
+    if course is not None and match_course_rules:
+        query = query.filter(_course_rule_filter(course))
+    users_by_id = {v: k for k, v in user_ids.items()}
+    for record in query:
+        user = users_by_id[record.user_id]
+        result[user].append(_resolve_registration(record, user))
+    return result
+
+
+def get_registration_records(user_ds_id=None, registration_ds_id=None,
+                             course_ntiid=None):
+    """
+    Return the user registrations, optionally by user ds id,
+    registration id and the course ntiid the rules map them to, with
+    surveys and survey details eagerly loaded. Takes and returns only
+    plain values and fully loaded rows, for callers without access to
+    the user or course objects.
     """
-    Given a registration, return all survey questions we know about
-    for that registration id.
+    db = get_analytics_db()
+    query = db.session.query(UserRegistrations).options(
+        subqueryload(UserRegistrations.survey_submission).subqueryload(RegistrationSurveysTaken.details)
+    )
+    if user_ds_id is not None:
+        query = query.join(
+            Users, Users.user_id == UserRegistrations.user_id
+        ).filter(Users.user_ds_id == user_ds_id)
+    if registration_ds_id:
+        registration_id = get_registration_id(registration_ds_id)
+        if registration_id is None:
+            return []
+        query = query.filter(UserRegistrations.registration_id ==
+                             registration_id)
+    if course_ntiid:
+        query = query.filter(_course_ntiid_filter(course_ntiid))
+    return query.order_by(UserRegistrations.user_registration_id).all()
+
+
+def iter_survey_details(registration_ds_id, yield_per=1000,
+                        include_unanswered=False):
+    """
+    Stream the (user_registration_id, registration_survey_taken_id,
+    username, survey_version, question_id, raw response) rows of every
+    survey submitted for the registration, ordered by user registration,
+    survey and then question insertion order. Rows are fetched
+    `yield_per` at a time through a server-side cursor, without building
+    ORM objects.
+
+    With `include_unanswered`, registrations without a survey (or
+    survey details) are included as a single row with None for the
+    missing values.
     """
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return
     db = get_analytics_db()
+    rows = db.session.query(UserRegistrations.user_registration_id,
+                            RegistrationSurveysTaken.registration_survey_taken_id,
+                            Users.username,
+                            RegistrationSurveysTaken.survey_version,
+                            RegistrationSurveyDetails.question_id,
+                            RegistrationSurveyDetails._response)
+    survey_join = (RegistrationSurveysTaken,
+                   RegistrationSurveysTaken.user_registration_id == UserRegistrations.user_registration_id)
+    details_join = (RegistrationSurveyDetails,
+                    RegistrationSurveyDetails.registration_survey_taken_id == RegistrationSurveysTaken.registration_survey_taken_id)
+    if include_unanswered:
+        rows = rows.outerjoin(*survey_join).outerjoin(*details_join)
+    else:
+        rows = rows.join(*survey_join).join(*details_join)
+    rows = rows.outerjoin(
+        Users, Users.user_id == UserRegistrations.user_id
+    ).filter(
+        UserRegistrations.registration_id == registration_id
+    ).order_by(
+        UserRegistrations.user_registration_id,
+        RegistrationSurveysTaken.registration_survey_taken_id,
+        RegistrationSurveyDetails.registration_survey_detail_id
+    ).execution_options(stream_results=True).yield_per(yield_per)
+    for row in rows:
+        yield tuple(row)
+
+
+def _iter_answers(response):
+    """
+    Expand multi-select (list) and matrix (dict) responses into their
+    individual, hashable answers.
+    """
+    if isinstance(response, list):
+        answers = response
+    elif isinstance(response, dict):
+        answers = sorted(response.items())
+    else:
+        answers = (response,)
+    for answer in answers:
+        try:
+            hash(answer)
+        except TypeError:
+            answer = _get_response_str(answer)
+        yield answer
+
+
+def _response_key(column, dialect):
+    """
+    The expression identical stored responses are grouped by. MySQL
+    compares TEXT with the column collation (case-insensitively for the
+    `_ci` collations) and only up to `max_sort_length` bytes, so there we
+    group by a digest of the full value instead.
+    """
+    if dialect == 'mysql':
+        return func.md5(column)
+    return column
+
+
+def get_survey_response_distribution(registration_ds_id, question_ids=None,
+                                     yield_per=1000):
+    """
+    Return the distribution of answers for the registration's survey, as
+    a map of (question_id, survey_version) to a map of answer to count.
+    Identical (byte for byte) stored responses are grouped and counted in
+    the database, so each distinct response is only fetched and decoded
+    once; list answers count once for each selected value.
+    """
+    result = {}
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return result
+    db = get_analytics_db()
+    response = RegistrationSurveyDetails._response
+    rows = db.session.query(RegistrationSurveyDetails.question_id,
+                            RegistrationSurveysTaken.survey_version,
+                            func.min(response),
+                            func.count(RegistrationSurveyDetails.registration_survey_detail_id)).join(
+        RegistrationSurveysTaken,
+        RegistrationSurveysTaken.registration_survey_taken_id == RegistrationSurveyDetails.registration_survey_taken_id
+    ).join(
+        UserRegistrations,
+        UserRegistrations.user_registration_id == RegistrationSurveysTaken.user_registration_id
+    ).filter(
+        UserRegistrations.registration_id == registration_id
+    )
+    if question_ids:
+        rows = rows.filter(RegistrationSurveyDetails.question_id.in_(question_ids))
+    rows = rows.group_by(
+        RegistrationSurveyDetails.question_id,
+        RegistrationSurveysTaken.survey_version,
+        _response_key(response, db.engine.name)
+    ).execution_options(stream_results=True).yield_per(yield_per)
+    decoded = {}
+    for question_id, version, raw, count in rows:
+        try:
+            response = decoded[raw]
+        except KeyError:
+            response = decoded[raw] = decode_response(raw)
+        histogram = result.setdefault((question_id, version), {})
+        for answer in _iter_answers(response):
+            histogram[answer] = histogram.get(answer, 0) + count
+    return result
+
+
+def get_all_survey_questions(registration):
+    """
+    Given a registration (or registration ds id or registration id),
+    return all survey questions we know about for that registration.
+    """
     if isinstance(registration, string_types):
-        registration = get_registration(registration)
-        registration_id = registration.registration_id if registration is not None else None
+        registration_id = get_registration_id(registration)
+    elif isinstance(registration, integer_types):
+        registration_id = registration
     else:
         registration_id = getattr(registration, 'registration_id', None)
 
     result = set()
     if registration_id:
-        registrations = db.session.query(UserRegistrations).filter(
-            UserRegistrations.registration_id == registration_id
-        ).all()
-        for registration in registrations:
-            if registration.survey_submission:
-                survey = registration.survey_submission[0]
-                for detail in survey.details:
-                    result.add(detail.question_id)
+        result.update(_survey_questions_cache.get(registration_id))
+    return result
+
+
+def _bulk_delete_user_registrations(user, registration_ds_id):
+    db = get_analytics_db()
+    query = db.session.query(UserRegistrations)
+    if registration_ds_id:
+        registration_id = get_registration_id(registration_ds_id)
+        if registration_id is None:
+            return []
+        query = query.filter(UserRegistrations.registration_id ==
+                             registration_id)
+    if user is not None:
+        user_id = _get_user_ids((user,), create=False).get(user)
+        if user_id is None:
+            return []
+        query = query.filter(UserRegistrations.user_id == user_id)
+    user_registrations = query.all()
+    result = []
+    deltas = {}
+    for registration in user_registrations:
+        _resolve_registration(registration, user)
+        # Rules are loaded once per registration through the rule index.
+        course_ntiid = _get_course_for_registration(registration,
+                                                    registration_ds_id)
+        result.append((registration, course_ntiid))
+        key = _summary_key(registration.school,
+                           registration.grade_teaching,
+                           registration.session_range,
+                           registration.curriculum)
+        counts = deltas.setdefault(registration.registration_id, Counter())
+        counts[key] -= 1
+
+    ids = [x.user_registration_id for x in user_registrations]
+    for idx in range(0, len(ids), 1000):
+        chunk = ids[idx:idx + 1000]
+        survey_ids = select([RegistrationSurveysTaken.registration_survey_taken_id]).where(
+            RegistrationSurveysTaken.user_registration_id.in_(chunk))
+        db.session.query(RegistrationSurveyDetails).filter(
+            RegistrationSurveyDetails.registration_survey_taken_id.in_(survey_ids)
+        ).delete(synchronize_session=False)
+        db.session.query(RegistrationSurveysTaken).filter(
+            RegistrationSurveysTaken.user_registration_id.in_(chunk)
+        ).delete(synchronize_session=False)
+        db.session.query(UserRegistrations).filter(
+            UserRegistrations.user_registration_id.in_(chunk)
+        ).delete(synchronize_session=False)
+    for registration_id, counts in deltas.items():
+        _update_summary(registration_id, counts)
+        _surveys_deleted(registration_id)
+    for registration in user_registrations:
+        db.session.expunge(registration)
+    logger.info('Deleted registrations (user=%s) (registration=%s) (%s)',
+                user, registration_ds_id, len(ids))
     return result
 
 
-def delete_user_registrations(user=None, registration_ds_id=None):
+def delete_user_registrations(user=None, registration_ds_id=None, bulk=False):
     """
     Delete the registrations (and surveys etc) associated with the
     given user and registration_id. Should probably only be used
     by admins in test environments.
+
+    With `bulk`, rows are removed with set-based deletes rather than
+    through the ORM, in a constant number of queries.
     """
+    if bulk:
+        return _bulk_delete_user_registrations(user, registration_ds_id)
     user_registrations = get_user_registrations(user, registration_ds_id)
     result = []
     if user_registrations:
@@ -440,6 +1846,12 @@ def delete_user_registrations(user=None, registration_ds_id=None):
             logger.info('Deleting registration (user=%s) (registration=%s)',
                         user, registration_ds_id)
             db.session.delete(registration)
+            key = _summary_key(registration.school,
+                               registration.grade_teaching,
+                               registration.session_range,
+                               registration.curriculum)
+            _update_summary(registration.registration_id, {key: -1})
+            _surveys_deleted(registration.registration_id)
             course_ntiid = _get_course_for_registration(registration,
                                                         registration_ds_id)
             # Return tuples of registration and course_ntiid.
@@ -447,59 +1859,73 @@ def delete_user_registrations(user=None, registration_ds_id=None):
     return result
 
 
-def get_registration_rules(registration_ds_id, sort=True, sort_descending=False):
+def _query_registration_records(table, pk_column, registration_ds_id, sort,
+                                sort_descending, limit, offset, filters):
+    db = get_analytics_db()
+    query = db.session.query(table).join(
+        Registrations, Registrations.registration_id == table.registration_id
+    ).filter(Registrations.registration_ds_id == registration_ds_id)
+    for name, value in filters:
+        if value is not None:
+            query = query.filter(getattr(table, name) == value)
+    if sort:
+        query = query.order_by(pk_column.desc() if sort_descending else pk_column)
+    if limit is not None:
+        query = query.limit(limit)
+    if offset:
+        query = query.offset(offset)
+    return query.all() or None
+
+
+def get_registration_rules(registration_ds_id, sort=True, sort_descending=False,
+                           limit=None, offset=None, school=None, grade=None,
+                           curriculum=None, course_ntiid=None):
     """
     Get the registration rules for the given registration id. By
-    default, sorted by insertion order ascending.
+    default, sorted by insertion order ascending. Results may be paged
+    with `limit` and `offset` and filtered by any of the rule columns.
     """
-    registration = get_registration(registration_ds_id)
-    results = None
-    if registration and registration.registration_rules:
-        results = registration.registration_rules
-        if sort:
-            results = sorted(results,
-                             key=lambda x: x.registration_rule_id,
-                             reverse=sort_descending)
-    return results
-
-
-def get_registration_sessions(registration_ds_id, sort=True, sort_descending=False):
+    filters = (('school', school),
+               ('grade_teaching', grade),
+               ('curriculum', curriculum),
+               ('course_ntiid', course_ntiid))
+    return _query_registration_records(RegistrationEnrollmentRules,
+                                       RegistrationEnrollmentRules.registration_rule_id,
+                                       registration_ds_id, sort, sort_descending,
+                                       limit, offset, filters)
+
+
+def get_registration_sessions(registration_ds_id, sort=True, sort_descending=False,
+                              limit=None, offset=None, session_range=None,
+                              curriculum=None, course_ntiid=None):
     """
     Get the registration sessions for the given registration id. By
-    default, sorted by insertion order ascending.
+    default, sorted by insertion order ascending. Results may be paged
+    with `limit` and `offset` and filtered by any of the session columns.
     """
-    registration = get_registration(registration_ds_id)
-    results = None
-    if registration and registration.registration_sessions:
-        results = registration.registration_sessions
-        if sort:
-            results = sorted(results,
-                             key=lambda x: x.registration_session_id,
-                             reverse=sort_descending)
-    return results
+    filters = (('session_range', session_range),
+               ('curriculum', curriculum),
+               ('course_ntiid', course_ntiid))
+    return _query_registration_records(RegistrationSessions,
+                                       RegistrationSessions.registration_session_id,
+                                       registration_ds_id, sort, sort_descending,
+                                       limit, offset, filters)
 
 
 def _get_course_for_registration(user_registration, registration_ds_id):
     """
     Use the registration info to retrieve a course ntiid.
     """
-    db = get_analytics_db()
     result = None
-    registration_id = user_registration.registration_id
     school = user_registration.school
     grade_teaching = user_registration.grade_teaching
     curriculum = user_registration.curriculum
-    rules = db.session.query(RegistrationEnrollmentRules).filter(
-        RegistrationEnrollmentRules.registration_id == registration_id,
-        RegistrationEnrollmentRules.school == school,
-        RegistrationEnrollmentRules.grade_teaching == grade_teaching,
-        RegistrationEnrollmentRules.curriculum == curriculum
-    ).all()
-    if rules:
-        if len(rules) > 1 and len({x.course_ntiid for x in rules}) > 1:
-            # Data issue; return nothing.
-            logger.warning('Multiple course ntiids mapping to registration (%s) (%s) (%s)',
-                           school, grade_teaching, registration_ds_id)
-        else:
-            result = rules[0].course_ntiid
+    rule_index = get_rule_index(user_registration.registration_id)
+    course_ntiids = rule_index.get_courses(school, grade_teaching, curriculum)
+    if len(course_ntiids) > 1:
+        # Data issue; return nothing.
+        logger.warning('Multiple course ntiids mapping to registration (%s) (%s) (%s)',
+                       school, grade_teaching, registration_ds_id)
+    elif course_ntiids:
+        result = next(iter(course_ntiids))
     return result
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Bulk enrollment of registered users in the courses their registration
+maps them to.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import transaction
+
+from ZODB.POSException import ConflictError
+
+from nti.analytics_database.users import Users
+
+from nti.analytics.database import get_analytics_db
+
+from nti.analytics_registration.database.registration import iter_user_registrations
+from nti.analytics_registration.database.registration import resolve_session_courses
+from nti.analytics_registration.database.registration import _get_course_for_registration
+
+from nti.contenttypes.courses.interfaces import ES_PUBLIC
+
+from nti.contenttypes.courses.interfaces import ICourseInstance
+from nti.contenttypes.courses.interfaces import ICourseEnrollmentManager
+
+from nti.contenttypes.courses.utils import get_enrollment_record
+
+from nti.dataserver.users import User
+
+from nti.ntiids.ntiids import find_object_with_ntiid
+
+#: Per-registration enrollment outcomes.
+ENROLLED = 'enrolled'
+ALREADY_ENROLLED = 'already_enrolled'
+NO_COURSE = 'no_course'
+COURSE_NOT_FOUND = 'course_not_found'
+NO_USER = 'no_user'
+FAILED = 'failed'
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def resolve_registration_courses(user_registrations):
+    """
+    Return the course ntiid (or None) for each of the given user
+    registrations, in order. A session mapping takes precedence over
+    the enrollment rules.
+    """
+    user_registrations = list(user_registrations)
+    result = resolve_session_courses(user_registrations)
+    for idx, user_registration in enumerate(user_registrations):
+        if result[idx] is None:
+            registration = user_registration._registration_record
+            result[idx] = _get_course_for_registration(user_registration,
+                                                       registration.registration_ds_id)
+    return result
+
+
+def _get_user(username):
+    return User.get_user(username)
+
+
+def _get_registration_users(user_registrations):
+    """
+    Return the user of each of the given registrations, in order, looking
+    up the usernames of those not already resolved in a single query.
+    """
+    users = [getattr(x, 'user', None) for x in user_registrations]
+    user_ids = {x.user_id for x, user in zip(user_registrations, users)
+                if user is None}
+    if user_ids:
+        db = get_analytics_db()
+        rows = db.session.query(Users.user_id, Users.username).filter(
+            Users.user_id.in_(user_ids))
+        usernames = dict(rows)
+        for idx, user_registration in enumerate(user_registrations):
+            username = usernames.get(user_registration.user_id)
+            if users[idx] is None and username is not None:
+                users[idx] = _get_user(username)
+    return users
+
+
+def _enroll_group(course, records, scope, retries):
+    manager = ICourseEnrollmentManager(course)
+    users = _get_registration_users(records)
+    for user_registration, user in zip(records, users):
+        if user is None:
+            yield user_registration, NO_USER
+            continue
+        # Re-running the pipeline skips users already enrolled.
+        if get_enrollment_record(course, user) is not None:
+            yield user_registration, ALREADY_ENROLLED
+            continue
+        for attempt in range(retries + 1):
+            # A failed attempt must not leave partial changes behind.
+            savepoint = transaction.savepoint()
+            try:
+                manager.enroll(user, scope=scope)
+            except ConflictError:
+                # The whole transaction must be retried.
+                raise
+            except Exception:  # pylint: disable=broad-except
+                savepoint.rollback()
+                if attempt == retries:
+                    logger.exception('Could not enroll user (%s) (%s)',
+                                     user, user_registration.user_registration_id)
+                    yield user_registration, FAILED
+            else:
+                yield user_registration, ENROLLED
+                break
+
+
+def enroll_registrations(user_registrations, scope=ES_PUBLIC, retries=1):
+    """
+    Enroll the users of the given registrations in the courses their
+    registrations map to. Registrations are grouped by course so each
+    course is resolved once. Returns (user_registration, course_ntiid,
+    outcome) tuples, in order; running it again is safe.
+    """
+    user_registrations = list(user_registrations)
+    course_ntiids = resolve_registration_courses(user_registrations)
+    groups = {}
+    outcomes = {}
+    for user_registration, course_ntiid in zip(user_registrations, course_ntiids):
+        if course_ntiid is None:
+            outcomes[id(user_registration)] = NO_COURSE
+        else:
+            groups.setdefault(course_ntiid, []).append(user_registration)
+    for course_ntiid, records in groups.items():
+        course = ICourseInstance(find_object_with_ntiid(course_ntiid), None)
+        if course is None:
+            logger.warning('Registration course not found (%s) (%s)',
+                           course_ntiid, len(records))
+            for user_registration in records:
+                outcomes[id(user_registration)] = COURSE_NOT_FOUND
+            continue
+        for user_registration, outcome in _enroll_group(course, records,
+                                                        scope, retries):
+            outcomes[id(user_registration)] = outcome
+        logger.info('Enrolled registrations (%s) (%s)',
+                    course_ntiid, len(records))
+    return [(x, ntiid, outcomes[id(x)])
+            for x, ntiid in zip(user_registrations, course_ntiids)]
+
+
+def enroll_registered_users(registration_ds_id, scope=ES_PUBLIC, page_size=1000,
+                            retries=1):
+    """
+    Enroll every registered user of the registration, a page of
+    registrations at a time, yielding the outcomes of each page.
+    """
+    page = []
+    for user_registration in iter_user_registrations(registration_ds_id,
+                                                     page_size=page_size,
+                                                     resolve=False):
+        page.append(user_registration)
+        if len(page) >= page_size:
+            for outcome in enroll_registrations(page, scope, retries):
+                yield outcome
+            page = []
+    for outcome in enroll_registrations(page, scope, retries):
+        yield outcome
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Streaming exports of registration survey data.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import csv
+
+import six
+
+import simplejson as json
+
+from six import text_type
+from six import string_types
+
+from nti.analytics_registration.database.registration import decode_response
+from nti.analytics_registration.database.registration import iter_survey_details
+from nti.analytics_registration.database.registration import get_all_survey_questions
+
+from nti.analytics_registration.stats import _get_question_key
+
+#: The columns of each exported survey response row.
+SURVEY_RESPONSE_COLUMNS = ('username', 'survey_version',
+                           'question_id', 'response')
+
+#: The leading columns of each survey pivot row.
+SURVEY_PIVOT_COLUMNS = ('user_registration_id', 'username', 'survey_version')
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def iter_survey_responses(registration_ds_id, yield_per=1000):
+    """
+    Yield a (username, survey_version, question_id, response) tuple for
+    every survey answer of the registration, with the response decoded.
+    Memory use is constant regardless of the number of answers.
+    """
+    rows = iter_survey_details(registration_ds_id, yield_per=yield_per)
+    for _, _, username, version, question_id, raw in rows:
+        yield username, version, question_id, decode_response(raw)
+
+
+def _csv_value(response):
+    if response is None or isinstance(response, string_types + (int, float)):
+        return response
+    return json.dumps(response)
+
+
+def _csv_row(values):
+    # The py2 csv module only writes byte strings.
+    if six.PY2:
+        values = [x.encode('utf-8') if isinstance(x, text_type) else x
+                  for x in values]
+    return values
+
+
+def write_survey_responses_csv(registration_ds_id, stream, yield_per=1000):
+    """
+    Write the survey responses of the registration to the stream as CSV,
+    returning the number of rows written. Non-scalar responses are
+    written as JSON.
+    """
+    writer = csv.writer(stream)
+    writer.writerow(SURVEY_RESPONSE_COLUMNS)
+    count = 0
+    for row in iter_survey_responses(registration_ds_id, yield_per):
+        writer.writerow(_csv_row(row[:-1] + (_csv_value(row[-1]),)))
+        count += 1
+    logger.info('Exported survey responses (%s) (%s)',
+                registration_ds_id, count)
+    return count
+
+
+def write_survey_responses_jsonl(registration_ds_id, stream, yield_per=1000):
+    """
+    Write the survey responses of the registration to the stream as JSON
+    lines, returning the number of rows written.
+    """
+    count = 0
+    for row in iter_survey_responses(registration_ds_id, yield_per):
+        stream.write(json.dumps(dict(zip(SURVEY_RESPONSE_COLUMNS, row))))
+        stream.write('\n')
+        count += 1
+    logger.info('Exported survey responses (%s) (%s)',
+                registration_ds_id, count)
+    return count
+
+
+class SurveyPivotTable(object):
+    """
+    Survey responses pivoted into one row per user registration and one
+    column per question, stored column-wise (one list per column).
+    """
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.column_index = {x: idx for idx, x in enumerate(self.columns)}
+        self.data = tuple([] for _ in self.columns)
+
+    def __len__(self):
+        return len(self.data[0]) if self.data else 0
+
+    def append(self, row):
+        for values, value in zip(self.data, row):
+            values.append(value)
+
+    def column(self, name):
+        return self.data[self.column_index[name]]
+
+    def iter_rows(self):
+        return zip(*self.data)
+
+    def write_csv(self, stream):
+        writer = csv.writer(stream)
+        writer.writerow(_csv_row(self.columns))
+        for row in self.iter_rows():
+            writer.writerow(_csv_row([_csv_value(x) for x in row]))
+
+
+def _pivot_value(response):
+    if isinstance(response, list):
+        # Make sure our list response is readable.
+        response = u', '.join(text_type(x) for x in response)
+    return response
+
+
+def build_survey_pivot(registration_ds_id, yield_per=1000):
+    """
+    Build a :class:`SurveyPivotTable` for the registration in a single
+    streaming pass over the survey details, with a row for every user
+    registration. Question columns are keyed as in the registration
+    survey stats, and unanswered questions are blank.
+    """
+    questions = sorted({_get_question_key(x)
+                        for x in get_all_survey_questions(registration_ds_id)})
+    result = SurveyPivotTable(SURVEY_PIVOT_COLUMNS + tuple(questions))
+    column_index = result.column_index
+    width = len(result.columns)
+    row = None
+    current = None
+    rows = iter_survey_details(registration_ds_id, yield_per=yield_per,
+                               include_unanswered=True)
+    for user_registration_id, _, username, version, question_id, raw in rows:
+        # Details arrive ordered by user registration, so each
+        # registration's answers are contiguous.
+        if user_registration_id != current:
+            if row is not None:
+                result.append(row)
+            current = user_registration_id
+            row = [''] * width
+            row[0] = user_registration_id
+            row[1] = username
+            row[2] = version
+        if question_id is None:
+            # Registered without a survey.
+            continue
+        idx = column_index.get(_get_question_key(question_id))
+        if idx is None:
+            logger.warning('Unknown survey question (%s) (%s)',
+                           registration_ds_id, question_id)
+            continue
+        row[idx] = _pivot_value(decode_response(raw))
+    if row is not None:
+        result.append(row)
+    return result
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope.component.hooks import setHooks
+
+from nti.analytics.generations.utils import do_evolve
+
+from nti.analytics.database import get_analytics_db
+
+from nti.analytics_registration.generations.utils import create_index
+from nti.analytics_registration.generations.utils import has_duplicates
+
+generation = 4
+
+logger = __import__('logging').getLogger(__name__)
+
+INDEXES = (
+    ('RegistrationEnrollmentRules', 'ix_registration_rules_course',
+     ('registration_id', 'school', 'grade_teaching', 'course_ntiid')),
+    ('RegistrationEnrollmentRules', 'ix_registration_rules_curriculum',
+     ('registration_id', 'school', 'grade_teaching', 'curriculum')),
+    ('RegistrationSessions', 'ix_registration_sessions_session',
+     ('registration_id', 'session_range', 'curriculum')),
+)
+
+UNIQUE_TABLE = 'UserRegistrations'
+UNIQUE_INDEX = 'ix_user_registrations_user_registration'
+UNIQUE_COLUMNS = ('user_id', 'registration_id')
+
+
+def add_indexes(engine):
+    for table, name, columns in INDEXES:
+        create_index(engine, table, name, columns)
+    if has_duplicates(engine, UNIQUE_TABLE, UNIQUE_COLUMNS):
+        # Do not guess which registration to drop; these must be
+        # cleaned up by hand before the constraint can be added. Until
+        # then, duplicates are detected by querying.
+        logger.warning('Duplicate user registrations exist, not adding (%s)',
+                       UNIQUE_INDEX)
+    else:
+        create_index(engine, UNIQUE_TABLE, UNIQUE_INDEX, UNIQUE_COLUMNS,
+                     unique=True)
+
+
+def evolve_job():
+    setHooks()
+    db = get_analytics_db()
+    add_indexes(db.engine)
+    logger.info('Finished analytics evolve (%s)', generation)
+
+
+def evolve(context):
+    """
+    Add composite lookup indexes and a unique (user_id, registration_id)
+    index to user registrations.
+    """
+    do_evolve(context, evolve_job, generation)
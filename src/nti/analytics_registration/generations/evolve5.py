@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope.component.hooks import setHooks
+
+from nti.analytics.generations.utils import do_evolve
+
+from nti.analytics.database import get_analytics_db
+
+from nti.analytics_registration.generations.utils import drop_index
+from nti.analytics_registration.generations.utils import create_index
+from nti.analytics_registration.generations.utils import has_duplicates
+
+generation = 5
+
+logger = __import__('logging').getLogger(__name__)
+
+TABLE = 'Registrations'
+INDEX = 'ix_registrations_registration_ds_id_unique'
+OLD_INDEX = 'ix_Registrations_registration_ds_id'
+COLUMNS = ('registration_ds_id',)
+
+
+def add_unique_index(engine):
+    if has_duplicates(engine, TABLE, COLUMNS):
+        logger.warning('Duplicate registrations exist, not adding (%s)',
+                       INDEX)
+    else:
+        create_index(engine, TABLE, INDEX, COLUMNS, unique=True)
+        drop_index(engine, TABLE, OLD_INDEX)
+
+
+def evolve_job():
+    setHooks()
+    db = get_analytics_db()
+    add_unique_index(db.engine)
+    logger.info('Finished analytics evolve (%s)', generation)
+
+
+def evolve(context):
+    """
+    Make registration_ds_id unique so concurrent creates cannot race,
+    replacing its non-unique index.
+    """
+    do_evolve(context, evolve_job, generation)
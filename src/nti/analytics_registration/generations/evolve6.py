@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope.component.hooks import setHooks
+
+from nti.analytics.generations.utils import do_evolve
+
+from nti.analytics.database import get_analytics_db
+
+from nti.analytics_registration.database.registration import RegistrationSummary
+
+from nti.analytics_registration.database.registration import rebuild_registration_summary
+
+generation = 6
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def evolve_job():
+    setHooks()
+    db = get_analytics_db()
+    RegistrationSummary.__table__.create(db.engine, checkfirst=True)
+    rebuild_registration_summary()
+    logger.info('Finished analytics evolve (%s)', generation)
+
+
+def evolve(context):
+    """
+    Add and populate the registration summary table.
+    """
+    do_evolve(context, evolve_job, generation)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=import-error
+from alembic.migration import MigrationContext
+
+from alembic.operations import Operations
+
+from sqlalchemy import Column
+from sqlalchemy import Integer
+
+from sqlalchemy import inspect
+
+from zope.component.hooks import setHooks
+
+from nti.analytics.generations.utils import do_evolve
+from nti.analytics.generations.utils import mysql_column_exists
+
+from nti.analytics.database import get_analytics_db
+
+generation = 7
+
+logger = __import__('logging').getLogger(__name__)
+
+COLUMNS = ('rules_version', 'sessions_version', 'surveys_version')
+
+
+def evolve_job():
+    setHooks()
+    db = get_analytics_db()
+
+    if db.defaultSQLite or db.engine.name == 'sqlite':
+        return
+
+    # Cannot use transaction with alter table scripts and mysql
+    connection = db.engine.connect()
+    mc = MigrationContext.configure(connection)
+    op = Operations(mc)
+    inspector = inspect(db.engine)
+    schema = inspector.default_schema_name
+
+    for column_name in COLUMNS:
+        if not mysql_column_exists(connection, schema, 'Registrations', column_name):
+            op.add_column('Registrations',
+                          Column(column_name, Integer, nullable=False,
+                                 server_default='0'))
+            logger.info('Adding column (%s) (%s)', column_name, schema)
+    logger.info('Finished analytics evolve (%s)', generation)
+
+
+def evolve(context):
+    """
+    Add the rules, sessions and surveys version counters to registrations.
+    """
+    do_evolve(context, evolve_job, generation)
@@ -15,7 +15,7 @@ from zope.generations.interfaces import IInstallableSchemaManager
 
 from nti.analytics_registration.generations.evolve2 import evolve as evolve2
 
-generation = 3
+generation = 7
 
 logger = __import__('logging').getLogger(__name__)
 
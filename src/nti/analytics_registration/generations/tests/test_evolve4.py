@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_not
+from hamcrest import has_item
+from hamcrest import assert_that
+
+import unittest
+
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy import inspect
+from sqlalchemy import create_engine
+
+from nti.analytics_database import Base
+
+from nti.analytics_registration.database.registration import UserRegistrations
+
+from nti.analytics_registration.generations.evolve4 import INDEXES
+from nti.analytics_registration.generations.evolve4 import UNIQUE_INDEX
+from nti.analytics_registration.generations.evolve4 import add_indexes
+
+
+class TestEvolve4(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        # Simulate a database created before these indexes existed.
+        names = [x[1] for x in INDEXES] + [UNIQUE_INDEX]
+        with self.engine.connect() as connection:
+            for name in names:
+                connection.execute(text('DROP INDEX %s' % name))
+
+    def _index_names(self, table):
+        inspector = inspect(self.engine)
+        return [x['name'] for x in inspector.get_indexes(table)]
+
+    def _insert_registration(self, user_id, registration_id):
+        with self.engine.connect() as connection:
+            connection.execute(UserRegistrations.__table__.insert(),
+                               user_id=user_id,
+                               registration_id=registration_id,
+                               session_id=1,
+                               timestamp=datetime.utcnow(),
+                               curriculum=u'curriculum',
+                               session_range=u'June')
+
+    def test_add_indexes(self):
+        self._insert_registration(1, 1)
+        self._insert_registration(1, 2)
+        add_indexes(self.engine)
+        for table, name, _ in INDEXES:
+            assert_that(self._index_names(table), has_item(name))
+        assert_that(self._index_names('UserRegistrations'),
+                    has_item(UNIQUE_INDEX))
+        # Running again is a no-op.
+        add_indexes(self.engine)
+        with self.assertRaises(Exception):
+            self._insert_registration(1, 1)
+
+    def test_duplicates(self):
+        self._insert_registration(1, 1)
+        self._insert_registration(1, 1)
+        add_indexes(self.engine)
+        names = self._index_names('UserRegistrations')
+        assert_that(names, is_not(has_item(UNIQUE_INDEX)))
+        assert_that(self._index_names('RegistrationSessions'),
+                    has_item(INDEXES[2][1]))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_not
+from hamcrest import has_item
+from hamcrest import assert_that
+
+import unittest
+
+from sqlalchemy import text
+from sqlalchemy import inspect
+from sqlalchemy import create_engine
+
+from nti.analytics_database import Base
+
+from nti.analytics_registration.database.registration import Registrations
+
+from nti.analytics_registration.generations.evolve5 import INDEX
+from nti.analytics_registration.generations.evolve5 import TABLE
+from nti.analytics_registration.generations.evolve5 import OLD_INDEX
+from nti.analytics_registration.generations.evolve5 import add_unique_index
+
+
+class TestEvolve5(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        # Simulate a database created with the non-unique index.
+        with self.engine.connect() as connection:
+            connection.execute(text('DROP INDEX %s' % INDEX))
+            connection.execute(text('CREATE INDEX %s ON %s (registration_ds_id)'
+                                    % (OLD_INDEX, TABLE)))
+
+    def _index_names(self):
+        inspector = inspect(self.engine)
+        return {x['name'] for x in inspector.get_indexes(TABLE)}
+
+    def _insert_registration(self, registration_ds_id):
+        with self.engine.connect() as connection:
+            connection.execute(Registrations.__table__.insert(),
+                               registration_ds_id=registration_ds_id)
+
+    def test_add_unique_index(self):
+        self._insert_registration(u'reg1')
+        add_unique_index(self.engine)
+        assert_that(self._index_names(), has_item(INDEX))
+        assert_that(self._index_names(), is_not(has_item(OLD_INDEX)))
+        # Running again is a no-op.
+        add_unique_index(self.engine)
+        with self.assertRaises(Exception):
+            self._insert_registration(u'reg1')
+
+    def test_duplicates(self):
+        self._insert_registration(u'reg1')
+        self._insert_registration(u'reg1')
+        add_unique_index(self.engine)
+        assert_that(self._index_names(), has_item(OLD_INDEX))
+        assert_that(self._index_names(), is_not(has_item(INDEX)))
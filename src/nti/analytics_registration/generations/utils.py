@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from sqlalchemy import text
+from sqlalchemy import inspect
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def index_exists(engine, table, name):
+    inspector = inspect(engine)
+    return name in {x['name'] for x in inspector.get_indexes(table)}
+
+
+def has_duplicates(engine, table, columns):
+    """
+    Return whether any rows of the table share values for the columns.
+    """
+    columns = ', '.join(columns)
+    sql = 'SELECT 1 FROM %s GROUP BY %s HAVING COUNT(*) > 1 LIMIT 1'
+    with engine.connect() as connection:
+        row = connection.execute(text(sql % (table, columns))).first()
+    return row is not None
+
+
+def create_index(engine, table, name, columns, unique=False):
+    """
+    Create the index if it does not already exist, returning whether it
+    was created. On MySQL the index is built online (in place, without
+    locking the table against writes).
+    """
+    if index_exists(engine, table, name):
+        return False
+    unique = 'UNIQUE ' if unique else ''
+    columns = ', '.join(columns)
+    if engine.name == 'mysql':
+        sql = 'ALTER TABLE %s ADD %sINDEX %s (%s), ALGORITHM=INPLACE, LOCK=NONE'
+        sql = sql % (table, unique, name, columns)
+    else:
+        sql = 'CREATE %sINDEX %s ON %s (%s)' % (unique, name, table, columns)
+    with engine.connect() as connection:
+        connection.execute(text(sql))
+    logger.info('Created index (%s) on (%s)', name, table)
+    return True
+
+
+def drop_index(engine, table, name):
+    """
+    Drop the index if it exists, returning whether it was dropped.
+    """
+    if not index_exists(engine, table, name):
+        return False
+    if engine.name == 'mysql':
+        sql = 'ALTER TABLE %s DROP INDEX %s, ALGORITHM=INPLACE, LOCK=NONE'
+        sql = sql % (table, name)
+    else:
+        sql = 'DROP INDEX %s' % name
+    with engine.connect() as connection:
+        connection.execute(text(sql))
+    logger.info('Dropped index (%s) on (%s)', name, table)
+    return True
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope import interface
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class IRegistrationSubmissionQueue(interface.Interface):
+    """
+    A durable queue of registration and survey submissions, written to
+    the analytics database in bulk by a background worker. When
+    registered as a utility, submissions are queued instead of being
+    written in the user's request.
+    """
+
+    def enqueue(kind, registration_ds_id, username, payload):
+        """
+        Queue the submission, returning False if the same submission is
+        already pending. A failed submission may be queued again.
+        """
+
+    def is_pending(kind, registration_ds_id, username):
+        """
+        Return whether a submission of this kind is pending for the user.
+        """
+
+    def peek(limit):
+        """
+        Return up to `limit` of the oldest pending submissions as
+        (id, kind, registration_ds_id, username, payload) tuples.
+        """
+
+    def ack(ids):
+        """
+        Remove the given submissions once they have been stored.
+        """
+
+    def fail(ids):
+        """
+        Record a failed attempt to store the given submissions. Those
+        failing too often are no longer pending, and are kept aside.
+        """
+
+    def failed():
+        """
+        Return the number of submissions that failed too often.
+        """
+
+    def depth():
+        """
+        Return the number of pending submissions.
+        """
+
+    def lag():
+        """
+        Return the age, in seconds, of the oldest pending submission.
+        """
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Streaming loaders for registration rule and session CSV/TSV files.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import csv
+
+from collections import namedtuple
+
+import six
+
+from nti.analytics_registration.database.registration import RegistrationSessions
+from nti.analytics_registration.database.registration import RegistrationEnrollmentRules
+
+from nti.analytics_registration.database.registration import store_registration_rules
+from nti.analytics_registration.database.registration import append_registration_rules
+from nti.analytics_registration.database.registration import store_registration_sessions
+from nti.analytics_registration.database.registration import append_registration_sessions
+
+#: The default number of rows written per bulk insert.
+DEFAULT_CHUNK_SIZE = 1000
+
+#: A row that could not be loaded, by 1-based line number.
+LoadError = namedtuple('LoadError', ('line', 'message'))
+
+#: The number of rows written and the rows rejected by a load.
+LoadResult = namedtuple('LoadResult', ('count', 'errors'))
+
+Rule = namedtuple('Rule', ('school', 'grade', 'curriculum', 'course_ntiid'))
+
+Session = namedtuple('Session', ('session_range', 'curriculum', 'course_ntiid'))
+
+#: Alternate header names, after normalization.
+HEADER_ALIASES = {
+    'grade_teaching': 'grade',
+    'ntiid': 'course_ntiid',
+    'session': 'session_range',
+}
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def _column_length(table, name):
+    return getattr(table.__table__.c[name].type, 'length', None)
+
+
+RULE_COLUMNS = (
+    ('school', _column_length(RegistrationEnrollmentRules, 'school')),
+    ('grade', _column_length(RegistrationEnrollmentRules, 'grade_teaching')),
+    ('curriculum', _column_length(RegistrationEnrollmentRules, 'curriculum')),
+    ('course_ntiid', _column_length(RegistrationEnrollmentRules, 'course_ntiid')),
+)
+
+SESSION_COLUMNS = (
+    ('session_range', _column_length(RegistrationSessions, 'session_range')),
+    ('curriculum', _column_length(RegistrationSessions, 'curriculum')),
+    ('course_ntiid', _column_length(RegistrationSessions, 'course_ntiid')),
+)
+
+
+def _normalize_header(value):
+    value = '_'.join(value.strip().lower().split())
+    return HEADER_ALIASES.get(value, value)
+
+
+def _text(value):
+    if six.PY2 and isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return value.strip()
+
+
+def _iter_records(stream, columns, factory, delimiter, errors):
+    """
+    Lazily parse the stream, yielding validated records and collecting
+    a :class:`LoadError` for every rejected line.
+    """
+    reader = csv.reader(stream, delimiter=delimiter)
+    header = next(reader, None)
+    if header is None:
+        errors.append(LoadError(1, 'Empty file'))
+        return
+    header = [_normalize_header(_text(x)) for x in header]
+    missing = [name for name, _ in columns if name not in header]
+    if missing:
+        errors.append(LoadError(1, 'Missing columns: %s' % ', '.join(missing)))
+        return
+    indexes = [header.index(name) for name, _ in columns]
+    for row in reader:
+        line = reader.line_num
+        if not any(x.strip() for x in row):
+            continue
+        if len(row) < len(header):
+            errors.append(LoadError(line, 'Expected %s columns, found %s'
+                                    % (len(header), len(row))))
+            continue
+        values = []
+        for (name, length), idx in zip(columns, indexes):
+            value = _text(row[idx])
+            if not value:
+                errors.append(LoadError(line, 'Missing %s' % name))
+                break
+            if length is not None and len(value) > length:
+                errors.append(LoadError(line, '%s longer than %s characters'
+                                        % (name, length)))
+                break
+            values.append(value)
+        else:
+            yield factory(*values)
+
+
+def _load(stream, columns, factory, store, append, registration_ds_id,
+          truncate, delimiter, chunk_size, progress):
+    errors = []
+    records = _iter_records(stream, columns, factory, delimiter, errors)
+    # Parse (and validate the header) before touching stored data.
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            break
+    if errors and not chunk:
+        return LoadResult(0, errors)
+    if truncate:
+        store(registration_ds_id, (), truncate=True)
+    count = 0
+    while chunk:
+        count += append(registration_ds_id, chunk)
+        if progress is not None:
+            progress(count, len(errors))
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                break
+    logger.info('Loaded registration rows (%s) (count=%s) (errors=%s)',
+                registration_ds_id, count, len(errors))
+    return LoadResult(count, errors)
+
+
+def load_registration_rules(registration_ds_id, stream, truncate=True,
+                            delimiter=',', chunk_size=DEFAULT_CHUNK_SIZE,
+                            progress=None):
+    """
+    Load registration rules from a CSV (or, with a tab `delimiter`, TSV)
+    stream with school, grade, curriculum and course_ntiid columns. Rows
+    are validated against the column limits and written `chunk_size` at
+    a time; `progress` is called with the number of rows written and
+    errors found after each chunk. Invalid lines are skipped and returned
+    as :class:`LoadError` values in the :class:`LoadResult`.
+    """
+    return _load(stream, RULE_COLUMNS, Rule,
+                 store_registration_rules, append_registration_rules,
+                 registration_ds_id, truncate, delimiter, chunk_size, progress)
+
+
+def load_registration_sessions(registration_ds_id, stream, truncate=True,
+                               delimiter=',', chunk_size=DEFAULT_CHUNK_SIZE,
+                               progress=None):
+    """
+    Load registration sessions from a CSV (or TSV) stream with
+    session_range, curriculum and course_ntiid columns. See
+    :func:`load_registration_rules`.
+    """
+    return _load(stream, SESSION_COLUMNS, Session,
+                 store_registration_sessions, append_registration_sessions,
+                 registration_ds_id, truncate, delimiter, chunk_size, progress)
@@ -8,17 +8,34 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+from zope import component
+
 from nti.analytics.common import timestamp_type
 
 from nti.analytics.sessions import get_nti_session_id
 
 from nti.analytics_registration.database import registration as db_registration
 
+from nti.analytics_registration.interfaces import IRegistrationSubmissionQueue
+
+from nti.analytics_registration.submissions import queue_registration_data
+from nti.analytics_registration.submissions import queue_registration_survey_data
+
 get_user_registrations = db_registration.get_user_registrations
+iter_user_registrations = db_registration.iter_user_registrations
+get_user_registrations_page = db_registration.get_user_registrations_page
+get_user_registrations_by_user = db_registration.get_user_registrations_by_user
 get_registration_rules = db_registration.get_registration_rules
+get_registration_counts = db_registration.get_registration_counts
+get_registration_summary = db_registration.get_registration_summary
+rebuild_registration_summary = db_registration.rebuild_registration_summary
 get_all_survey_questions = db_registration.get_all_survey_questions
+get_survey_response_distribution = db_registration.get_survey_response_distribution
 get_registration_sessions = db_registration.get_registration_sessions
 
+resolve_session_course = db_registration.resolve_session_course
+resolve_session_courses = db_registration.resolve_session_courses
+
 store_registration_rules = db_registration.store_registration_rules
 store_registration_sessions = db_registration.store_registration_sessions
 
@@ -28,15 +45,49 @@ logger = __import__('logging').getLogger(__name__)
 
 
 def store_registration_data(user, timestamp, registration_ds_id, data):
+    queue = component.queryUtility(IRegistrationSubmissionQueue)
+    if queue is not None:
+        queue_registration_data(queue, user, timestamp,
+                                registration_ds_id, data)
+        return
     timestamp = timestamp_type(timestamp)
     session_id = get_nti_session_id()
     db_registration.store_registration_data(user, timestamp, session_id,
                                             registration_ds_id, data)
 
 
+def store_registration_data_batch(registration_ds_id, items):
+    """
+    Store many (user, timestamp, data) registrations, returning the
+    per-item outcomes.
+    """
+    session_id = get_nti_session_id()
+    items = [(user, timestamp_type(timestamp), session_id, data)
+             for user, timestamp, data in items]
+    return db_registration.store_registration_data_batch(registration_ds_id,
+                                                         items)
+
+
 def store_registration_survey_data(user, timestamp, registration_ds_id, version, data):
+    queue = component.queryUtility(IRegistrationSubmissionQueue)
+    if queue is not None:
+        queue_registration_survey_data(queue, user, timestamp,
+                                       registration_ds_id, version, data)
+        return
     timestamp = timestamp_type(timestamp)
     session_id = get_nti_session_id()
     db_registration.store_registration_survey_data(user, timestamp, session_id,
                                                    registration_ds_id,
                                                    version, data)
+
+
+def store_registration_survey_data_batch(registration_ds_id, items):
+    """
+    Store many (user, timestamp, version, data) surveys, returning the
+    per-item outcomes.
+    """
+    session_id = get_nti_session_id()
+    items = [(user, timestamp_type(timestamp), session_id, version, data)
+             for user, timestamp, version, data in items]
+    return db_registration.store_registration_survey_data_batch(registration_ds_id,
+                                                                items)
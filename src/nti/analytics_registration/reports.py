@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Registration and survey reports for many registrations, built in
+parallel worker processes.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import multiprocessing
+
+from collections import OrderedDict
+
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import create_engine
+
+from nti.analytics_database.users import Users
+
+from nti.analytics.database import get_analytics_db
+
+from nti.analytics_registration.database.registration import UserRegistrations
+from nti.analytics_registration.database.registration import RegistrationSurveysTaken
+from nti.analytics_registration.database.registration import RegistrationSurveyDetails
+
+from nti.analytics_registration.database.registration import decode_response
+from nti.analytics_registration.database.registration import get_registration_id
+from nti.analytics_registration.database.registration import get_all_survey_questions
+
+from nti.analytics_registration.export import _pivot_value
+
+from nti.analytics_registration.stats import _get_question_key
+
+#: The default number of user registration ids per worker chunk.
+DEFAULT_CHUNK_SIZE = 5000
+
+#: The leading columns of each report row.
+REPORT_COLUMNS = ('username', 'timestamp', 'school', 'grade_teaching',
+                  'curriculum', 'employee_id', 'phone', 'session_range',
+                  'survey_version')
+
+_REGISTRATION_COLUMNS = (UserRegistrations.timestamp,
+                         UserRegistrations.school,
+                         UserRegistrations.grade_teaching,
+                         UserRegistrations.curriculum,
+                         UserRegistrations.employee_id,
+                         UserRegistrations.phone,
+                         UserRegistrations.session_range)
+
+#: The engine of a worker process.
+_worker_engine = None
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def _partition(registration_ds_ids, chunk_size):
+    """
+    Split each registration into ranges of user registration ids,
+    yielding the (registration_ds_id, question keys, tasks) of each
+    registration found. Tasks are (registration_ds_id, registration_id,
+    start, end, question keys) tuples in a stable order; registrations
+    without registrants have none.
+    """
+    db = get_analytics_db()
+    for registration_ds_id in registration_ds_ids:
+        registration_id = get_registration_id(registration_ds_id)
+        if registration_id is None:
+            continue
+        questions = tuple(sorted({_get_question_key(x)
+                                  for x in get_all_survey_questions(registration_id)}))
+        low, high = db.session.query(func.min(UserRegistrations.user_registration_id),
+                                     func.max(UserRegistrations.user_registration_id)).filter(
+            UserRegistrations.registration_id == registration_id).one()
+        tasks = []
+        start = (low or 1) - 1
+        while high is not None and start < high:
+            tasks.append((registration_ds_id, registration_id,
+                          start, start + chunk_size, questions))
+            start += chunk_size
+        yield registration_ds_id, questions, tasks
+
+
+def _init_worker(dburi):
+    # Each worker needs its own engine; pooled connections must not be
+    # shared across processes.
+    global _worker_engine  # pylint: disable=global-statement
+    _worker_engine = create_engine(dburi)
+
+
+def _build_chunk(task):
+    """
+    Build the report rows of a range of user registrations, in user
+    registration id order.
+    """
+    registration_ds_id, registration_id, start, end, questions = task
+    in_range = ((UserRegistrations.registration_id == registration_id)
+                & (UserRegistrations.user_registration_id > start)
+                & (UserRegistrations.user_registration_id <= end))
+    registration_query = select(
+        [UserRegistrations.user_registration_id, Users.username]
+        + list(_REGISTRATION_COLUMNS)
+    ).select_from(
+        UserRegistrations.__table__.join(Users.__table__,
+                                         Users.user_id == UserRegistrations.user_id)
+    ).where(in_range).order_by(UserRegistrations.user_registration_id)
+    detail_query = select(
+        [RegistrationSurveysTaken.user_registration_id,
+         RegistrationSurveysTaken.survey_version,
+         RegistrationSurveyDetails.question_id,
+         RegistrationSurveyDetails._response]
+    ).select_from(
+        RegistrationSurveyDetails.__table__.join(
+            RegistrationSurveysTaken.__table__,
+            RegistrationSurveysTaken.registration_survey_taken_id == RegistrationSurveyDetails.registration_survey_taken_id
+        ).join(
+            UserRegistrations.__table__,
+            UserRegistrations.user_registration_id == RegistrationSurveysTaken.user_registration_id)
+    ).where(in_range).order_by(RegistrationSurveyDetails.registration_survey_detail_id)
+
+    column_index = {x: idx for idx, x in enumerate(questions, len(REPORT_COLUMNS))}
+    width = len(REPORT_COLUMNS) + len(questions)
+    rows = OrderedDict()
+    with _worker_engine.connect() as connection:
+        for record in connection.execute(registration_query):
+            row = [''] * width
+            row[:len(REPORT_COLUMNS) - 1] = list(record[1:])
+            rows[record[0]] = row
+        for user_registration_id, version, question_id, raw in connection.execute(detail_query):
+            row = rows.get(user_registration_id)
+            if row is None:
+                continue
+            row[len(REPORT_COLUMNS) - 1] = version
+            idx = column_index.get(_get_question_key(question_id))
+            if idx is not None:
+                row[idx] = _pivot_value(decode_response(raw))
+    return registration_ds_id, [tuple(x) for x in rows.values()]
+
+
+def run_registration_reports(registration_ds_ids, processes=None,
+                             chunk_size=DEFAULT_CHUNK_SIZE, dburi=None):
+    """
+    Build a report of every registrant and their survey answers for each
+    of the given registrations. Work is split by registration and user
+    registration id range and built in a pool of `processes` workers
+    (default: one per core), each with its own database engine. `dburi`
+    defaults to that of the current analytics database and must be
+    reachable from other processes (not an in-memory SQLite database).
+
+    Returns an ordered mapping of registration_ds_id to a (columns, rows)
+    tuple for each registration found, even those without registrants;
+    rows are in user registration id order, so output does not depend on
+    the number of workers.
+    """
+    result = OrderedDict()
+    tasks = []
+    for registration_ds_id, questions, chunks in _partition(registration_ds_ids,
+                                                            chunk_size):
+        if registration_ds_id not in result:
+            result[registration_ds_id] = (REPORT_COLUMNS + questions, [])
+            tasks.extend(chunks)
+    if dburi is None:
+        dburi = get_analytics_db().dburi
+    pool = multiprocessing.Pool(processes,
+                                initializer=_init_worker,
+                                initargs=(dburi,))
+    try:
+        # imap yields in task order, which keeps the merge deterministic.
+        for registration_ds_id, rows in pool.imap(_build_chunk, tasks):
+            result[registration_ds_id][1].extend(rows)
+    finally:
+        pool.close()
+        pool.join()
+    logger.info('Built registration reports (%s) (chunks=%s)',
+                len(result), len(tasks))
+    return result
@@ -8,6 +8,10 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import threading
+
+from contextlib import contextmanager
+
 from zope import interface
 
 from zope.cachedescriptors.property import Lazy
@@ -17,6 +21,11 @@ from nti.analytics.stats.interfaces import IAnalyticsStatsSource
 
 from nti.analytics_registration.registration import get_user_registrations
 from nti.analytics_registration.registration import get_all_survey_questions
+from nti.analytics_registration.registration import get_user_registrations_by_user
+
+from nti.contenttypes.courses.interfaces import ICourseEnrollments
+
+from nti.dataserver.users import User
 
 logger = __import__('logging').getLogger(__name__)
 
@@ -60,6 +69,73 @@ class _SurveyStats(object):
             setattr(self, no_response, '')
 
 
+def _build_survey_stats(registration, questions=None):
+    result = None
+    if registration.survey_submission:
+        survey_submission = registration.survey_submission[0]
+        if questions is None:
+            questions = get_all_survey_questions(registration)
+        result = _SurveyStats(survey_submission.survey_version,
+                              survey_submission.details,
+                              questions)
+    return result
+
+
+def _get_course_users(course):
+    for username in ICourseEnrollments(course).iter_principals():
+        user = User.get_user(username)
+        if user is not None:
+            yield user
+
+
+def build_registration_stats(course=None, users=None):
+    """
+    Build the registration and survey stats for the given users (or all
+    users enrolled in the given course) at once, returning a mapping of
+    user to a (`_RegistrationStats`, `_SurveyStats`) tuple. Either may be
+    None if the user has not registered or submitted a survey.
+    """
+    if users is None:
+        users = _get_course_users(course)
+    registrations = get_user_registrations_by_user(users, course=course)
+    # The question set is shared by everyone in a registration.
+    questions = {}
+    result = {}
+    for user, records in registrations.items():
+        registration_stats = survey_stats = None
+        if records:
+            record = records[0]
+            registration_stats = _RegistrationStats(record)
+            registration_id = record.registration_id
+            if registration_id not in questions:
+                questions[registration_id] = get_all_survey_questions(record)
+            survey_stats = _build_survey_stats(record,
+                                               questions[registration_id])
+        result[user] = (registration_stats, survey_stats)
+    return result
+
+
+_active_stats = threading.local()
+
+
+@contextmanager
+def bulk_registration_stats(course=None, users=None):
+    """
+    Build the stats for many users at once and make them available to
+    any `_RegistrationStatsSource` for the same course created in this
+    thread while the context is active.
+    """
+    stats = build_registration_stats(course=course, users=users)
+    previous = getattr(_active_stats, 'stats', None)
+    active = dict(previous or {})
+    active[course] = stats
+    _active_stats.stats = active
+    try:
+        yield stats
+    finally:
+        _active_stats.stats = previous
+
+
 @interface.implementer(IAnalyticsStatsSource)
 class _RegistrationStatsSource(object):
     """
@@ -76,6 +152,13 @@ class _RegistrationStatsSource(object):
         self.user = user
         self.course = course
 
+    @Lazy
+    def _bulk_stats(self):
+        # Stats built for another course are filtered differently.
+        stats = getattr(_active_stats, 'stats', None) or {}
+        stats = stats.get(self.course)
+        return stats.get(self.user) if stats is not None else None
+
     @Lazy
     def _registrations(self):
         records = get_user_registrations(user=self.user, course=self.course)
@@ -83,6 +166,8 @@ class _RegistrationStatsSource(object):
 
     @Lazy
     def RegistrationStats(self):
+        if self._bulk_stats is not None:
+            return self._bulk_stats[0]
         registration = self._registrations
         result = None
         if registration is not None:
@@ -91,14 +176,10 @@ class _RegistrationStatsSource(object):
 
     @Lazy
     def RegistrationSurveyStats(self):
+        if self._bulk_stats is not None:
+            return self._bulk_stats[1]
         registration = self._registrations
         result = None
-        # pylint: disable=no-member
-        if registration is not None and registration.survey_submission:
-            survey_submission = registration.survey_submission[0]
-            survey_results = survey_submission.details
-            all_questions = get_all_survey_questions(registration)
-            survey_version = survey_submission.survey_version
-            result = _SurveyStats(survey_version, survey_results, 
-                                  all_questions)
+        if registration is not None:
+            result = _build_survey_stats(registration)
         return result
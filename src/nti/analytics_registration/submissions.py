@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+A write-behind queue for registration and survey submissions, so that
+registration waves do not write to the analytics database inside each
+user's request.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import sqlite3
+import threading
+
+from collections import Counter
+from collections import namedtuple
+
+from datetime import datetime
+
+from weakref import WeakKeyDictionary
+
+import simplejson as json
+
+import transaction
+
+from six import string_types
+
+from zope import component
+from zope import interface
+
+from nti.analytics.common import timestamp_type
+
+from nti.analytics.sessions import get_nti_session_id
+
+from nti.analytics_registration.database import registration as db_registration
+
+from nti.analytics_registration.exceptions import NoUserRegistrationException
+from nti.analytics_registration.exceptions import InvalidCourseMappingException
+from nti.analytics_registration.exceptions import DuplicateUserRegistrationException
+from nti.analytics_registration.exceptions import DuplicateRegistrationSurveyException
+
+from nti.analytics_registration.interfaces import IRegistrationSubmissionQueue
+
+from nti.dataserver.interfaces import IDataserverTransactionRunner
+
+from nti.dataserver.users import User
+
+#: Submission kinds, drained in this order.
+REGISTRATION = 'registration'
+SURVEY = 'survey'
+KINDS = (REGISTRATION, SURVEY)
+
+#: The fields of queued registration data.
+REGISTRATION_FIELDS = ('school', 'grade_teaching', 'course_ntiid',
+                       'phone', 'employee_id', 'session_range')
+
+RegistrationData = namedtuple('RegistrationData', REGISTRATION_FIELDS)
+
+#: How many times a submission may fail to be stored before it is no
+#: longer drained.
+MAX_ATTEMPTS = 5
+
+#: The outcome of submissions that failed to be stored.
+FAILED = 'failed'
+
+#: The outcome of submissions whose user no longer exists.
+MISSING_USER = 'missing_user'
+
+#: The stored outcomes removing submissions from the queue; submissions
+#: with any other outcome are recorded as a failed attempt.
+COMPLETED = (db_registration.STORED, db_registration.DUPLICATE)
+
+#: The format of queued (naive, UTC) datetime timestamps.
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@interface.implementer(IRegistrationSubmissionQueue)
+class SQLiteSubmissionQueue(object):
+    """
+    A submission queue stored in a local SQLite database file.
+    Submissions failing `max_attempts` times are kept, but no longer
+    drained, and may be submitted again.
+    """
+
+    def __init__(self, path, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS submissions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    registration_ds_id TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    enqueued REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (kind, registration_ds_id, username))""")
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path)
+        return connection
+
+    def enqueue(self, kind, registration_ds_id, username, payload):
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    'DELETE FROM submissions WHERE kind = ? '
+                    'AND registration_ds_id = ? AND username = ? '
+                    'AND attempts >= ?',
+                    (kind, registration_ds_id, username, self.max_attempts))
+                connection.execute(
+                    'INSERT INTO submissions '
+                    '(kind, registration_ds_id, username, payload, enqueued) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (kind, registration_ds_id, username,
+                     json.dumps(payload), time.time()))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def is_pending(self, kind, registration_ds_id, username):
+        row = self._connection().execute(
+            'SELECT 1 FROM submissions WHERE kind = ? '
+            'AND registration_ds_id = ? AND username = ? AND attempts < ?',
+            (kind, registration_ds_id, username, self.max_attempts)).fetchone()
+        return row is not None
+
+    def peek(self, limit):
+        rows = self._connection().execute(
+            'SELECT id, kind, registration_ds_id, username, payload '
+            'FROM submissions WHERE attempts < ? ORDER BY id LIMIT ?',
+            (self.max_attempts, limit))
+        return [row[:4] + (json.loads(row[4]),) for row in rows]
+
+    def _update(self, sql, ids):
+        ids = list(ids)
+        with self._connection() as connection:
+            for idx in range(0, len(ids), 500):
+                chunk = ids[idx:idx + 500]
+                connection.execute(sql % ', '.join('?' * len(chunk)), chunk)
+
+    def ack(self, ids):
+        self._update('DELETE FROM submissions WHERE id IN (%s)', ids)
+
+    def fail(self, ids):
+        self._update('UPDATE submissions SET attempts = attempts + 1 '
+                     'WHERE id IN (%s)', ids)
+
+    def depth(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM submissions WHERE attempts < ?',
+            (self.max_attempts,)).fetchone()[0]
+
+    def failed(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM submissions WHERE attempts >= ?',
+            (self.max_attempts,)).fetchone()[0]
+
+    def lag(self):
+        oldest = self._connection().execute(
+            'SELECT MIN(enqueued) FROM submissions WHERE attempts < ?',
+            (self.max_attempts,)).fetchone()[0]
+        return time.time() - oldest if oldest is not None else 0
+
+
+def _dump_timestamp(timestamp):
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is not None:
+            timestamp = (timestamp - timestamp.utcoffset()).replace(tzinfo=None)
+        return timestamp.strftime(TIMESTAMP_FORMAT)
+    return timestamp
+
+
+def _load_timestamp(value):
+    if isinstance(value, string_types):
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+    return timestamp_type(value)
+
+
+#: The submissions queued in each open transaction, enqueued on commit.
+_transaction_submissions = WeakKeyDictionary()
+
+
+def _enqueue_submissions(success, submissions):
+    if not success:
+        return
+    for queue, key, payload in submissions:
+        # Errors raised by after commit hooks are swallowed; log them
+        # with the submission so it may be recovered.
+        try:
+            queued = queue.enqueue(*(key + (payload,)))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Could not queue submission (%s) (%s) (%s) (%s)',
+                             *(key + (payload,)))
+            continue
+        if not queued:
+            # Queued concurrently by another request.
+            logger.warning('Dropping duplicate submission (%s) (%s) (%s)',
+                           *key)
+
+
+def _get_transaction_submissions():
+    txn = transaction.get()
+    result = _transaction_submissions.get(txn)
+    if result is None:
+        result = _transaction_submissions[txn] = []
+        txn.addAfterCommitHook(_enqueue_submissions, args=(result,))
+    return result
+
+
+def _enqueue_on_commit(queue, kind, registration_ds_id, username, payload):
+    submissions = _get_transaction_submissions()
+    submissions.append((queue, (kind, registration_ds_id, username), payload))
+
+
+def _is_queued(queue, kind, registration_ds_id, username):
+    key = (kind, registration_ds_id, username)
+    submissions = _transaction_submissions.get(transaction.get(), ())
+    return (any(x[0] is queue and x[1] == key for x in submissions)
+            or queue.is_pending(kind, registration_ds_id, username))
+
+
+def queue_registration_data(queue, user, timestamp, registration_ds_id, data):
+    """
+    Validate the registration against the cached rules and queue it
+    once the current transaction commits.
+    """
+    registration_id = db_registration.get_registration_id(registration_ds_id)
+    if registration_id is None:
+        raise InvalidCourseMappingException()
+    db_registration._validate_registration(registration_id,
+                                           registration_ds_id,
+                                           data)
+    username = user.username
+    if (_is_queued(queue, REGISTRATION, registration_ds_id, username)
+            or db_registration.get_registration_status(user, registration_ds_id)[0]):
+        raise DuplicateUserRegistrationException()
+    payload = {x: getattr(data, x, None) for x in REGISTRATION_FIELDS}
+    payload['timestamp'] = _dump_timestamp(timestamp)
+    payload['session_id'] = get_nti_session_id()
+    _enqueue_on_commit(queue, REGISTRATION, registration_ds_id,
+                       username, payload)
+
+
+def queue_registration_survey_data(queue, user, timestamp, registration_ds_id,
+                                   version, data):
+    """
+    Queue the survey submission once the current transaction commits.
+    The user must have registered, or have a queued registration.
+    """
+    username = user.username
+    registered, surveyed = db_registration.get_registration_status(user,
+                                                                   registration_ds_id)
+    if (not registered
+            and not _is_queued(queue, REGISTRATION, registration_ds_id, username)):
+        raise NoUserRegistrationException()
+    if surveyed or _is_queued(queue, SURVEY, registration_ds_id, username):
+        raise DuplicateRegistrationSurveyException()
+    payload = {'timestamp': _dump_timestamp(timestamp),
+               'session_id': get_nti_session_id(),
+               'version': version,
+               'data': data}
+    _enqueue_on_commit(queue, SURVEY, registration_ds_id, username, payload)
+
+
+def _registration_item(user, payload):
+    data = RegistrationData(*[payload.get(x) for x in REGISTRATION_FIELDS])
+    return (user, _load_timestamp(payload['timestamp']),
+            payload['session_id'], data)
+
+
+def _survey_item(user, payload):
+    return (user, _load_timestamp(payload['timestamp']),
+            payload['session_id'], payload['version'], payload['data'])
+
+
+def _get_user(username):
+    return User.get_user(username)
+
+
+def _store_submissions(submissions):
+    """
+    Bulk store the submissions, grouped by kind and registration, and
+    return a map of submission id to outcome.
+    """
+    groups = {}
+    for submission_id, kind, registration_ds_id, username, payload in submissions:
+        groups.setdefault((kind, registration_ds_id), []).append(
+            (submission_id, username, payload))
+    result = {}
+    for kind in KINDS:
+        for (group_kind, registration_ds_id), rows in groups.items():
+            if group_kind != kind:
+                continue
+            ids = []
+            items = []
+            for submission_id, username, payload in rows:
+                user = _get_user(username)
+                if user is None:
+                    logger.warning('Missing user for submission (%s)',
+                                   username)
+                    result[submission_id] = MISSING_USER
+                    continue
+                ids.append(submission_id)
+                if kind == REGISTRATION:
+                    items.append(_registration_item(user, payload))
+                else:
+                    items.append(_survey_item(user, payload))
+            if kind == REGISTRATION:
+                outcomes = db_registration.store_registration_data_batch(registration_ds_id,
+                                                                         items)
+            else:
+                outcomes = db_registration.store_registration_survey_data_batch(registration_ds_id,
+                                                                                items)
+            result.update(zip(ids, outcomes))
+    return result
+
+
+def _complete(queue, outcomes):
+    """
+    Remove the stored (or duplicate) submissions from the queue, record a
+    failed attempt for the others, and return a count of the outcomes.
+    """
+    completed = [k for k, v in outcomes.items() if v in COMPLETED]
+    rejected = [k for k, v in outcomes.items() if v not in COMPLETED]
+    queue.ack(completed)
+    if rejected:
+        logger.warning('Could not store submissions (%s)', len(rejected))
+        queue.fail(rejected)
+    return Counter(outcomes.values())
+
+
+def _run_in_transaction(func):
+    runner = component.getUtility(IDataserverTransactionRunner)
+    return runner(func)
+
+
+def _store_each(queue, submissions, runner):
+    """
+    Store the submissions one at a time, recording a failed attempt for
+    those that cannot be stored so they do not block the queue.
+    """
+    outcomes = {}
+    for submission in submissions:
+        try:
+            outcomes.update(runner(lambda s=submission: _store_submissions((s,))))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Could not store submission (%s) (%s) (%s)',
+                             *submission[1:4])
+            outcomes[submission[0]] = FAILED
+    return _complete(queue, outcomes)
+
+
+def drain_submissions(queue, batch_size=500, runner=_run_in_transaction):
+    """
+    Store up to `batch_size` pending submissions with bulk inserts and
+    remove them from the queue once committed. `runner` is called with a
+    function to run in a dataserver transaction. Submissions stored twice (e.g. on
+    a retry after a crash) are reported as duplicates. If the batch
+    fails, its submissions are stored one at a time and those failing
+    are reported as :const:`FAILED`. Submissions not stored (e.g. invalid
+    registrations or surveys of users not registered) are recorded as a
+    failed attempt, and set aside once out of attempts. Returns a count
+    of the outcomes.
+    """
+    submissions = queue.peek(batch_size)
+    if not submissions:
+        return Counter()
+    try:
+        outcomes = runner(lambda: _store_submissions(submissions))
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Could not store submission batch (%s)',
+                         len(submissions))
+        result = _store_each(queue, submissions, runner)
+    else:
+        result = _complete(queue, outcomes)
+    if result.get(db_registration.DUPLICATE):
+        logger.info('Duplicate queued submissions (%s)',
+                    result[db_registration.DUPLICATE])
+    return result
+
+
+class SubmissionQueueWorker(object):
+    """
+    A background thread that drains the queue until stopped.
+    """
+
+    def __init__(self, queue, batch_size=500, interval=1,
+                 runner=_run_in_transaction):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.runner = runner
+        self.stats = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                result = drain_submissions(self.queue, self.batch_size,
+                                           self.runner)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Could not drain submission queue')
+                result = None
+            if result:
+                self.stats.update(result)
+            else:
+                self._stopped.wait(self.interval)
+
+    def metrics(self):
+        """
+        Return the queue depth, lag and number of failed submissions,
+        and the stored outcome counts.
+        """
+        return {'depth': self.queue.depth(),
+                'lag': self.queue.lag(),
+                'failed': self.queue.failed(),
+                'outcomes': dict(self.stats)}
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run,
+                                        name='registration-submissions')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
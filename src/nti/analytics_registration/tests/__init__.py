@@ -4,3 +4,105 @@
 from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
+
+from datetime import datetime
+
+import transaction
+
+from zope import component
+from zope import interface
+
+from nti.analytics.database.database import AnalyticsDB
+
+from nti.analytics.database.interfaces import IAnalyticsDB
+
+from nti.analytics.database.tests import AnalyticsTestBase
+
+from nti.analytics_registration.loader import Rule
+from nti.analytics_registration.loader import Session
+
+from nti.analytics_registration.submissions import RegistrationData
+
+from nti.analytics_registration.database.registration import store_registration_data
+from nti.analytics_registration.database.registration import store_registration_rules
+from nti.analytics_registration.database.registration import store_registration_sessions
+
+from nti.contenttypes.courses.interfaces import ICourseCatalogEntry
+
+REGISTRATION_DS_ID = u'tag:nextthought.com,2011-10:NTI-registration-test'
+
+COURSE_NTIID = u'tag:nextthought.com,2011-10:NTI-CourseInfo-course1'
+COURSE_NTIID2 = u'tag:nextthought.com,2011-10:NTI-CourseInfo-course2'
+
+RULES = (Rule(u'school1', u'K-5', u'math', COURSE_NTIID),
+         Rule(u'school1', u'6-8', u'science', COURSE_NTIID2),
+         Rule(u'school2', u'K-5', u'math', COURSE_NTIID))
+
+SESSIONS = (Session(u'June 1-5', u'math', COURSE_NTIID),
+            Session(u'June 8-12', u'science', COURSE_NTIID2))
+
+
+class MockUser(int):
+    """
+    A user known by its int ds id.
+    """
+
+    @property
+    def username(self):
+        return u'user%s' % int(self)
+
+
+@interface.implementer(ICourseCatalogEntry)
+class MockCatalogEntry(object):
+    """
+    A course, adaptable to itself as its catalog entry.
+    """
+
+    def __init__(self, ntiid):
+        self.ntiid = ntiid
+
+
+def registration_data(school=u'school1', grade_teaching=u'K-5',
+                      course_ntiid=COURSE_NTIID, session_range=u'June 1-5'):
+    return RegistrationData(school, grade_teaching, course_ntiid,
+                            u'555-555-5555', u'1234', session_range)
+
+
+class RegistrationTestBase(AnalyticsTestBase):
+    """
+    A base class with stored registration rules and sessions.
+    """
+
+    #: The database to use instead of the in-memory one, e.g. one
+    #: shared between threads.
+    dburi = None
+
+    def setUp(self):
+        super(RegistrationTestBase, self).setUp()
+        if self.dburi:
+            self._use_database(self.dburi)
+        transaction.abort()
+        store_registration_rules(REGISTRATION_DS_ID, RULES)
+        store_registration_sessions(REGISTRATION_DS_ID, SESSIONS)
+        self.session.flush()
+
+    def tearDown(self):
+        transaction.abort()
+        super(RegistrationTestBase, self).tearDown()
+
+    def _use_database(self, dburi):
+        gsm = component.getGlobalSiteManager()
+        gsm.unregisterUtility(self.db, IAnalyticsDB)
+        self.session.close()
+        self.db = AnalyticsDB(dburi=dburi, testmode=True)
+        gsm.registerUtility(self.db, IAnalyticsDB)
+        self.session = self.db.session
+
+    def commit(self):
+        transaction.commit()
+        # Test sessions are not joined to the zope transaction.
+        self.session.commit()
+
+    def register(self, user, data=None, timestamp=None):
+        store_registration_data(user, timestamp or datetime.utcnow(), None,
+                                REGISTRATION_DS_ID, data or registration_data())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import contains_inanyorder
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime
+
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    asyncio = None
+
+from nti.analytics_database import Base
+
+from nti.analytics_registration.database.registration import store_registration_survey_data
+
+from nti.analytics_registration.tests import COURSE_NTIID
+from nti.analytics_registration.tests import COURSE_NTIID2
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import MockCatalogEntry
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.analytics_registration.tests import registration_data
+
+_temp_dir = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(_temp_dir)
+
+
+@unittest.skipIf(asyncio is None, 'Python 3 only')
+class TestAsyncRegistrationReader(RegistrationTestBase):
+
+    # Pool threads have their own connections.
+    dburi = 'sqlite:///%s' % os.path.join(_temp_dir, 'analytics.db')
+
+    def setUp(self):
+        super(TestAsyncRegistrationReader, self).setUp()
+        self.user1 = MockUser(1001)
+        self.user2 = MockUser(1002)
+        self.register(self.user1)
+        self.register(self.user2,
+                      registration_data(grade_teaching=u'6-8',
+                                        course_ntiid=COURSE_NTIID2))
+        store_registration_survey_data(self.user1, datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'1',
+                                       {u'q1': u'yes', u'q2': [1, 2]})
+        self.commit()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        self.session.close()
+        Base.metadata.drop_all(self.db.engine)
+        super(TestAsyncRegistrationReader, self).tearDown()
+
+    def test_reader(self):
+        from nti.analytics_registration.asynchronous import AsyncRegistrationReader
+        reader = AsyncRegistrationReader(max_workers=4)
+        try:
+            calls = asyncio.gather(
+                reader.get_user_registrations(user=self.user1,
+                                              registration_ds_id=REGISTRATION_DS_ID),
+                reader.get_registration_rules(REGISTRATION_DS_ID),
+                reader.get_all_survey_questions(REGISTRATION_DS_ID),
+                reader.get_course_registrations((MockCatalogEntry(COURSE_NTIID),
+                                                 MockCatalogEntry(COURSE_NTIID2)),
+                                                registration_ds_id=REGISTRATION_DS_ID))
+            registrations, rules, questions, by_course = self.loop.run_until_complete(calls)
+        finally:
+            reader.close()
+
+        assert_that(registrations, has_length(1))
+        # Surveys are loaded before the pool session is closed.
+        survey = registrations[0].survey_submission[0]
+        assert_that(survey.survey_version, is_(u'1'))
+        assert_that({x.question_id: x.response for x in survey.details},
+                    is_({u'q1': u'yes', u'q2': [1, 2]}))
+
+        assert_that(rules, has_length(3))
+        assert_that(questions, contains_inanyorder(u'q1', u'q2'))
+
+        course1, course2 = by_course
+        assert_that([x.user_registration_id for x in course1],
+                    is_([registrations[0].user_registration_id]))
+        assert_that(course2, has_length(1))
+        assert_that(course2[0].grade_teaching, is_(u'6-8'))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import assert_that
+
+from zope import interface
+
+from ZODB.POSException import ConflictError
+
+from nti.analytics_registration import enrollment
+
+from nti.analytics_registration.database.registration import get_user_registrations
+from nti.analytics_registration.database.registration import store_registration_rules
+
+from nti.analytics_registration.enrollment import FAILED
+from nti.analytics_registration.enrollment import NO_USER
+from nti.analytics_registration.enrollment import ENROLLED
+from nti.analytics_registration.enrollment import NO_COURSE
+from nti.analytics_registration.enrollment import ALREADY_ENROLLED
+from nti.analytics_registration.enrollment import COURSE_NOT_FOUND
+
+from nti.analytics_registration.enrollment import enroll_registrations
+from nti.analytics_registration.enrollment import enroll_registered_users
+
+from nti.analytics_registration.tests import RULES
+from nti.analytics_registration.tests import COURSE_NTIID
+from nti.analytics_registration.tests import COURSE_NTIID2
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.analytics_registration.tests import registration_data
+
+from nti.contenttypes.courses.interfaces import ES_PUBLIC
+
+from nti.contenttypes.courses.interfaces import ICourseInstance
+from nti.contenttypes.courses.interfaces import ICourseEnrollmentManager
+
+
+@interface.implementer(ICourseInstance, ICourseEnrollmentManager)
+class MockCourse(object):
+    """
+    A course that is its own enrollment manager, failing the first
+    `failures` enrollments with `error`.
+    """
+
+    def __init__(self, failures=0, error=ValueError):
+        self.enrolled = {}
+        self.failures = failures
+        self.error = error
+
+    def enroll(self, user, scope=ES_PUBLIC):
+        if self.failures:
+            self.failures -= 1
+            raise self.error()
+        self.enrolled[user] = scope
+        return True
+
+
+class TestEnrollment(RegistrationTestBase):
+
+    def setUp(self):
+        super(TestEnrollment, self).setUp()
+        self.courses = {COURSE_NTIID: MockCourse(),
+                        COURSE_NTIID2: MockCourse()}
+        self.missing = set()
+        self._old = (enrollment._get_user,
+                     enrollment.find_object_with_ntiid,
+                     enrollment.get_enrollment_record)
+        enrollment._get_user = self._get_user
+        enrollment.find_object_with_ntiid = self.courses.get
+        enrollment.get_enrollment_record = lambda course, user: course.enrolled.get(user)
+
+    def tearDown(self):
+        (enrollment._get_user,
+         enrollment.find_object_with_ntiid,
+         enrollment.get_enrollment_record) = self._old
+        super(TestEnrollment, self).tearDown()
+
+    def _get_user(self, username):
+        if username in self.missing:
+            return None
+        return MockUser(int(username[len('user'):]))
+
+    def test_enroll_registered_users(self):
+        user1, user2, user3, user4 = [MockUser(x) for x in range(1001, 1005)]
+        self.register(user1)
+        self.register(user2, registration_data(grade_teaching=u'6-8',
+                                               course_ntiid=COURSE_NTIID2,
+                                               session_range=u'June 8-12'))
+        self.register(user3, registration_data(school=u'school2'))
+        self.register(user4)
+        course1 = self.courses[COURSE_NTIID]
+        course1.enrolled[user3] = ES_PUBLIC
+        self.missing.add(user4.username)
+
+        result = list(enroll_registered_users(REGISTRATION_DS_ID, page_size=2))
+        assert_that([x[1:] for x in result],
+                    is_([(COURSE_NTIID, ENROLLED),
+                         (COURSE_NTIID2, ENROLLED),
+                         (COURSE_NTIID, ALREADY_ENROLLED),
+                         (COURSE_NTIID, NO_USER)]))
+        assert_that(course1.enrolled, is_({user1: ES_PUBLIC, user3: ES_PUBLIC}))
+
+        # Running again is safe.
+        del self.courses[COURSE_NTIID2]
+        result = list(enroll_registered_users(REGISTRATION_DS_ID))
+        assert_that([x[2] for x in result],
+                    is_([ALREADY_ENROLLED, COURSE_NOT_FOUND,
+                         ALREADY_ENROLLED, NO_USER]))
+
+    def test_resolved_users(self):
+        user = MockUser(1001)
+        self.register(user)
+        self.missing.add(user.username)
+        # Users already resolved on the registrations are used as is.
+        records = get_user_registrations(user, REGISTRATION_DS_ID)
+        result = enroll_registrations(records)
+        assert_that(result, is_([(records[0], COURSE_NTIID, ENROLLED)]))
+
+    def test_no_course(self):
+        user = MockUser(1001)
+        self.register(user, registration_data(school=u'school2',
+                                              session_range=u'July 6-10'))
+        store_registration_rules(REGISTRATION_DS_ID, RULES[:2])
+        records = get_user_registrations(user, REGISTRATION_DS_ID)
+        result = enroll_registrations(records)
+        assert_that(result, is_([(records[0], None, NO_COURSE)]))
+
+    def test_retries(self):
+        user = MockUser(1001)
+        self.register(user)
+        records = get_user_registrations(user, REGISTRATION_DS_ID)
+        course = self.courses[COURSE_NTIID]
+
+        course.failures = 2
+        result = enroll_registrations(records, retries=1)
+        assert_that(result[0][2], is_(FAILED))
+        assert_that(course.enrolled, is_({}))
+
+        course.failures = 1
+        result = enroll_registrations(records, retries=1)
+        assert_that(result[0][2], is_(ENROLLED))
+        assert_that(course.enrolled, is_({user: ES_PUBLIC}))
+
+    def test_conflict(self):
+        user = MockUser(1001)
+        self.register(user)
+        records = get_user_registrations(user, REGISTRATION_DS_ID)
+        # Conflicts are not retried; the transaction must be.
+        self.courses[COURSE_NTIID] = MockCourse(failures=1, error=ConflictError)
+        with self.assertRaises(ConflictError):
+            enroll_registrations(records)
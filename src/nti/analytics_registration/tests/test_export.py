@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import contains_string
+
+import six
+
+from datetime import datetime
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_registration.database.registration import store_registration_survey_data
+
+from nti.analytics_registration.export import build_survey_pivot
+from nti.analytics_registration.export import write_survey_responses_csv
+
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import COURSE_NTIID2
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.analytics_registration.tests import registration_data
+
+
+def _csv_stream():
+    return six.BytesIO() if six.PY2 else six.StringIO()
+
+
+def _csv_text(stream):
+    result = stream.getvalue()
+    if six.PY2:
+        result = result.decode('utf-8')
+    return result
+
+
+class TestExport(RegistrationTestBase):
+
+    def setUp(self):
+        super(TestExport, self).setUp()
+        self.user1 = MockUser(1001)
+        self.register(self.user1)
+        store_registration_survey_data(self.user1, datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'1',
+                                       {u'q1': u'caf\xe9',
+                                        u'q2': [u'\xfcber', u'plain']})
+
+    def test_responses_csv(self):
+        stream = _csv_stream()
+        count = write_survey_responses_csv(REGISTRATION_DS_ID, stream)
+        assert_that(count, is_(2))
+        text = _csv_text(stream)
+        assert_that(text, contains_string(u'user1001,1,q1,caf\xe9'))
+
+    def test_pivot_csv(self):
+        table = build_survey_pivot(REGISTRATION_DS_ID)
+        stream = _csv_stream()
+        table.write_csv(stream)
+        text = _csv_text(stream)
+        assert_that(text, contains_string(u'caf\xe9'))
+        assert_that(text, contains_string(u'\xfcber, plain'))
+
+    def test_pivot(self):
+        user2, user3 = MockUser(1002), MockUser(1003)
+        self.register(user2)
+        self.register(user3, registration_data(grade_teaching=u'6-8',
+                                               course_ntiid=COURSE_NTIID2))
+        store_registration_survey_data(user3, datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'2',
+                                       {u'q1': u'no'})
+        # Registrations of users without a username are not merged.
+        self.session.query(Users).filter(
+            Users.user_ds_id.in_((1001, 1003))
+        ).update({Users.username: None}, synchronize_session=False)
+
+        table = build_survey_pivot(REGISTRATION_DS_ID)
+        assert_that(table, has_length(3))
+        assert_that(table.column('username'), is_([None, u'user1002', None]))
+        assert_that(table.column('survey_version'), is_([u'1', None, u'2']))
+        assert_that(table.column('q1'), is_([u'caf\xe9', u'', u'no']))
+        assert_that(table.column('q2'), is_([u'\xfcber, plain', u'', u'']))
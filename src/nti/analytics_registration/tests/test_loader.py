@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import has_length
+from hamcrest import assert_that
+
+import io
+
+import six
+
+from nti.analytics_registration.database.registration import get_registration_rules
+from nti.analytics_registration.database.registration import get_registration_sessions
+
+from nti.analytics_registration.loader import LoadError
+from nti.analytics_registration.loader import LoadResult
+
+from nti.analytics_registration.loader import load_registration_rules
+from nti.analytics_registration.loader import load_registration_sessions
+
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import RegistrationTestBase
+
+RULES_CSV = u"""School,Grade Teaching,Curriculum,NTIID,Notes
+school1,K-5,math,course1,
+school1,6-8,science,course2,new
+school2,K-5
+
+school3,,art,course1,
+school3,%s,art,course1,
+school2,K-5,math,course1,
+""" % (u'9' * 33)
+
+SESSIONS_TSV = u"""Session\tCurriculum\tCourse NTIID
+June 15-19\tmath\tcourse1
+June 22-26\t\tcourse2
+"""
+
+
+def _stream(value):
+    # The csv module reads bytes on Python 2.
+    if six.PY2:
+        return io.BytesIO(value.encode('utf-8'))
+    return io.StringIO(value)
+
+
+def _rule_keys(registration_ds_id=REGISTRATION_DS_ID):
+    rules = get_registration_rules(registration_ds_id) or ()
+    return [(x.school, x.grade_teaching, x.curriculum, x.course_ntiid)
+            for x in rules]
+
+
+class TestLoader(RegistrationTestBase):
+
+    def test_load_rules(self):
+        progress = []
+        result = load_registration_rules(REGISTRATION_DS_ID, _stream(RULES_CSV),
+                                         chunk_size=2,
+                                         progress=lambda *args: progress.append(args))
+        assert_that(result,
+                    is_(LoadResult(3, [LoadError(4, 'Expected 5 columns, found 2'),
+                                       LoadError(6, 'Missing grade'),
+                                       LoadError(7, 'grade longer than 32 characters')])))
+        # Written a chunk at a time, replacing the stored rules.
+        assert_that(progress, is_([(2, 0), (3, 3)]))
+        assert_that(_rule_keys(),
+                    is_([(u'school1', u'K-5', u'math', u'course1'),
+                         (u'school1', u'6-8', u'science', u'course2'),
+                         (u'school2', u'K-5', u'math', u'course1')]))
+
+    def test_load_sessions(self):
+        result = load_registration_sessions(REGISTRATION_DS_ID,
+                                            _stream(SESSIONS_TSV),
+                                            truncate=False, delimiter='\t')
+        assert_that(result, is_(LoadResult(1, [LoadError(3, 'Missing curriculum')])))
+        sessions = get_registration_sessions(REGISTRATION_DS_ID)
+        assert_that(sessions, has_length(3))
+        assert_that(sessions[-1].session_range, is_(u'June 15-19'))
+        assert_that(sessions[-1].course_ntiid, is_(u'course1'))
+
+    def test_rejected_files(self):
+        # Stored rules are only truncated once a valid chunk is read.
+        rules = _rule_keys()
+        stream = _stream(u'School,Grade,Curriculum\nschool1,K-5,math\n')
+        result = load_registration_rules(REGISTRATION_DS_ID, stream)
+        assert_that(result,
+                    is_(LoadResult(0, [LoadError(1, 'Missing columns: course_ntiid')])))
+
+        stream = _stream(u'School,Grade,Curriculum,Course NTIID\nschool1,K-5,,c1\n')
+        result = load_registration_rules(REGISTRATION_DS_ID, stream)
+        assert_that(result, is_(LoadResult(0, [LoadError(2, 'Missing curriculum')])))
+
+        result = load_registration_rules(REGISTRATION_DS_ID, _stream(u''))
+        assert_that(result, is_(LoadResult(0, [LoadError(1, 'Empty file')])))
+        assert_that(_rule_keys(), is_(rules))
+
+    def test_header_only(self):
+        # A valid, empty file replaces the stored rules.
+        stream = _stream(u'school,grade,curriculum,course_ntiid\n')
+        result = load_registration_rules(REGISTRATION_DS_ID, stream)
+        assert_that(result, is_(LoadResult(0, [])))
+        assert_that(_rule_keys(), is_([]))
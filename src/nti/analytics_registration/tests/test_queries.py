@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import is_not
+from hamcrest import has_length
+from hamcrest import assert_that
+
+from datetime import datetime
+
+from nti.analytics_registration.loader import Session
+
+from nti.analytics_registration.database.registration import iter_user_registrations
+from nti.analytics_registration.database.registration import get_registration_rules
+from nti.analytics_registration.database.registration import get_user_registrations
+from nti.analytics_registration.database.registration import resolve_session_course
+from nti.analytics_registration.database.registration import resolve_session_courses
+from nti.analytics_registration.database.registration import get_registration_counts
+from nti.analytics_registration.database.registration import get_registration_sessions
+from nti.analytics_registration.database.registration import append_registration_sessions
+from nti.analytics_registration.database.registration import get_user_registrations_page
+from nti.analytics_registration.database.registration import store_registration_survey_data
+from nti.analytics_registration.database.registration import get_user_registrations_by_user
+from nti.analytics_registration.database.registration import get_survey_response_distribution
+
+from nti.analytics_registration.tests import COURSE_NTIID
+from nti.analytics_registration.tests import COURSE_NTIID2
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import MockCatalogEntry
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.analytics_registration.tests import registration_data
+
+
+class TestRegistrationQueries(RegistrationTestBase):
+
+    def setUp(self):
+        super(TestRegistrationQueries, self).setUp()
+        self.users = [MockUser(x) for x in range(1001, 1005)]
+        user1, user2, user3, user4 = self.users
+        self.register(user1, timestamp=datetime(2017, 1, 5))
+        self.register(user2, timestamp=datetime(2017, 1, 20))
+        self.register(user3,
+                      registration_data(school=u'school2',
+                                        session_range=u'June 8-12'),
+                      timestamp=datetime(2017, 2, 1))
+        self.register(user4,
+                      registration_data(grade_teaching=u'6-8',
+                                        course_ntiid=COURSE_NTIID2,
+                                        session_range=u'June 8-12'),
+                      timestamp=datetime(2017, 3, 1))
+
+    def _ids(self, records):
+        return [x.user_registration_id for x in records]
+
+    def _ids_of(self, rules):
+        return [x.registration_rule_id for x in rules]
+
+    def test_rules_and_sessions(self):
+        rules = get_registration_rules(REGISTRATION_DS_ID)
+        assert_that([x.grade_teaching for x in rules], is_([u'K-5', u'6-8', u'K-5']))
+        page = get_registration_rules(REGISTRATION_DS_ID, limit=2)
+        assert_that(self._ids_of(page), is_(self._ids_of(rules[:2])))
+        page = get_registration_rules(REGISTRATION_DS_ID, limit=2, offset=2)
+        assert_that(self._ids_of(page), is_(self._ids_of(rules[2:])))
+        page = get_registration_rules(REGISTRATION_DS_ID, sort_descending=True)
+        assert_that(self._ids_of(page), is_(self._ids_of(reversed(rules))))
+
+        assert_that(get_registration_rules(REGISTRATION_DS_ID, school=u'school1'),
+                    has_length(2))
+        assert_that(get_registration_rules(REGISTRATION_DS_ID, school=u'school1',
+                                           course_ntiid=COURSE_NTIID),
+                    has_length(1))
+        assert_that(get_registration_rules(REGISTRATION_DS_ID, curriculum=u'art'),
+                    none())
+        assert_that(get_registration_rules(u'unknown'), none())
+
+        sessions = get_registration_sessions(REGISTRATION_DS_ID)
+        assert_that([x.session_range for x in sessions],
+                    is_([u'June 1-5', u'June 8-12']))
+        sessions = get_registration_sessions(REGISTRATION_DS_ID,
+                                             course_ntiid=COURSE_NTIID2)
+        assert_that([x.curriculum for x in sessions], is_([u'science']))
+        sessions = get_registration_sessions(REGISTRATION_DS_ID, limit=1,
+                                             sort_descending=True)
+        assert_that([x.session_range for x in sessions], is_([u'June 8-12']))
+
+    def test_pages(self):
+        records = get_user_registrations(registration_ds_id=REGISTRATION_DS_ID)
+        ids = sorted(self._ids(records))
+
+        page, after = get_user_registrations_page(REGISTRATION_DS_ID, page_size=3)
+        assert_that(self._ids(page), is_(ids[:3]))
+        assert_that(after, is_(ids[2]))
+        page, after = get_user_registrations_page(REGISTRATION_DS_ID, after=after,
+                                                  page_size=3)
+        assert_that(self._ids(page), is_(ids[3:]))
+        assert_that(after, none())
+
+        records = iter_user_registrations(REGISTRATION_DS_ID, page_size=2)
+        assert_that(self._ids(records), is_(ids))
+        records = iter_user_registrations(REGISTRATION_DS_ID, page_size=2,
+                                          start_time=datetime(2017, 1, 10),
+                                          end_time=datetime(2017, 2, 10))
+        assert_that(self._ids(records), is_(ids[1:3]))
+
+        page, after = get_user_registrations_page(REGISTRATION_DS_ID,
+                                                  user=self.users[1])
+        assert_that(self._ids(page), is_(ids[1:2]))
+        page, after = get_user_registrations_page(REGISTRATION_DS_ID,
+                                                  user=MockUser(1010))
+        assert_that(page, has_length(0))
+        assert_that(after, none())
+
+    def test_counts(self):
+        counts = get_registration_counts(REGISTRATION_DS_ID)
+        assert_that(counts, is_([(u'school1', 3), (u'school2', 1)]))
+        counts = get_registration_counts(REGISTRATION_DS_ID,
+                                         group_by=('school', 'grade_teaching'))
+        assert_that(counts, is_([(u'school1', u'6-8', 1),
+                                 (u'school1', u'K-5', 2),
+                                 (u'school2', u'K-5', 1)]))
+        counts = get_registration_counts(REGISTRATION_DS_ID, group_by=(),
+                                         time_bucket='month')
+        assert_that(counts, is_([(u'2017-01', 2), (u'2017-02', 1),
+                                 (u'2017-03', 1)]))
+        counts = get_registration_counts(REGISTRATION_DS_ID, group_by=(),
+                                         by_course=True)
+        assert_that(counts, is_([(COURSE_NTIID, 3), (COURSE_NTIID2, 1)]))
+        counts = get_registration_counts(REGISTRATION_DS_ID,
+                                         start_time=datetime(2017, 1, 10),
+                                         end_time=datetime(2017, 2, 10))
+        assert_that(counts, is_([(u'school1', 1), (u'school2', 1)]))
+        assert_that(get_registration_counts(u'unknown'), is_([]))
+        with self.assertRaises(ValueError):
+            get_registration_counts(REGISTRATION_DS_ID, group_by=('phone',))
+        with self.assertRaises(ValueError):
+            get_registration_counts(REGISTRATION_DS_ID, time_bucket='week')
+
+    def test_distribution(self):
+        user1, user2, user3 = self.users[:3]
+        surveys = ((user1, {u'q1': u'yes', u'q2': [1, 2]}),
+                   (user2, {u'q1': u'no', u'q2': [2]}),
+                   (user3, {u'q1': u'yes'}))
+        for user, data in surveys:
+            store_registration_survey_data(user, datetime.utcnow(), None,
+                                           REGISTRATION_DS_ID, u'1', data)
+        result = get_survey_response_distribution(REGISTRATION_DS_ID)
+        assert_that(result, is_({(u'q1', u'1'): {u'yes': 2, u'no': 1},
+                                 (u'q2', u'1'): {1: 1, 2: 2}}))
+        result = get_survey_response_distribution(REGISTRATION_DS_ID,
+                                                  question_ids=(u'q1',))
+        assert_that(result, is_({(u'q1', u'1'): {u'yes': 2, u'no': 1}}))
+        assert_that(get_survey_response_distribution(u'unknown'), is_({}))
+
+    def test_distribution_distinct_responses(self):
+        # Responses differing only by case, or only after a long shared
+        # prefix, are counted separately.
+        prefix = u'x' * 2000
+        surveys = ((u'Yes', prefix + u'a'),
+                   (u'yes', prefix + u'b'),
+                   (u'yes', prefix + u'b'),
+                   (u'YES', prefix + u'a'))
+        for user, (answer, essay) in zip(self.users, surveys):
+            store_registration_survey_data(user, datetime.utcnow(), None,
+                                           REGISTRATION_DS_ID, u'1',
+                                           {u'q1': answer, u'q2': essay})
+        result = get_survey_response_distribution(REGISTRATION_DS_ID)
+        assert_that(result, is_({(u'q1', u'1'): {u'Yes': 1, u'yes': 2, u'YES': 1},
+                                 (u'q2', u'1'): {prefix + u'a': 2,
+                                                 prefix + u'b': 2}}))
+
+    def test_course_filter(self):
+        ids = [get_user_registrations(x, REGISTRATION_DS_ID)[0].user_registration_id
+               for x in self.users]
+        course1 = MockCatalogEntry(COURSE_NTIID)
+        course2 = MockCatalogEntry(COURSE_NTIID2)
+        records = get_user_registrations(registration_ds_id=REGISTRATION_DS_ID,
+                                         course=course1)
+        assert_that(sorted(self._ids(records)), is_(ids[:3]))
+        records = get_user_registrations(registration_ds_id=REGISTRATION_DS_ID,
+                                         course=course2)
+        assert_that(self._ids(records), is_(ids[3:]))
+        records = get_user_registrations(registration_ds_id=REGISTRATION_DS_ID,
+                                         course=course2,
+                                         match_course_rules=False)
+        assert_that(records, has_length(4))
+        records = get_user_registrations(self.users[0], course=course2)
+        assert_that(records, has_length(0))
+
+        user5 = MockUser(1005)
+        result = get_user_registrations_by_user((self.users[0], self.users[3], user5),
+                                                course=course1)
+        assert_that(self._ids(result[self.users[0]]), is_(ids[:1]))
+        assert_that(result[self.users[3]], has_length(0))
+        assert_that(result[user5], has_length(0))
+
+    def test_session_resolver(self):
+        assert_that(resolve_session_course(REGISTRATION_DS_ID, u'June 1-5', u'math'),
+                    is_(COURSE_NTIID))
+        assert_that(resolve_session_course(REGISTRATION_DS_ID, u'June 8-12', u'science'),
+                    is_(COURSE_NTIID2))
+        assert_that(resolve_session_course(REGISTRATION_DS_ID, u'June 8-12', u'math'),
+                    none())
+        assert_that(resolve_session_course(u'unknown', u'June 1-5', u'math'),
+                    none())
+
+        records = [get_user_registrations(x, REGISTRATION_DS_ID)[0]
+                   for x in self.users]
+        assert_that(resolve_session_courses(records),
+                    is_([COURSE_NTIID, COURSE_NTIID, None, COURSE_NTIID2]))
+
+        # Sessions mapping to more than one course resolve to nothing.
+        append_registration_sessions(REGISTRATION_DS_ID,
+                                     (Session(u'June 1-5', u'math', COURSE_NTIID2),))
+        assert_that(resolve_session_course(REGISTRATION_DS_ID, u'June 1-5', u'math'),
+                    none())
+        assert_that(resolve_session_courses(records)[3], is_not(none()))
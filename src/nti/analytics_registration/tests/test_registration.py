@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_key
+from hamcrest import does_not
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import contains_inanyorder
+
+import unittest
+
+from datetime import datetime
+
+import simplejson as json
+
+from sqlalchemy import text
+from sqlalchemy import DateTime
+
+import transaction
+
+from nti.analytics_database.users import Users
+
+from nti.analytics.database.users import get_or_create_user
+
+from nti.analytics.identifier import get_ds_id
+
+from nti.analytics_registration.loader import Rule
+from nti.analytics_registration.loader import Session
+
+from nti.analytics_registration.database.registration import STORED
+from nti.analytics_registration.database.registration import INVALID
+from nti.analytics_registration.database.registration import DUPLICATE
+from nti.analytics_registration.database.registration import NOT_REGISTERED
+from nti.analytics_registration.database.registration import UNIQUE_REGISTRATION_INDEX
+
+from nti.analytics_registration.database.registration import StoreDiffResult
+
+from nti.analytics_registration.database import registration as db_registration
+
+from nti.analytics_registration.database.registration import Registrations
+from nti.analytics_registration.database.registration import RegistrationEnrollmentRules
+
+from nti.analytics_registration.database.registration import _get_user_ids
+from nti.analytics_registration.database.registration import _rule_index_cache
+from nti.analytics_registration.database.registration import _get_rules_version
+from nti.analytics_registration.database.registration import _increment_version
+from nti.analytics_registration.database.registration import _get_surveys_version
+from nti.analytics_registration.database.registration import _session_index_cache
+from nti.analytics_registration.database.registration import _get_registration_ids
+from nti.analytics_registration.database.registration import _get_sessions_version
+from nti.analytics_registration.database.registration import _survey_questions_cache
+from nti.analytics_registration.database.registration import _insert_user_registrations
+from nti.analytics_registration.database.registration import _unique_registration_index
+
+from nti.analytics_registration.database.registration import get_rule_index
+from nti.analytics_registration.database.registration import decode_response
+from nti.analytics_registration.database.registration import get_registration
+from nti.analytics_registration.database.registration import get_registration_id
+from nti.analytics_registration.database.registration import get_registration_rules
+from nti.analytics_registration.database.registration import get_user_registrations
+from nti.analytics_registration.database.registration import resolve_session_course
+from nti.analytics_registration.database.registration import get_all_survey_questions
+from nti.analytics_registration.database.registration import store_registration_rules
+from nti.analytics_registration.database.registration import append_registration_rules
+from nti.analytics_registration.database.registration import delete_user_registrations
+from nti.analytics_registration.database.registration import get_registration_sessions
+from nti.analytics_registration.database.registration import get_or_create_registration
+from nti.analytics_registration.database.registration import store_registration_sessions
+from nti.analytics_registration.database.registration import store_registration_data_batch
+from nti.analytics_registration.database.registration import store_registration_survey_data
+from nti.analytics_registration.database.registration import store_registration_survey_data_batch
+
+from nti.analytics_registration.exceptions import NoUserRegistrationException
+from nti.analytics_registration.exceptions import InvalidCourseMappingException
+from nti.analytics_registration.exceptions import DuplicateUserRegistrationException
+from nti.analytics_registration.exceptions import DuplicateRegistrationSurveyException
+
+from nti.analytics_registration.tests import RULES
+from nti.analytics_registration.tests import SESSIONS
+from nti.analytics_registration.tests import COURSE_NTIID
+from nti.analytics_registration.tests import COURSE_NTIID2
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.analytics_registration.tests import registration_data
+
+
+class TestDecodeResponse(unittest.TestCase):
+
+    def test_decode_response(self):
+        values = (0, 7, 123456789012, -1, 1.5, None, True,
+                  u'', u'a', u'a, b', u'a"b', u'x\ny', u'caf\xe9', u'01',
+                  [], [u''], [u'a', u'b'], [u'a, b', 3], [0, 10, u'0'],
+                  [u'a"b'], [u'caf\xe9', 1], [[1, 2]], [True])
+        for value in values:
+            for separators in ((', ', ': '), (',', ':')):
+                for ensure_ascii in (True, False):
+                    raw = json.dumps(value, separators=separators,
+                                     ensure_ascii=ensure_ascii)
+                    assert_that(decode_response(raw), is_(json.loads(raw)),
+                                raw)
+        for raw in (u'[ 1 ]', u'[1 , 2]', u'["a",  "b"]'):
+            assert_that(decode_response(raw), is_(json.loads(raw)), raw)
+        # Dicts get int keys where possible.
+        assert_that(decode_response(u'{"1": "a", "2": [1]}'),
+                    is_({1: u'a', 2: [1]}))
+        assert_that(decode_response(u'{"a": 1}'), is_({u'a': 1}))
+        assert_that(decode_response(None), none())
+        with self.assertRaises(ValueError):
+            decode_response(u'007')
+
+
+class TestStoreRegistration(RegistrationTestBase):
+
+    def test_duplicate(self):
+        user = MockUser(1001)
+        self.register(user)
+        with self.assertRaises(DuplicateUserRegistrationException):
+            self.register(user)
+        assert_that(get_user_registrations(user, REGISTRATION_DS_ID),
+                    has_length(1))
+        # Other users may still register.
+        self.register(MockUser(1002))
+
+    def test_duplicate_without_index(self):
+        # Databases with duplicate registrations do not get the index.
+        self.session.execute(text('DROP INDEX %s' % UNIQUE_REGISTRATION_INDEX))
+        _unique_registration_index.pop(self.db, None)
+        try:
+            user = MockUser(1001)
+            self.register(user)
+            with self.assertRaises(DuplicateUserRegistrationException):
+                self.register(user)
+            assert_that(get_user_registrations(user, REGISTRATION_DS_ID),
+                        has_length(1))
+        finally:
+            _unique_registration_index.pop(self.db, None)
+
+    def test_invalid(self):
+        with self.assertRaises(InvalidCourseMappingException):
+            self.register(MockUser(1001),
+                          registration_data(school=u'unknown'))
+
+
+class TestRegistrations(RegistrationTestBase):
+
+    def test_registration_id(self):
+        registration_ids = _get_registration_ids(self.db)
+        registration_id = get_registration_id(REGISTRATION_DS_ID)
+        assert_that(get_registration(REGISTRATION_DS_ID).registration_id,
+                    is_(registration_id))
+        assert_that(get_registration_id(u'unknown'), none())
+        assert_that(get_registration(u'unknown'), none())
+        # Created registrations are cached once committed.
+        assert_that(registration_ids, does_not(has_key(REGISTRATION_DS_ID)))
+        transaction.commit()
+        assert_that(registration_ids, has_key(REGISTRATION_DS_ID))
+        assert_that(get_registration_id(REGISTRATION_DS_ID),
+                    is_(registration_id))
+
+        get_or_create_registration(u'other')
+        transaction.abort()
+        assert_that(registration_ids, does_not(has_key(u'other')))
+
+    def test_concurrent_create(self):
+        # Another worker creates the registration after our lookup.
+        existing = get_registration(REGISTRATION_DS_ID)
+        old_get_registration = db_registration.get_registration
+        db_registration.get_registration = lambda unused: None
+        try:
+            registration = get_or_create_registration(REGISTRATION_DS_ID)
+        finally:
+            db_registration.get_registration = old_get_registration
+        assert_that(registration.registration_id,
+                    is_(existing.registration_id))
+        count = self.session.query(Registrations).filter(
+            Registrations.registration_ds_id == REGISTRATION_DS_ID).count()
+        assert_that(count, is_(1))
+
+
+class TestRegistrationBatch(RegistrationTestBase):
+
+    def test_user_ids(self):
+        users = [MockUser(1001), MockUser(1002)]
+        user_ids = _get_user_ids(users, create=False)
+        assert_that(user_ids, has_length(0))
+
+        user_ids = _get_user_ids(users)
+        assert_that(user_ids, has_length(2))
+        records = self.session.query(Users).filter(
+            Users.user_ds_id.in_((1001, 1002))).all()
+        assert_that([x.username for x in records],
+                    contains_inanyorder(u'user1001', u'user1002'))
+        # Existing records are reused.
+        assert_that(_get_user_ids(users), is_(user_ids))
+
+    def _user_row(self, user):
+        record = self.session.query(Users).filter(
+            Users.user_ds_id == get_ds_id(user)).one()
+        return {x.key: getattr(record, x.key)
+                for x in Users.__mapper__.column_attrs
+                if (x.key != 'user_id'
+                    and not isinstance(x.columns[0].type, DateTime))}
+
+    def test_user_rows(self):
+        # Created records match those created one at a time.
+        user = MockUser(1001)
+        _get_user_ids((user,))
+        created = self._user_row(user)
+        transaction.abort()
+        get_or_create_user(user)
+        assert_that(created, is_(self._user_row(user)))
+
+    def test_batch_outcomes(self):
+        now = datetime.utcnow()
+        user1, user2, user3 = MockUser(1001), MockUser(1002), MockUser(1003)
+        self.register(user3)
+        invalid = registration_data(school=u'unknown')
+        items = [(user1, now, None, registration_data()),
+                 (user2, now, None, invalid),
+                 (user3, now, None, registration_data()),
+                 (user1, now, None, registration_data())]
+        result = store_registration_data_batch(REGISTRATION_DS_ID, items)
+        assert_that(result, is_([STORED, INVALID, DUPLICATE, DUPLICATE]))
+        assert_that(get_user_registrations(user1, REGISTRATION_DS_ID),
+                    has_length(1))
+        assert_that(get_user_registrations(user2, REGISTRATION_DS_ID),
+                    has_length(0))
+
+        # Rows are validated against the rule curriculum.
+        record = get_user_registrations(user1, REGISTRATION_DS_ID)[0]
+        assert_that(record.curriculum, is_(u'math'))
+
+    def test_batch_unknown_registration(self):
+        items = [(MockUser(1001), datetime.utcnow(), None, registration_data())]
+        result = store_registration_data_batch(u'unknown', items)
+        assert_that(result, is_([INVALID]))
+
+    def test_batch_concurrent_registration(self):
+        # A user registered after the duplicate probe is skipped rather
+        # than failing the whole batch.
+        user1, user2 = MockUser(1001), MockUser(1002)
+        self.register(user2)
+        existing = get_user_registrations(user2, REGISTRATION_DS_ID)[0]
+        user_ids = _get_user_ids((user1, user2))
+        mappings = [{'user_id': user_ids[user],
+                     'timestamp': datetime.utcnow(),
+                     'session_id': None,
+                     'registration_id': existing.registration_id,
+                     'school': u'school1',
+                     'grade_teaching': u'K-5',
+                     'phone': None,
+                     'curriculum': u'math',
+                     'employee_id': None,
+                     'session_range': u'June 1-5'} for user in (user1, user2)]
+        stored = _insert_user_registrations(mappings)
+        assert_that(stored, has_length(1))
+        assert_that(stored[0]['user_id'], is_(user_ids[user1]))
+        assert_that(get_user_registrations(user1, REGISTRATION_DS_ID),
+                    has_length(1))
+
+
+class TestRegistrationCaches(RegistrationTestBase):
+
+    def setUp(self):
+        super(TestRegistrationCaches, self).setUp()
+        self.registration_id = get_registration(REGISTRATION_DS_ID).registration_id
+
+    def test_rule_index(self):
+        registration_id = self.registration_id
+        entries = _rule_index_cache._get_entries()
+        # Rules changed in this transaction are read, but not cached.
+        index = get_rule_index(registration_id)
+        assert_that(index.get_curriculum(u'school1', u'6-8', COURSE_NTIID2),
+                    is_(u'science'))
+        assert_that(entries, does_not(has_key(registration_id)))
+
+        transaction.commit()
+        get_rule_index(registration_id)
+        assert_that(entries, has_key(registration_id))
+
+        store_registration_rules(REGISTRATION_DS_ID, RULES[:1])
+        index = get_rule_index(registration_id)
+        assert_that(index.get_curriculum(u'school1', u'6-8', COURSE_NTIID2),
+                    none())
+        # Other transactions still see the committed rules.
+        cached = entries[registration_id].value
+        assert_that(cached.get_curriculum(u'school1', u'6-8', COURSE_NTIID2),
+                    is_(u'science'))
+
+        transaction.commit()
+        assert_that(entries, does_not(has_key(registration_id)))
+        index = get_rule_index(registration_id)
+        assert_that(index.get_curriculum(u'school1', u'6-8', COURSE_NTIID2),
+                    none())
+
+    def test_session_index(self):
+        entries = _session_index_cache._get_entries()
+        course = resolve_session_course(REGISTRATION_DS_ID, u'June 1-5', u'math')
+        assert_that(course, is_(COURSE_NTIID))
+        assert_that(entries, does_not(has_key(self.registration_id)))
+
+        transaction.commit()
+        resolve_session_course(REGISTRATION_DS_ID, u'June 1-5', u'math')
+        assert_that(entries, has_key(self.registration_id))
+
+        store_registration_sessions(REGISTRATION_DS_ID, SESSIONS[1:])
+        course = resolve_session_course(REGISTRATION_DS_ID, u'June 1-5', u'math')
+        assert_that(course, none())
+        transaction.commit()
+        assert_that(entries, does_not(has_key(self.registration_id)))
+
+    def test_survey_questions(self):
+        user = MockUser(1001)
+        entries = _survey_questions_cache._get_entries()
+        self.register(user)
+        transaction.commit()
+        assert_that(get_all_survey_questions(REGISTRATION_DS_ID), has_length(0))
+        assert_that(entries, has_key(self.registration_id))
+
+        store_registration_survey_data(user, datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'1',
+                                       {u'q1': u'yes', u'q2': [1, 2]})
+        assert_that(get_all_survey_questions(REGISTRATION_DS_ID),
+                    contains_inanyorder(u'q1', u'q2'))
+        transaction.commit()
+        assert_that(entries, does_not(has_key(self.registration_id)))
+        assert_that(get_all_survey_questions(REGISTRATION_DS_ID),
+                    contains_inanyorder(u'q1', u'q2'))
+
+    def test_versions(self):
+        registration_id = self.registration_id
+        rules_version = _get_rules_version(registration_id)
+        store_registration_rules(REGISTRATION_DS_ID, RULES)
+        store_registration_rules(REGISTRATION_DS_ID, RULES, diff=True)
+        append_registration_rules(REGISTRATION_DS_ID, ())
+        assert_that(_get_rules_version(registration_id),
+                    is_(rules_version + 3))
+
+        sessions_version = _get_sessions_version(registration_id)
+        store_registration_sessions(REGISTRATION_DS_ID, SESSIONS)
+        assert_that(_get_sessions_version(registration_id),
+                    is_(sessions_version + 1))
+
+        user = MockUser(1001)
+        self.register(user)
+        surveys_version = _get_surveys_version(registration_id)
+        store_registration_survey_data(user, datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'1', {u'q1': u'yes'})
+        stored_version = _get_surveys_version(registration_id)
+        assert_that(stored_version[:2], is_((surveys_version[0], 1)))
+        delete_user_registrations(user, REGISTRATION_DS_ID, bulk=True)
+        assert_that(_get_surveys_version(registration_id),
+                    is_((surveys_version[0] + 1, 0, None)))
+
+    def test_changed_elsewhere(self):
+        registration_id = self.registration_id
+        transaction.commit()
+        get_rule_index(registration_id)
+        entries = _rule_index_cache._get_entries()
+        # Another process re-stores the rules; after a truncate the new
+        # rows may reuse the same ids, so only the version tells.
+        self.session.query(RegistrationEnrollmentRules).filter(
+            RegistrationEnrollmentRules.registration_id == registration_id
+        ).update({RegistrationEnrollmentRules.curriculum: u'art'},
+                 synchronize_session=False)
+        _increment_version(registration_id, Registrations.rules_version)
+        transaction.commit()
+
+        # Not rechecked within the interval.
+        index = get_rule_index(registration_id)
+        assert_that(index.get_curriculum(u'school1', u'6-8', COURSE_NTIID2),
+                    is_(u'science'))
+        entries[registration_id].checked = 0
+        index = get_rule_index(registration_id)
+        assert_that(index.get_curriculum(u'school1', u'6-8', COURSE_NTIID2),
+                    is_(u'art'))
+
+
+class TestSurveyBatch(RegistrationTestBase):
+
+    def test_batch_outcomes(self):
+        user1, user2 = MockUser(1001), MockUser(1002)
+        self.register(user1)
+        record = get_user_registrations(user1, REGISTRATION_DS_ID)[0]
+        assert_that(record.survey_submission, has_length(0))
+
+        now = datetime.utcnow()
+        items = [(user1, now, None, u'1', {u'q1': u'yes', u'q2': [1, 2]}),
+                 (user2, now, None, u'1', {u'q1': u'no'}),
+                 (user1, now, None, u'1', {u'q1': u'no'})]
+        result = store_registration_survey_data_batch(REGISTRATION_DS_ID, items)
+        assert_that(result, is_([STORED, NOT_REGISTERED, DUPLICATE]))
+        result = store_registration_survey_data_batch(REGISTRATION_DS_ID, items[:1])
+        assert_that(result, is_([DUPLICATE]))
+        result = store_registration_survey_data_batch(u'unknown', items[:1])
+        assert_that(result, is_([NOT_REGISTERED]))
+
+        # Loaded registrations see the bulk inserted survey.
+        survey = record.survey_submission[0]
+        assert_that(survey.survey_version, is_(u'1'))
+        assert_that({x.question_id: x.response for x in survey.details},
+                    is_({u'q1': u'yes', u'q2': [1, 2]}))
+
+    def test_single(self):
+        user1 = MockUser(1001)
+        with self.assertRaises(NoUserRegistrationException):
+            store_registration_survey_data(user1, datetime.utcnow(), None,
+                                           REGISTRATION_DS_ID, u'1', {})
+        self.register(user1)
+        store_registration_survey_data(user1, datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'1', {u'q1': 1})
+        with self.assertRaises(DuplicateRegistrationSurveyException):
+            store_registration_survey_data(user1, datetime.utcnow(), None,
+                                           REGISTRATION_DS_ID, u'1', {u'q1': 1})
+
+
+class TestStoreDiff(RegistrationTestBase):
+
+    def test_rules(self):
+        rules = RULES[:2] + (Rule(u'school3', u'K-5', u'art', COURSE_NTIID),)
+        result = store_registration_rules(REGISTRATION_DS_ID, rules, diff=True)
+        assert_that(result, is_(StoreDiffResult(1, 1, 2)))
+        result = store_registration_rules(REGISTRATION_DS_ID, rules, diff=True)
+        assert_that(result, is_(StoreDiffResult(0, 0, 3)))
+        stored = get_registration_rules(REGISTRATION_DS_ID)
+        assert_that([x.school for x in stored],
+                    contains_inanyorder(u'school1', u'school1', u'school3'))
+        index = get_rule_index(get_registration(REGISTRATION_DS_ID).registration_id)
+        assert_that(index.get_curriculum(u'school3', u'K-5', COURSE_NTIID),
+                    is_(u'art'))
+        assert_that(index.get_curriculum(u'school2', u'K-5', COURSE_NTIID),
+                    none())
+
+        # Duplicate rules are kept as given.
+        rules = rules + rules[:1]
+        result = store_registration_rules(REGISTRATION_DS_ID, rules, diff=True)
+        assert_that(result, is_(StoreDiffResult(1, 0, 3)))
+
+    def test_sessions(self):
+        sessions = (SESSIONS[0], Session(u'July 1-5', u'math', COURSE_NTIID))
+        result = store_registration_sessions(REGISTRATION_DS_ID, sessions,
+                                             diff=True)
+        assert_that(result, is_(StoreDiffResult(1, 1, 1)))
+        stored = get_registration_sessions(REGISTRATION_DS_ID)
+        assert_that([x.session_range for x in stored],
+                    contains_inanyorder(u'June 1-5', u'July 1-5'))
+        result = store_registration_sessions(REGISTRATION_DS_ID, (), diff=True)
+        assert_that(result, is_(StoreDiffResult(0, 2, 0)))
+        assert_that(get_registration_sessions(REGISTRATION_DS_ID), none())
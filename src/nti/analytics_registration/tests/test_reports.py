@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import has_length
+from hamcrest import assert_that
+
+import os
+import shutil
+import tempfile
+
+from datetime import datetime
+
+from nti.analytics_database import Base
+
+from nti.analytics_registration.database.registration import store_registration_rules
+from nti.analytics_registration.database.registration import store_registration_survey_data
+
+from nti.analytics_registration.reports import REPORT_COLUMNS
+
+from nti.analytics_registration.reports import run_registration_reports
+
+from nti.analytics_registration.tests import RULES
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import RegistrationTestBase
+
+EMPTY_REGISTRATION_DS_ID = u'tag:nextthought.com,2011-10:NTI-registration-empty'
+
+_temp_dir = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(_temp_dir)
+
+
+class TestRegistrationReports(RegistrationTestBase):
+
+    # Worker processes open their own connections.
+    dburi = 'sqlite:///%s' % os.path.join(_temp_dir, 'analytics.db')
+
+    def setUp(self):
+        super(TestRegistrationReports, self).setUp()
+        self.users = [MockUser(x) for x in range(1001, 1006)]
+        for user in self.users:
+            self.register(user)
+        store_registration_survey_data(self.users[0], datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'1',
+                                       {u'q1': u'yes', u'q2': [1, 2]})
+        store_registration_survey_data(self.users[3], datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'2',
+                                       {u'q1': u'no'})
+        store_registration_rules(EMPTY_REGISTRATION_DS_ID, RULES)
+        self.commit()
+
+    def tearDown(self):
+        self.session.close()
+        Base.metadata.drop_all(self.db.engine)
+        super(TestRegistrationReports, self).tearDown()
+
+    def _run(self, processes):
+        return run_registration_reports((REGISTRATION_DS_ID,
+                                         EMPTY_REGISTRATION_DS_ID,
+                                         u'unknown'),
+                                        processes=processes,
+                                        chunk_size=2,
+                                        dburi=self.dburi)
+
+    def test_reports(self):
+        result = self._run(1)
+        # The merged output does not depend on the number of workers.
+        assert_that(self._run(2), is_(result))
+
+        assert_that(list(result),
+                    is_([REGISTRATION_DS_ID, EMPTY_REGISTRATION_DS_ID]))
+        assert_that(result[EMPTY_REGISTRATION_DS_ID], is_((REPORT_COLUMNS, [])))
+
+        columns, rows = result[REGISTRATION_DS_ID]
+        assert_that(columns, is_(REPORT_COLUMNS + (u'q1', u'q2')))
+        assert_that(rows, has_length(5))
+        assert_that([x[0] for x in rows], is_([x.username for x in self.users]))
+        assert_that(rows[0][-3:], is_((u'1', u'yes', u'1, 2')))
+        assert_that(rows[1][-3:], is_(('', '', '')))
+        assert_that(rows[3][-3:], is_((u'2', u'no', '')))
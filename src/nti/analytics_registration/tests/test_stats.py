@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import is_not
+from hamcrest import assert_that
+
+from datetime import datetime
+
+from nti.analytics_registration.database.registration import store_registration_survey_data
+
+from nti.analytics_registration.stats import bulk_registration_stats
+from nti.analytics_registration.stats import _RegistrationStatsSource
+
+from nti.analytics_registration.tests import COURSE_NTIID
+from nti.analytics_registration.tests import COURSE_NTIID2
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import MockCatalogEntry
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.analytics_registration.tests import registration_data
+
+
+def _stats_dict(stats):
+    return None if stats is None else dict(stats.__dict__)
+
+
+class TestRegistrationStats(RegistrationTestBase):
+
+    def setUp(self):
+        super(TestRegistrationStats, self).setUp()
+        self.user1 = MockUser(1001)
+        self.user2 = MockUser(1002)
+        self.user3 = MockUser(1003)
+        self.register(self.user1)
+        self.register(self.user2,
+                      registration_data(grade_teaching=u'6-8',
+                                        course_ntiid=COURSE_NTIID2,
+                                        session_range=u'June 8-12'))
+        store_registration_survey_data(self.user1, datetime.utcnow(), None,
+                                       REGISTRATION_DS_ID, u'1',
+                                       {u'q1': u'yes', u'q 2': [1, 2]})
+        self.users = (self.user1, self.user2, self.user3)
+
+    def _get_stats(self, course):
+        result = {}
+        for user in self.users:
+            source = _RegistrationStatsSource(user, course)
+            result[user] = (_stats_dict(source.RegistrationStats),
+                            _stats_dict(source.RegistrationSurveyStats))
+        return result
+
+    def test_bulk_matches_per_user(self):
+        for course in (None, MockCatalogEntry(COURSE_NTIID)):
+            expected = self._get_stats(course)
+            with bulk_registration_stats(course=course, users=self.users):
+                assert_that(self._get_stats(course), is_(expected))
+
+        stats = self._get_stats(None)
+        assert_that(stats[self.user1][0]['school'], is_(u'school1'))
+        assert_that(stats[self.user1][1]['q_2'], is_(u'1, 2'))
+        assert_that(stats[self.user2][0], is_not(none()))
+        assert_that(stats[self.user2][1], none())
+        assert_that(stats[self.user3], is_((None, None)))
+
+    def test_bulk_other_course(self):
+        course = MockCatalogEntry(COURSE_NTIID2)
+        expected = self._get_stats(course)
+        assert_that(expected[self.user1], is_((None, None)))
+        # Stats built without a course filter are not used for a course.
+        with bulk_registration_stats(users=self.users):
+            assert_that(self._get_stats(course), is_(expected))
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import is_not
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import greater_than_or_equal_to
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from datetime import datetime
+
+import transaction
+
+from zope.interface.verify import verifyObject
+
+from nti.analytics_registration import submissions
+
+from nti.analytics_registration.database.registration import STORED
+from nti.analytics_registration.database.registration import INVALID
+from nti.analytics_registration.database.registration import NOT_REGISTERED
+
+from nti.analytics_registration.database.registration import get_user_registrations
+from nti.analytics_registration.database.registration import get_registration_status
+from nti.analytics_registration.database.registration import store_registration_rules
+
+from nti.analytics_registration.exceptions import NoUserRegistrationException
+from nti.analytics_registration.exceptions import InvalidCourseMappingException
+from nti.analytics_registration.exceptions import DuplicateUserRegistrationException
+from nti.analytics_registration.exceptions import DuplicateRegistrationSurveyException
+
+from nti.analytics_registration.interfaces import IRegistrationSubmissionQueue
+
+from nti.analytics_registration.submissions import FAILED
+from nti.analytics_registration.submissions import SURVEY
+from nti.analytics_registration.submissions import REGISTRATION
+from nti.analytics_registration.submissions import SQLiteSubmissionQueue
+
+from nti.analytics_registration.submissions import drain_submissions
+from nti.analytics_registration.submissions import queue_registration_data
+from nti.analytics_registration.submissions import queue_registration_survey_data
+
+from nti.analytics_registration.tests import RULES
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.analytics_registration.tests import registration_data
+
+
+class TestSQLiteSubmissionQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'submissions.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_queue(self):
+        queue = SQLiteSubmissionQueue(self.path)
+        assert_that(verifyObject(IRegistrationSubmissionQueue, queue),
+                    is_(True))
+        assert_that(queue.depth(), is_(0))
+        assert_that(queue.lag(), is_(0))
+        assert_that(queue.peek(10), has_length(0))
+
+        payload = {'school': u'school1', 'timestamp': 1000}
+        assert_that(queue.enqueue(REGISTRATION, u'reg1', u'user1', payload),
+                    is_(True))
+        assert_that(queue.enqueue(SURVEY, u'reg1', u'user1', {'data': {}}),
+                    is_(True))
+        assert_that(queue.enqueue(REGISTRATION, u'reg1', u'user2', payload),
+                    is_(True))
+        # Duplicates of pending submissions are rejected.
+        assert_that(queue.enqueue(REGISTRATION, u'reg1', u'user1', payload),
+                    is_(False))
+        assert_that(queue.is_pending(REGISTRATION, u'reg1', u'user1'),
+                    is_(True))
+        assert_that(queue.is_pending(SURVEY, u'reg1', u'user2'), is_(False))
+        assert_that(queue.depth(), is_(3))
+        assert_that(queue.lag(), greater_than_or_equal_to(0))
+
+        pending = queue.peek(2)
+        assert_that(pending, has_length(2))
+        assert_that(pending[0][1:], is_((REGISTRATION, u'reg1', u'user1', payload)))
+        assert_that(pending[1][1], is_(SURVEY))
+
+        queue.ack(x[0] for x in pending)
+        assert_that(queue.depth(), is_(1))
+        assert_that(queue.is_pending(REGISTRATION, u'reg1', u'user1'),
+                    is_(False))
+
+        # The queue is durable.
+        queue = SQLiteSubmissionQueue(self.path)
+        pending = queue.peek(10)
+        assert_that(pending, has_length(1))
+        assert_that(pending[0][3], is_(u'user2'))
+        assert_that(pending[0][4], is_not(none()))
+
+    def test_fail(self):
+        queue = SQLiteSubmissionQueue(self.path, max_attempts=2)
+        payload = {'data': {}}
+        queue.enqueue(SURVEY, u'reg1', u'user1', payload)
+        queue.enqueue(SURVEY, u'reg1', u'user2', payload)
+        pending = queue.peek(10)
+        queue.fail([pending[0][0]])
+        assert_that(queue.peek(10), has_length(2))
+        queue.fail([pending[0][0]])
+        # Failed submissions are set aside.
+        assert_that(queue.peek(10), has_length(1))
+        assert_that(queue.depth(), is_(1))
+        assert_that(queue.failed(), is_(1))
+        assert_that(queue.is_pending(SURVEY, u'reg1', u'user1'), is_(False))
+        # And may be submitted again.
+        assert_that(queue.enqueue(SURVEY, u'reg1', u'user1', payload),
+                    is_(True))
+        assert_that(queue.depth(), is_(2))
+        assert_that(queue.failed(), is_(0))
+
+
+class _BrokenQueue(SQLiteSubmissionQueue):
+
+    def enqueue(self, kind, registration_ds_id, username, payload):
+        if username == u'user1001':
+            raise sqlite3.OperationalError('database is locked')
+        return super(_BrokenQueue, self).enqueue(kind, registration_ds_id,
+                                                 username, payload)
+
+
+def _run(func):
+    return func()
+
+
+def _get_user(username):
+    return MockUser(int(username[len('user'):]))
+
+
+class TestQueueSubmissions(RegistrationTestBase):
+
+    def setUp(self):
+        super(TestQueueSubmissions, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        path = os.path.join(self.temp_dir, 'submissions.db')
+        self.queue = SQLiteSubmissionQueue(path, max_attempts=2)
+        self._old_get_user = submissions._get_user
+        submissions._get_user = _get_user
+
+    def tearDown(self):
+        submissions._get_user = self._old_get_user
+        shutil.rmtree(self.temp_dir)
+        super(TestQueueSubmissions, self).tearDown()
+
+    def _queue_registration(self, user, data=None, timestamp=None):
+        queue_registration_data(self.queue, user, timestamp or datetime.utcnow(),
+                                REGISTRATION_DS_ID, data or registration_data())
+
+    def _queue_survey(self, user):
+        queue_registration_survey_data(self.queue, user, datetime.utcnow(),
+                                       REGISTRATION_DS_ID, u'1', {u'q1': u'yes'})
+
+    def test_queue_on_commit(self):
+        user1, user2 = MockUser(1001), MockUser(1002)
+        with self.assertRaises(InvalidCourseMappingException):
+            self._queue_registration(user1, registration_data(school=u'unknown'))
+
+        self._queue_registration(user1)
+        self._queue_survey(user1)
+        # Nothing is queued until the transaction commits.
+        assert_that(self.queue.depth(), is_(0))
+        with self.assertRaises(DuplicateUserRegistrationException):
+            self._queue_registration(user1)
+        with self.assertRaises(DuplicateRegistrationSurveyException):
+            self._queue_survey(user1)
+        transaction.commit()
+        assert_that(self.queue.depth(), is_(2))
+
+        # Pending submissions are duplicates.
+        with self.assertRaises(DuplicateUserRegistrationException):
+            self._queue_registration(user1)
+        with self.assertRaises(DuplicateRegistrationSurveyException):
+            self._queue_survey(user1)
+
+        # Aborted submissions are not queued.
+        self._queue_registration(user2)
+        transaction.abort()
+        assert_that(self.queue.depth(), is_(2))
+        assert_that(self.queue.is_pending(REGISTRATION, REGISTRATION_DS_ID,
+                                          user2.username), is_(False))
+
+    def test_queue_stored(self):
+        user1, user2 = MockUser(1001), MockUser(1002)
+        with self.assertRaises(NoUserRegistrationException):
+            self._queue_survey(user1)
+        # Submissions already drained are duplicates.
+        self.register(user1)
+        with self.assertRaises(DuplicateUserRegistrationException):
+            self._queue_registration(user1)
+        self._queue_survey(user1)
+        transaction.commit()
+        drain_submissions(self.queue, runner=_run)
+        with self.assertRaises(DuplicateRegistrationSurveyException):
+            self._queue_survey(user1)
+        with self.assertRaises(NoUserRegistrationException):
+            self._queue_survey(user2)
+
+    def test_drain(self):
+        users = [MockUser(x) for x in range(1001, 1004)]
+        for user in users:
+            self._queue_registration(user)
+        self._queue_survey(users[0])
+        transaction.commit()
+
+        result = drain_submissions(self.queue, batch_size=2, runner=_run)
+        assert_that(result, is_({STORED: 2}))
+        assert_that(self.queue.depth(), is_(2))
+        result = drain_submissions(self.queue, runner=_run)
+        assert_that(result, is_({STORED: 2}))
+        assert_that(self.queue.depth(), is_(0))
+        assert_that(drain_submissions(self.queue, runner=_run), has_length(0))
+
+        assert_that(get_registration_status(users[0], REGISTRATION_DS_ID),
+                    is_((True, True)))
+        assert_that(get_registration_status(users[2], REGISTRATION_DS_ID),
+                    is_((True, False)))
+
+    def test_drain_failure(self):
+        users = [MockUser(x) for x in range(1001, 1004)]
+        for user in users:
+            self._queue_registration(user)
+        transaction.commit()
+
+        def _fail_user(username):
+            if username == users[1].username:
+                raise ValueError(username)
+            return _get_user(username)
+        submissions._get_user = _fail_user
+
+        # The failing submission does not hold up the others.
+        result = drain_submissions(self.queue, runner=_run)
+        assert_that(result, is_({STORED: 2, FAILED: 1}))
+        assert_that(self.queue.depth(), is_(1))
+        result = drain_submissions(self.queue, runner=_run)
+        assert_that(result, is_({FAILED: 1}))
+        assert_that(self.queue.depth(), is_(0))
+        assert_that(self.queue.failed(), is_(1))
+        assert_that(get_registration_status(users[1], REGISTRATION_DS_ID),
+                    is_((False, False)))
+
+    def test_drain_rejected(self):
+        user1, user2 = MockUser(1001), MockUser(1002)
+        self._queue_registration(user1)
+        self._queue_survey(user1)
+        self._queue_registration(user2, registration_data(school=u'school2'))
+        transaction.commit()
+        # The rules change before the submissions are drained.
+        store_registration_rules(REGISTRATION_DS_ID, RULES[2:])
+        transaction.commit()
+
+        # Rejected submissions are retried, then set aside.
+        result = drain_submissions(self.queue, runner=_run)
+        assert_that(result, is_({STORED: 1, INVALID: 1, NOT_REGISTERED: 1}))
+        assert_that(self.queue.depth(), is_(2))
+        result = drain_submissions(self.queue, runner=_run)
+        assert_that(result, is_({INVALID: 1, NOT_REGISTERED: 1}))
+        assert_that(self.queue.depth(), is_(0))
+        assert_that(self.queue.failed(), is_(2))
+
+    def test_timestamp(self):
+        user = MockUser(1001)
+        timestamp = datetime(2017, 6, 1, 12, 30, 15, 123456)
+        self._queue_registration(user, timestamp=timestamp)
+        transaction.commit()
+        drain_submissions(self.queue, runner=_run)
+        record = get_user_registrations(user, REGISTRATION_DS_ID)[0]
+        assert_that(record.timestamp, is_(timestamp))
+
+    def test_enqueue_error(self):
+        self.queue = _BrokenQueue(self.queue.path, max_attempts=2)
+        user1, user2 = MockUser(1001), MockUser(1002)
+        self._queue_registration(user1)
+        self._queue_registration(user2)
+        # The error is logged, and does not lose the other submissions.
+        transaction.commit()
+        assert_that(self.queue.depth(), is_(1))
+        assert_that(self.queue.is_pending(REGISTRATION, REGISTRATION_DS_ID,
+                                          user2.username), is_(True))
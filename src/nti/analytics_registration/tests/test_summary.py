@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import has_length
+from hamcrest import assert_that
+
+from datetime import datetime
+
+from nti.analytics_registration.database.registration import RegistrationSummary
+from nti.analytics_registration.database.registration import RegistrationSurveyDetails
+from nti.analytics_registration.database.registration import RegistrationSurveysTaken
+
+from nti.analytics_registration.database.registration import get_user_registrations
+from nti.analytics_registration.database.registration import get_registration_summary
+from nti.analytics_registration.database.registration import delete_user_registrations
+from nti.analytics_registration.database.registration import rebuild_registration_summary
+from nti.analytics_registration.database.registration import store_registration_data_batch
+from nti.analytics_registration.database.registration import store_registration_survey_data
+
+from nti.analytics_registration.tests import COURSE_NTIID
+from nti.analytics_registration.tests import COURSE_NTIID2
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import MockUser
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.analytics_registration.tests import registration_data
+
+
+class TestRegistrationSummary(RegistrationTestBase):
+
+    def setUp(self):
+        super(TestRegistrationSummary, self).setUp()
+        self.users = [MockUser(x) for x in range(1001, 1005)]
+        user1, user2, user3, user4 = self.users
+        self.register(user1)
+        self.register(user2)
+        self.register(user3, registration_data(school=u'school2',
+                                               session_range=u'June 8-12'))
+        # Batch stores maintain the summary too.
+        items = [(user4, datetime.utcnow(), None,
+                  registration_data(grade_teaching=u'6-8',
+                                    course_ntiid=COURSE_NTIID2,
+                                    session_range=u'June 8-12'))]
+        store_registration_data_batch(REGISTRATION_DS_ID, items)
+        for user in (user1, user2):
+            store_registration_survey_data(user, datetime.utcnow(), None,
+                                           REGISTRATION_DS_ID, u'1',
+                                           {u'q1': u'yes'})
+
+    def _assert_rebuilt(self):
+        # The maintained summary matches one recomputed from scratch.
+        expected = get_registration_summary(REGISTRATION_DS_ID)
+        rebuild_registration_summary(REGISTRATION_DS_ID, chunk_size=1)
+        assert_that(get_registration_summary(REGISTRATION_DS_ID),
+                    is_(expected))
+        rebuild_registration_summary()
+        assert_that(get_registration_summary(REGISTRATION_DS_ID),
+                    is_(expected))
+
+    def test_insert(self):
+        summary = get_registration_summary(REGISTRATION_DS_ID)
+        assert_that(summary,
+                    is_([(u'school1', u'6-8', u'June 8-12', u'science', 1),
+                         (u'school1', u'K-5', u'June 1-5', u'math', 2),
+                         (u'school2', u'K-5', u'June 8-12', u'math', 1)]))
+        assert_that(get_registration_summary(u'unknown'), is_([]))
+        self._assert_rebuilt()
+
+    def test_rebuild(self):
+        self.session.query(RegistrationSummary).delete()
+        assert_that(get_registration_summary(REGISTRATION_DS_ID),
+                    has_length(0))
+        rebuild_registration_summary(REGISTRATION_DS_ID, chunk_size=2)
+        assert_that(get_registration_summary(REGISTRATION_DS_ID),
+                    has_length(3))
+
+    def test_delete(self):
+        user1 = self.users[0]
+        result = delete_user_registrations(user1, REGISTRATION_DS_ID)
+        assert_that(result, has_length(1))
+        assert_that(result[0][1], is_(COURSE_NTIID))
+        self.session.flush()
+        summary = get_registration_summary(REGISTRATION_DS_ID)
+        assert_that(summary[1], is_((u'school1', u'K-5', u'June 1-5', u'math', 1)))
+        assert_that(get_user_registrations(user1, REGISTRATION_DS_ID),
+                    has_length(0))
+        self._assert_rebuilt()
+
+    def test_bulk_delete(self):
+        user1, user2 = self.users[:2]
+        result = delete_user_registrations(user1, REGISTRATION_DS_ID, bulk=True)
+        assert_that(result, has_length(1))
+        assert_that(result[0][1], is_(COURSE_NTIID))
+        # Surveys and their details are removed with the registration.
+        assert_that(self.session.query(RegistrationSurveysTaken).count(), is_(1))
+        assert_that(self.session.query(RegistrationSurveyDetails).count(), is_(1))
+        summary = get_registration_summary(REGISTRATION_DS_ID)
+        assert_that(summary[1], is_((u'school1', u'K-5', u'June 1-5', u'math', 1)))
+        self._assert_rebuilt()
+
+        # Emptied groups are not reported.
+        delete_user_registrations(user2, REGISTRATION_DS_ID, bulk=True)
+        assert_that(get_registration_summary(REGISTRATION_DS_ID), has_length(2))
+        self._assert_rebuilt()
+
+        result = delete_user_registrations(registration_ds_id=REGISTRATION_DS_ID,
+                                           bulk=True)
+        assert_that(result, has_length(2))
+        assert_that(get_user_registrations(registration_ds_id=REGISTRATION_DS_ID),
+                    has_length(0))
+        assert_that(self.session.query(RegistrationSurveysTaken).count(), is_(0))
+        assert_that(get_registration_summary(REGISTRATION_DS_ID), has_length(0))
+        self._assert_rebuilt()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import assert_that
+
+from zope import component
+from zope import interface
+
+from zope.lifecycleevent.interfaces import IObjectAddedEvent
+from zope.lifecycleevent.interfaces import IObjectRemovedEvent
+
+from nti.analytics_registration import utils
+
+from nti.analytics_registration.utils import INSTRUCTOR_CACHE_TIMEOUT
+
+from nti.analytics_registration.utils import _collect_instructors
+from nti.analytics_registration.utils import get_all_course_instructors
+from nti.analytics_registration.utils import invalidate_course_instructors
+
+from nti.analytics_registration.tests import COURSE_NTIID
+from nti.analytics_registration.tests import COURSE_NTIID2
+from nti.analytics_registration.tests import REGISTRATION_DS_ID
+
+from nti.analytics_registration.tests import RegistrationTestBase
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.contenttypes.courses.interfaces import ICourseCatalog
+from nti.contenttypes.courses.interfaces import ICourseInstance
+from nti.contenttypes.courses.interfaces import ICourseRolesSynchronized
+
+COURSE_NTIID3 = u'tag:nextthought.com,2011-10:NTI-CourseInfo-course3'
+
+
+@interface.implementer(ICourseInstance)
+class MockCourse(object):
+
+    _p_jar = None
+
+    def __init__(self, *instructors):
+        self.instructors = set(instructors)
+
+
+@interface.implementer(ICourseCatalog)
+class MockCatalog(object):
+
+    def __init__(self, courses):
+        self.courses = courses
+
+    def iterCatalogEntries(self):
+        return iter(self.courses)
+
+
+class MockJar(object):
+
+    collections = 0
+
+    def cacheGC(self):
+        self.collections += 1
+
+
+class TestCourseInstructors(RegistrationTestBase):
+
+    def setUp(self):
+        super(TestCourseInstructors, self).setUp()
+        self.courses = {COURSE_NTIID: MockCourse(u'inst1'),
+                        COURSE_NTIID2: MockCourse(u'inst2'),
+                        COURSE_NTIID3: MockCourse(u'inst3')}
+        self.catalog = MockCatalog(list(self.courses.values()))
+        component.getGlobalSiteManager().registerUtility(self.catalog,
+                                                         ICourseCatalog)
+        self._old = (utils.get_course_instructors,
+                     utils.find_object_with_ntiid)
+        utils.get_course_instructors = lambda course: course.instructors
+        utils.find_object_with_ntiid = self.courses.get
+        invalidate_course_instructors()
+
+    def tearDown(self):
+        invalidate_course_instructors()
+        (utils.get_course_instructors,
+         utils.find_object_with_ntiid) = self._old
+        component.getGlobalSiteManager().unregisterUtility(self.catalog,
+                                                           ICourseCatalog)
+        super(TestCourseInstructors, self).tearDown()
+
+    def _expire(self):
+        cache = utils._instructors_cache
+        for key, (created, value) in list(cache.items()):
+            cache[key] = (created - INSTRUCTOR_CACHE_TIMEOUT - 1, value)
+
+    def test_cache(self):
+        result = get_all_course_instructors()
+        assert_that(result, is_({u'inst1', u'inst2', u'inst3'}))
+        # Callers get their own copy.
+        result.add(u'other')
+
+        # Cached until expired or invalidated.
+        self.courses[COURSE_NTIID].instructors.add(u'inst4')
+        assert_that(get_all_course_instructors(),
+                    is_({u'inst1', u'inst2', u'inst3'}))
+        self._expire()
+        assert_that(get_all_course_instructors(),
+                    is_({u'inst1', u'inst2', u'inst3', u'inst4'}))
+
+        self.courses[COURSE_NTIID].instructors.discard(u'inst4')
+        assert_that(get_all_course_instructors(), is_({u'inst1', u'inst2',
+                                                       u'inst3', u'inst4'}))
+        invalidate_course_instructors(self.courses[COURSE_NTIID], None)
+        assert_that(get_all_course_instructors(),
+                    is_({u'inst1', u'inst2', u'inst3'}))
+
+    def test_registration_courses(self):
+        # Only the courses the registration rules map to.
+        assert_that(get_all_course_instructors(REGISTRATION_DS_ID),
+                    is_({u'inst1', u'inst2'}))
+        assert_that(get_all_course_instructors(u'unknown'), is_(set()))
+        # Cached separately from the whole catalog.
+        assert_that(get_all_course_instructors(),
+                    is_({u'inst1', u'inst2', u'inst3'}))
+
+        del self.courses[COURSE_NTIID2]
+        assert_that(get_all_course_instructors(REGISTRATION_DS_ID),
+                    is_({u'inst1', u'inst2'}))
+        invalidate_course_instructors()
+        assert_that(get_all_course_instructors(REGISTRATION_DS_ID),
+                    is_({u'inst1'}))
+
+    def test_collect_instructors(self):
+        jar = MockJar()
+        courses = list(self.courses.values())
+        for course in courses:
+            course._p_jar = jar
+        result = _collect_instructors(courses, chunk_size=2)
+        assert_that(result, is_(frozenset((u'inst1', u'inst2', u'inst3'))))
+        assert_that(jar.collections, is_(1))
+
+
+class TestInstructorSubscribers(ApplicationLayerTest):
+
+    def test_subscribers(self):
+        gsm = component.getGlobalSiteManager()
+        required = {tuple(x.required) for x in gsm.registeredHandlers()
+                    if x.handler is invalidate_course_instructors}
+        assert_that(required,
+                    is_({(ICourseInstance, ICourseRolesSynchronized),
+                         (ICourseInstance, IObjectAddedEvent),
+                         (ICourseInstance, IObjectRemovedEvent)}))
@@ -8,27 +8,95 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import time
+
 from zope import component
 
+from nti.analytics_registration.database.registration import get_rule_index
+from nti.analytics_registration.database.registration import get_registration_id
+
 from nti.contenttypes.courses.interfaces import ICourseCatalog
 from nti.contenttypes.courses.interfaces import ICourseInstance
 
 from nti.contenttypes.courses.utils import get_course_instructors
 
+from nti.ntiids.ntiids import find_object_with_ntiid
+
+#: How long, in seconds, a cached instructor set is used. Courses added
+#: or removed and course roles synchronized in this process invalidate
+#: it sooner; other role changes are picked up on expiry.
+INSTRUCTOR_CACHE_TIMEOUT = 300
+
+#: The number of courses walked between object cache collections.
+INSTRUCTOR_CHUNK_SIZE = 500
+
+_instructors_cache = {}
+
 logger = __import__('logging').getLogger(__name__)
 
 
-def get_all_course_instructors():
+def _catalog_key(catalog):
+    oid = getattr(catalog, '_p_oid', None)
+    return oid if oid is not None else id(catalog)
+
+
+def _iter_catalog_courses(catalog):
+    for entry in catalog.iterCatalogEntries():
+        course = ICourseInstance(entry, None)
+        if course is not None:
+            yield course
+
+
+def _iter_registration_courses(registration_ds_id):
+    registration_id = get_registration_id(registration_ds_id)
+    if registration_id is None:
+        return
+    rule_index = get_rule_index(registration_id)
+    course_ntiids = set()
+    for by_course in rule_index.curricula.values():
+        course_ntiids.update(by_course)
+    for ntiid in sorted(course_ntiids):
+        course = ICourseInstance(find_object_with_ntiid(ntiid), None)
+        if course is not None:
+            yield course
+
+
+def _collect_instructors(courses, chunk_size=INSTRUCTOR_CHUNK_SIZE):
     """
-    Return the usernames of all instructors in all courses.
+    Walk the courses in chunks, releasing unused persistent objects
+    between chunks so a cold walk of a large catalog stays bounded.
     """
-    # May need to limit to only certain courses by registration id.
     result = set()
+    for idx, course in enumerate(courses, 1):
+        result.update(get_course_instructors(course))
+        jar = getattr(course, '_p_jar', None)
+        if idx % chunk_size == 0 and jar is not None:
+            jar.cacheGC()
+    return frozenset(result)
+
+
+def get_all_course_instructors(registration_ds_id=None):
+    """
+    Return the usernames of all instructors in all courses, or, given a
+    registration id, only in the courses its rules map to. Results are
+    cached per catalog.
+    """
     course_catalog = component.getUtility(ICourseCatalog)
-    for entry in course_catalog.iterCatalogEntries():
-        course = ICourseInstance(entry, None)
-        if course is None:
-            continue
-        instructors = get_course_instructors(course)
-        result.update(instructors)
-    return result
+    key = (_catalog_key(course_catalog), registration_ds_id)
+    cached = _instructors_cache.get(key)
+    now = time.time()
+    if cached is None or now - cached[0] > INSTRUCTOR_CACHE_TIMEOUT:
+        if registration_ds_id:
+            courses = _iter_registration_courses(registration_ds_id)
+        else:
+            courses = _iter_catalog_courses(course_catalog)
+        cached = _instructors_cache[key] = (now, _collect_instructors(courses))
+    return set(cached[1])
+
+
+def invalidate_course_instructors(*unused_args):
+    """
+    Drop all cached instructor sets. Subscribed to course role
+    synchronization and course added and removed events.
+    """
+    _instructors_cache.clear()